@@ -0,0 +1,115 @@
+"""
+Compares MQTT packet processing throughput of the MessageToDict path with the
+protobuf-native path.
+
+    python benchmarks/bench_decode.py --packets 20000
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import meshtastic
+from google.protobuf.json_format import MessageToDict
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+from meshtastic_prometheus_exporter.util import save_node_metadata_in_cache
+
+
+def make_payloads(count, nodes):
+    rng = random.Random(42)
+    payloads = []
+    for packet_id in range(1, count + 1):
+        sender = rng.choice(nodes)
+        packet = mesh_pb2.MeshPacket(
+            id=packet_id, to=0xFFFFFFFF, hop_limit=3, hop_start=3, rx_time=1
+        )
+        setattr(packet, "from", sender)
+        kind = rng.random()
+        if kind < 0.5:
+            telemetry = telemetry_pb2.Telemetry(time=1)
+            telemetry.device_metrics.battery_level = rng.randint(0, 101)
+            telemetry.device_metrics.voltage = 4.1
+            telemetry.device_metrics.channel_utilization = rng.random() * 100
+            telemetry.device_metrics.air_util_tx = rng.random() * 10
+            packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+            packet.decoded.payload = telemetry.SerializeToString()
+        elif kind < 0.6:
+            user = mesh_pb2.User(
+                id=f"!{sender:08x}",
+                long_name=f"Node {sender:08x}",
+                short_name=f"{sender & 0xFFFF:04x}",
+                hw_model="TBEAM",
+            )
+            packet.decoded.portnum = portnums_pb2.NODEINFO_APP
+            packet.decoded.payload = user.SerializeToString()
+        elif kind < 0.7:
+            neighbor_info = mesh_pb2.NeighborInfo(node_id=sender)
+            for neighbor in rng.sample(nodes, 5):
+                neighbor_info.neighbors.add(node_id=neighbor, snr=rng.random() * 10)
+            packet.decoded.portnum = portnums_pb2.NEIGHBORINFO_APP
+            packet.decoded.payload = neighbor_info.SerializeToString()
+        else:
+            packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+            packet.decoded.payload = b"hello mesh"
+        envelope = mqtt_pb2.ServiceEnvelope(
+            packet=packet, channel_id="LongFast", gateway_id="!deadbeef"
+        )
+        payloads.append(envelope.SerializeToString())
+    return payloads
+
+
+def dict_path(topic, payload):
+    """on_message before the protobuf-native path, as used by pubsub interfaces"""
+    envelope = mqtt_pb2.ServiceEnvelope.FromString(payload)
+    exporter.logger.debug(
+        f"Received UTF-8 payload `{MessageToDict(envelope)}` from `{topic}` topic"
+    )
+    packet = MessageToDict(envelope.packet)
+    # Decode the payload the way meshtastic.mesh_interface does for pubsub
+    protocol = meshtastic.protocols.get(envelope.packet.decoded.portnum)
+    if protocol and protocol.protobufFactory:
+        packet["decoded"][protocol.name] = MessageToDict(
+            protocol.protobufFactory.FromString(envelope.packet.decoded.payload)
+        )
+    exporter.on_native_message(packet, None)
+
+
+def run(name, process, payloads):
+    exporter.flood_cache = DedupWindow(ttl=600, maxsize=len(payloads))
+    started = time.perf_counter()
+    for payload in payloads:
+        process("msh/EU_433/2/e/LongFast/!deadbeef", payload)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:<8} {len(payloads) / elapsed:10.0f} packets/s  "
+        f"{elapsed / len(payloads) * 10**6:7.1f} µs/packet"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument("--nodes", type=int, default=500)
+    args = parser.parse_args()
+
+    exporter.logger.setLevel(logging.WARNING)
+    exporter.configure_metrics_backend()
+    nodes = list(range(0x10000000, 0x10000000 + args.nodes))
+    for node in nodes:
+        save_node_metadata_in_cache(
+            exporter.node_cache,
+            node,
+            {"longName": f"Node {node:08x}", "shortName": "node", "hwModel": "TBEAM"},
+        )
+    payloads = make_payloads(args.packets, nodes)
+
+    run("dict", dict_path, payloads)
+    run("protobuf", exporter.on_mqtt_payload, payloads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Decryption throughput over the encrypted MeshPackets of a capture, alone and
+as part of the whole MQTT processing path.
+
+    python benchmarks/bench_decrypt.py benchmarks/captures/encrypted.mpcap --keys LongFast=AQ==
+"""
+
+import argparse
+import logging
+import time
+
+from meshtastic.protobuf import mqtt_pb2
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter.capture import read_capture
+from meshtastic_prometheus_exporter.decrypt import (
+    decrypt_mesh_packet,
+    parse_channel_keys,
+)
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+from meshtastic_prometheus_exporter.replay import replay
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("capture")
+    parser.add_argument("--keys", default="LongFast=AQ==", help="CHANNEL_KEYS")
+    parser.add_argument("--loops", type=int, default=20)
+    args = parser.parse_args()
+
+    exporter.logger.setLevel(logging.WARNING)
+    exporter.configure_metrics_backend()
+    channel_keys = parse_channel_keys(args.keys)
+    records = list(read_capture(args.capture))
+    packets = [
+        mqtt_pb2.ServiceEnvelope.FromString(payload).packet for _, _, payload in records
+    ]
+    packets = [packet for packet in packets if packet.HasField("encrypted")]
+
+    started = time.perf_counter()
+    decrypted = 0
+    for _ in range(args.loops):
+        for packet in packets:
+            copy = type(packet)()
+            copy.CopyFrom(packet)
+            decrypted += decrypt_mesh_packet(copy, channel_keys) is not None
+    elapsed = time.perf_counter() - started
+    print(
+        f"decrypt   {len(packets) * args.loops / elapsed:10.0f} packets/s  "
+        f"({decrypted // args.loops}/{len(packets)} decrypted)"
+    )
+
+    for name, keys in (("without keys", {}), ("with keys", channel_keys)):
+        exporter.channel_keys = keys
+        elapsed = 0
+        for _ in range(args.loops):
+            exporter.flood_cache = DedupWindow(ttl=600, maxsize=len(records))
+            elapsed += sum(replay(records)) / 10**9
+        print(
+            f"replay {name:<13} {len(records) * args.loops / elapsed:10.0f} messages/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Simulates an MQTT flood and compares node-name hit rate and memory use of
+the exporter's DedupWindow and NodeRegistry against the single TTLCache that
+used to hold dedup keys and node metadata together.
+
+    python benchmarks/bench_node_cache.py --rate 50000 --minutes 30
+"""
+
+import argparse
+import random
+import tracemalloc
+
+from cachetools import TTLCache
+
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+from meshtastic_prometheus_exporter.nodedb import NodeRegistry
+from meshtastic_prometheus_exporter.util import (
+    get_decoded_node_metadata_from_cache,
+    save_node_metadata_in_cache,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SharedLayout:
+    """Dedup keys and node metadata in one TTLCache, as before DedupWindow."""
+
+    def __init__(self, clock, args):
+        self.cache = TTLCache(maxsize=10000, ttl=args.flood_expire_time, timer=clock)
+        self.node_cache = self.cache
+
+    def seen(self, node, packet_id):
+        # String keys, as packet ids and node numbers share one keyspace
+        key = str(packet_id)
+        if key in self.cache:
+            return True
+        self.cache[key] = True
+        return False
+
+    def known(self, node):
+        long_name = get_decoded_node_metadata_from_cache(self.cache, node, "long_name")
+        return long_name != "unknown"
+
+    def evictions(self):
+        return None
+
+
+class ExporterLayout:
+    """flood_cache and node_cache as created by the exporter by default."""
+
+    def __init__(self, clock, args):
+        self.flood_cache = DedupWindow(
+            ttl=args.flood_expire_time, maxsize=args.flood_cache_maxsize, timer=clock
+        )
+        self.node_cache = NodeRegistry(
+            maxsize=args.node_cache_maxsize, ttl=args.node_cache_ttl, timer=clock
+        )
+
+    def seen(self, node, packet_id):
+        return self.flood_cache.seen(node, packet_id)
+
+    def known(self, node):
+        return self.node_cache.labels(node) is not None
+
+    def evictions(self):
+        return self.flood_cache.evictions
+
+
+def node_info(node):
+    return {
+        "longName": f"Node {node:08x}",
+        "shortName": f"{node & 0xFFFF:04x}",
+        "hwModel": "TBEAM",
+    }
+
+
+def simulate(layout, clock, nodes, rate, minutes, nodeinfo_interval):
+    rng = random.Random(42)
+    # Every node is known at start, as if a device NodeDB had just been loaded
+    for node in nodes:
+        save_node_metadata_in_cache(layout.node_cache, node, node_info(node))
+
+    nodeinfo_probability = len(nodes) / (nodeinfo_interval / 60) / rate
+    hits = lookups = 0
+    step = 60 / rate
+    for _ in range(rate * minutes):
+        clock.now += step
+        packet_id = rng.getrandbits(32)
+        node = rng.choice(nodes)
+
+        if layout.seen(node, packet_id):
+            continue
+
+        if rng.random() < nodeinfo_probability:
+            save_node_metadata_in_cache(layout.node_cache, node, node_info(node))
+            continue
+
+        lookups += 1
+        if layout.known(node):
+            hits += 1
+
+    return hits / lookups if lookups else 0.0
+
+
+def run(name, make_layout, args):
+    nodes = list(range(0x10000000, 0x10000000 + args.nodes))
+    clock = Clock()
+
+    tracemalloc.start()
+    layout = make_layout(clock, args)
+    hit_rate = simulate(
+        layout,
+        clock,
+        nodes,
+        args.rate,
+        args.minutes,
+        args.nodeinfo_interval,
+    )
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    evictions = layout.evictions()
+    print(
+        f"{name:<8} node name hit rate {hit_rate:7.2%}  "
+        f"memory {current / 2**20:7.2f} MiB (peak {peak / 2**20:7.2f} MiB)"
+        + (f"  dedup evictions {evictions}" if evictions is not None else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=int, default=50000, help="packets/min")
+    parser.add_argument("--minutes", type=int, default=30)
+    parser.add_argument("--nodes", type=int, default=3000)
+    parser.add_argument(
+        "--nodeinfo-interval",
+        type=int,
+        default=3 * 3600,
+        help="seconds between NodeInfo broadcasts of a single node",
+    )
+    parser.add_argument("--flood-expire-time", type=int, default=10 * 60)
+    parser.add_argument("--flood-cache-maxsize", type=int, default=50000)
+    parser.add_argument("--node-cache-ttl", type=int, default=3600 * 72)
+    parser.add_argument("--node-cache-maxsize", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(
+        f"{args.rate} packets/min for {args.minutes} min, {args.nodes} nodes, "
+        f"NodeInfo every {args.nodeinfo_interval}s per node"
+    )
+
+    run("shared", SharedLayout, args)
+    run("exporter", ExporterLayout, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures how long it takes to load the persisted node registry on startup and
+how much a registry write costs on the packet processing path.
+
+    python benchmarks/bench_nodedb.py --nodes 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from meshtastic_prometheus_exporter.nodedb import NodeRegistry, NodeStore
+from meshtastic_prometheus_exporter.util import save_node_metadata_in_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=100000)
+    args = parser.parse_args()
+
+    ttl = 3600 * 72
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nodedb.sqlite")
+
+        registry = NodeRegistry(
+            maxsize=args.nodes, ttl=ttl, store=NodeStore(path, ttl=ttl)
+        )
+        started = time.perf_counter()
+        for node in range(args.nodes):
+            save_node_metadata_in_cache(
+                registry,
+                node,
+                {
+                    "longName": f"Node {node:08x}",
+                    "shortName": f"{node & 0xFFFF:04x}",
+                    "hwModel": "TBEAM",
+                },
+            )
+        elapsed = time.perf_counter() - started
+        print(f"save:  {elapsed / args.nodes * 10**6:.2f} µs per node")
+
+        started = time.perf_counter()
+        registry.store.close()
+        print(f"flush: {time.perf_counter() - started:.3f}s for {args.nodes} nodes")
+
+        restarted = NodeRegistry(
+            maxsize=args.nodes, ttl=ttl, store=NodeStore(path, ttl=ttl)
+        )
+        started = time.perf_counter()
+        loaded = restarted.load()
+        print(f"load:  {time.perf_counter() - started:.3f}s for {loaded} nodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compares /metrics scrape latency and peak memory of the OTel SDK backend
+(PrometheusMetricReader) with the native prometheus_client collector.
+
+    python benchmarks/bench_scrape.py --series 10000 100000 500000
+"""
+
+import argparse
+import multiprocessing
+import time
+import tracemalloc
+
+from opentelemetry import metrics as otel_metrics
+from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.sdk.metrics import MeterProvider
+from prometheus_client import CollectorRegistry, generate_latest
+
+from meshtastic_prometheus_exporter import metrics
+from meshtastic_prometheus_exporter.collector import Collector
+
+
+def make_instruments(backend, series):
+    """Half of the series in a packet counter, half in a telemetry gauge."""
+    counter = metrics.Counter(name="bench_packets_total")
+    gauge = metrics.Gauge(name="bench_voltage_volts")
+    if backend == "native":
+        counter._totals = {}
+    for i in range(series // 2):
+        node = f"{0x10000000 + i // 4:08x}"
+        counter.add(
+            1,
+            attributes={
+                "source": node,
+                "source_long_name": f"Node {node}",
+                "destination": "4294967295",
+                "type": ("TELEMETRY_APP", "NODEINFO_APP", "TEXT_MESSAGE_APP")[i % 3],
+                "channel": str(i % 4),
+            },
+        )
+        gauge.set(
+            3.3 + i % 100 / 100,
+            attributes={
+                "source": f"{0x10000000 + i:08x}",
+                "source_long_name": f"Node {i}",
+                "source_short_name": f"{i % 0xFFFF:04x}",
+            },
+        )
+    return {counter.name: counter, gauge.name: gauge}
+
+
+def measure(registry, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = generate_latest(registry)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    generate_latest(registry)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sorted(timings)[len(timings) // 2], peak, len(body)
+
+
+def run(series, backend, repeat):
+    """One measurement, in a fresh process so that backends and rounds share nothing."""
+    if backend == "otel":
+        reader = PrometheusMetricReader()
+        otel_metrics.set_meter_provider(MeterProvider(metric_readers=[reader]))
+        # Only the exporter's series, not the process collectors of REGISTRY
+        registry = CollectorRegistry()
+        registry.register(reader._collector)
+        make_instruments(backend, series)
+    else:
+        registry = CollectorRegistry()
+        registry.register(
+            Collector(instruments=make_instruments(backend, series), observables=[])
+        )
+    return measure(registry, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--series", type=int, nargs="+", default=[10_000, 100_000, 500_000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'series':>8} {'backend':<8} {'scrape':>10} {'peak memory':>12} {'size':>10}"
+    )
+    context = multiprocessing.get_context("spawn")
+    for series in args.series:
+        for backend in ("otel", "native"):
+            with context.Pool(1) as pool:
+                latency, peak, size = pool.apply(run, (series, backend, args.repeat))
+            print(
+                f"{series:>8} {backend:<8} {latency * 1000:8.1f}ms "
+                f"{peak / 2**20:9.1f}MiB {size / 2**20:8.1f}MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Measures how long the exporter takes to import and to serve its first
+metrics, and which optional heavy modules an import pulls in.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Only needed by some interfaces or backends, never by a plain import
+HEAVY_MODULES = ("bleak", "paho", "opentelemetry.sdk", "sentry_sdk")
+
+IMPORT_SCRIPT = f"""
+import sys, time
+started = time.perf_counter()
+import meshtastic_prometheus_exporter.__main__
+print(time.perf_counter() - started)
+print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+def time_first_metric(timeout=30):
+    """Seconds from spawning the exporter to a /metrics with its own series."""
+    port = free_port()
+    env = dict(
+        os.environ,
+        SOURCES="[]",
+        ENABLE_SENTRY="0",
+        PROMETHEUS_SERVER_PORT=str(port),
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "meshtastic_prometheus_exporter"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/metrics", timeout=1
+                ) as response:
+                    if b"meshtastic_" in response.read():
+                        return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"No metrics on port {port} after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = [time_import() for _ in range(args.runs)]
+    first_metrics = [time_first_metric() for _ in range(args.runs)]
+    print(f"import        {statistics.median(t for t, _ in imports) * 1000:7.1f} ms")
+    print(f"first metric  {statistics.median(first_metrics) * 1000:7.1f} ms")
+    print(f"heavy modules {' '.join(imports[0][1]) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Per-packet cost of the telemetry decoder, for every mapped telemetry variant,
+on the MessageToDict path and the protobuf-native path.
+
+    python benchmarks/bench_telemetry.py --packets 50000
+"""
+
+import argparse
+import logging
+import time
+
+from google.protobuf.json_format import MessageToDict
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+
+from meshtastic_prometheus_exporter.telemetry import (
+    TELEMETRY_METRICS,
+    logger,
+    on_meshtastic_telemetry_app,
+    on_meshtastic_telemetry_app_pb,
+)
+
+
+def make_packet(variant, sender):
+    """A MeshPacket with every mapped field of ``variant`` set."""
+    telemetry = telemetry_pb2.Telemetry(time=1732550036)
+    for index, (field, _, _) in enumerate(TELEMETRY_METRICS[variant]):
+        setattr(getattr(telemetry, variant), field, index + 1)
+    packet = mesh_pb2.MeshPacket(id=sender, to=0xFFFFFFFF, hop_limit=3)
+    setattr(packet, "from", sender)
+    packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    packet.decoded.payload = telemetry.SerializeToString()
+    packet_dict = MessageToDict(packet)
+    packet_dict["decoded"]["telemetry"] = MessageToDict(telemetry)
+    return packet, packet_dict
+
+
+def run(name, process, packets):
+    started = time.perf_counter()
+    for packet in packets:
+        process(packet, "Node", "node")
+    elapsed = time.perf_counter() - started
+    print(f"{name:<30} {elapsed / len(packets) * 10**6:7.2f} µs/packet")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packets", type=int, default=50000)
+    parser.add_argument("--nodes", type=int, default=500)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    for variant in TELEMETRY_METRICS:
+        packets = [
+            make_packet(variant, 0x10000000 + i % args.nodes)
+            for i in range(args.packets)
+        ]
+        run(f"{variant} dict", on_meshtastic_telemetry_app, [p[1] for p in packets])
+        run(
+            f"{variant} protobuf",
+            on_meshtastic_telemetry_app_pb,
+            [p[0] for p in packets],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Regenerates the sample captures used by the replay benchmarks. The output is
+deterministic, so the committed files only change when this script does.
+
+    python benchmarks/captures/generate.py
+"""
+
+import base64
+import os
+import random
+import struct
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+
+from meshtastic_prometheus_exporter.capture import CaptureWriter
+from meshtastic_prometheus_exporter.decrypt import channel_hash, expand_psk
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def mesh_packet(rng, packet_id, sender, nodes):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=0xFFFFFFFF, hop_start=3)
+    setattr(packet, "from", sender)
+    kind = rng.random()
+    if kind < 0.4:
+        telemetry = telemetry_pb2.Telemetry(time=1730000000)
+        telemetry.device_metrics.battery_level = rng.randint(0, 101)
+        telemetry.device_metrics.voltage = rng.uniform(3.3, 4.2)
+        telemetry.device_metrics.channel_utilization = rng.uniform(0, 40)
+        telemetry.device_metrics.air_util_tx = rng.uniform(0, 5)
+        telemetry.device_metrics.uptime_seconds = rng.randint(0, 10**6)
+        packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+        packet.decoded.payload = telemetry.SerializeToString()
+    elif kind < 0.5:
+        telemetry = telemetry_pb2.Telemetry(time=1730000000)
+        telemetry.environment_metrics.temperature = rng.uniform(-10, 35)
+        telemetry.environment_metrics.relative_humidity = rng.uniform(20, 90)
+        telemetry.environment_metrics.barometric_pressure = rng.uniform(980, 1030)
+        packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+        packet.decoded.payload = telemetry.SerializeToString()
+    elif kind < 0.6:
+        user = mesh_pb2.User(
+            id=f"!{sender:08x}",
+            long_name=f"Node {sender:08x}",
+            short_name=f"{sender & 0xFFFF:04x}",
+            hw_model="TBEAM",
+        )
+        packet.decoded.portnum = portnums_pb2.NODEINFO_APP
+        packet.decoded.payload = user.SerializeToString()
+    elif kind < 0.65:
+        neighbor_info = mesh_pb2.NeighborInfo(node_id=sender)
+        for neighbor in rng.sample(nodes, 5):
+            neighbor_info.neighbors.add(node_id=neighbor, snr=rng.uniform(-20, 10))
+        packet.decoded.portnum = portnums_pb2.NEIGHBORINFO_APP
+        packet.decoded.payload = neighbor_info.SerializeToString()
+    elif kind < 0.85:
+        position = mesh_pb2.Position(
+            latitude_i=rng.randint(460000000, 480000000),
+            longitude_i=rng.randint(280000000, 300000000),
+        )
+        packet.decoded.portnum = portnums_pb2.POSITION_APP
+        packet.decoded.payload = position.SerializeToString()
+    else:
+        packet.encrypted = rng.randbytes(rng.randint(16, 64))
+    return packet
+
+
+def encrypt(packet, channel, psk):
+    """Encrypt the Data of ``packet`` like a node on ``channel`` would."""
+    key = expand_psk(base64.b64decode(psk))
+    nonce = struct.pack("<QI4x", packet.id, getattr(packet, "from"))
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(nonce)).encryptor()
+    packet.encrypted = encryptor.update(packet.decoded.SerializeToString())
+    packet.channel = channel_hash(channel, key)
+
+
+def generate(path, packets, nodes, gateways, seed, psk=None):
+    rng = random.Random(seed)
+    nodes = [rng.getrandbits(32) for _ in range(nodes)]
+    gateways = [f"!{rng.getrandbits(32):08x}" for _ in range(gateways)]
+
+    if os.path.exists(path):
+        os.remove(path)
+    writer = CaptureWriter(path)
+    timestamp = 1730000000.0
+    for _ in range(packets):
+        packet = mesh_packet(rng, rng.getrandbits(32), rng.choice(nodes), nodes)
+        if psk and packet.HasField("decoded"):
+            encrypt(packet, "LongFast", psk)
+        # Every gateway that hears the packet uplinks its own copy
+        for gateway in rng.sample(gateways, rng.randint(1, len(gateways))):
+            packet.hop_limit = rng.randint(0, 3)
+            packet.rx_snr = rng.uniform(-20, 10)
+            packet.rx_rssi = rng.randint(-130, -40)
+            envelope = mqtt_pb2.ServiceEnvelope(
+                packet=packet, channel_id="LongFast", gateway_id=gateway
+            )
+            timestamp += rng.expovariate(50000 / 60)
+            writer.write(
+                timestamp,
+                f"msh/EU_433/2/e/LongFast/{gateway}",
+                envelope.SerializeToString(),
+            )
+    writer.close()
+
+
+if __name__ == "__main__":
+    generate(os.path.join(HERE, "mixed.mpcap"), 1000, 300, 3, seed=1)
+    generate(os.path.join(HERE, "relayed.mpcap"), 150, 100, 12, seed=2)
+    # Default channel traffic uplinked encrypted, as most gateways do,
+    # decrypted with CHANNEL_KEYS=LongFast=AQ==
+    generate(os.path.join(HERE, "encrypted.mpcap"), 1000, 300, 3, seed=3, psk="AQ==")
@@ -0,0 +1,53 @@
+"""
+Hot path regression benchmarks, run with `hatch run bench:run`. Each round
+replays a bundled capture at maximum speed into a fresh dedup window and
+node registry.
+"""
+
+import logging
+import os
+
+import pytest
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter.capture import read_capture
+from meshtastic_prometheus_exporter.decrypt import parse_channel_keys
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+from meshtastic_prometheus_exporter.nodedb import NodeRegistry
+from meshtastic_prometheus_exporter.replay import replay
+
+CAPTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def metrics_backend():
+    exporter.configure_metrics_backend()
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger():
+    level = exporter.logger.level
+    exporter.logger.setLevel(logging.WARNING)
+    yield
+    exporter.logger.setLevel(level)
+
+
+def reset_state():
+    exporter.flood_cache = DedupWindow(ttl=600, maxsize=50000)
+    exporter.node_cache = NodeRegistry(maxsize=50000, ttl=3600)
+
+
+@pytest.mark.parametrize("capture", ["mixed.mpcap", "relayed.mpcap"])
+def test_replay(benchmark, capture):
+    records = list(read_capture(os.path.join(CAPTURES, capture)))
+
+    benchmark.extra_info["messages"] = len(records)
+    benchmark.pedantic(replay, args=(records,), setup=reset_state, rounds=20)
+
+
+def test_replay_encrypted(benchmark, monkeypatch):
+    monkeypatch.setattr(exporter, "channel_keys", parse_channel_keys("LongFast=AQ=="))
+    records = list(read_capture(os.path.join(CAPTURES, "encrypted.mpcap")))
+
+    benchmark.extra_info["messages"] = len(records)
+    benchmark.pedantic(replay, args=(records,), setup=reset_state, rounds=20)
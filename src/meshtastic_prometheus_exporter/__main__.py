@@ -17,39 +17,86 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+
+import atexit
+import functools
 import json
 import logging
 import os
-import ssl
+import signal
 import sys
+import threading
 import time
 import traceback
 from sys import stdout
-from google.protobuf.json_format import MessageToDict
 
+# Interface, MQTT and OpenTelemetry SDK modules are imported when the sources
+# and backend that need them are started, so that importing this module stays
+# cheap and free of side effects
 import google.protobuf.message
-import meshtastic.ble_interface
-import meshtastic.serial_interface
-import meshtastic.tcp_interface
-from cachetools import TTLCache
+import meshtastic
+from cachetools import LRUCache
 from google.protobuf.json_format import MessageToDict
-from opentelemetry.exporter.prometheus import PrometheusMetricReader
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.resources import Resource
-import paho.mqtt.client as mqtt
-from meshtastic.protobuf import mqtt_pb2
-from prometheus_client import start_http_server
+from opentelemetry.metrics import Observation
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2
+from prometheus_client import REGISTRY
 from pubsub import pub
 
+from meshtastic_prometheus_exporter.capture import CaptureWriter
+from meshtastic_prometheus_exporter.collector import Collector
+from meshtastic_prometheus_exporter.decrypt import (
+    count_decryption,
+    decrypt_mesh_packet,
+    parse_channel_keys,
+)
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+from meshtastic_prometheus_exporter.errors import ErrorReporter
+from meshtastic_prometheus_exporter.exposition import (
+    ExpositionCache,
+    start_exposition_server,
+)
+from meshtastic_prometheus_exporter.ingest import (
+    POLICIES as INGEST_POLICIES,
+    AsyncIngestQueue,
+    IngestQueue,
+)
 from meshtastic_prometheus_exporter.metrics import *
-from meshtastic_prometheus_exporter.neighborinfo import on_meshtastic_neighborinfo_app
-from meshtastic_prometheus_exporter.nodeinfo import on_meshtastic_nodeinfo_app
-from meshtastic_prometheus_exporter.telemetry import on_meshtastic_telemetry_app
+from meshtastic_prometheus_exporter.neighborinfo import (
+    on_meshtastic_neighborinfo_app,
+    on_meshtastic_neighborinfo_app_pb,
+    save_neighborinfo_in_topology,
+)
+from meshtastic_prometheus_exporter.nodedb import (
+    DeviceNodeSync,
+    NodeLabels,
+    NodeRegistry,
+    NodeStore,
+    sync_device_nodes,
+)
+from meshtastic_prometheus_exporter.nodeinfo import (
+    on_meshtastic_nodeinfo_app,
+    on_meshtastic_nodeinfo_app_pb,
+    save_nodeinfo_in_cache,
+    save_user_in_cache,
+)
+from meshtastic_prometheus_exporter.rollup import Rollups
+from meshtastic_prometheus_exporter.sources import INTERFACES, parse_sources
+from meshtastic_prometheus_exporter.telemetry import (
+    on_meshtastic_telemetry_app,
+    on_meshtastic_telemetry_app_pb,
+)
+from meshtastic_prometheus_exporter.topology import TopologyIndex
 from meshtastic_prometheus_exporter.util import (
     get_decoded_node_metadata_from_cache,
     save_node_metadata_in_cache,
 )
 
+PORTNUM_NAMES = {v: k for k, v in portnums_pb2.PortNum.items()}
+DELAYED_NAMES = {v: k for k, v in mesh_pb2.MeshPacket.Delayed.items()}
+
+# meshtastic.tcp_interface.DEFAULT_TCP_PORT
+DEFAULT_TCP_PORT = 4403
+
 
 class ColorFormatter(logging.Formatter):
     COLORS = {
@@ -78,9 +125,7 @@ config = {
     "meshtastic_interface": os.environ.get("MESHTASTIC_INTERFACE"),
     "interface_serial_device": os.environ.get("SERIAL_DEVICE", "/dev/ttyACM0"),
     "interface_tcp_addr": os.environ.get("INTERFACE_TCP_ADDR"),
-    "interface_tcp_port": os.environ.get(
-        "INTERFACE_TCP_PORT", meshtastic.tcp_interface.DEFAULT_TCP_PORT
-    ),
+    "interface_tcp_port": os.environ.get("INTERFACE_TCP_PORT", DEFAULT_TCP_PORT),
     "interface_ble_addr": os.environ.get("INTERFACE_BLE_ADDR", "AA:BB:CC:DD:EE:FF"),
     "mqtt_address": os.environ.get("MQTT_ADDRESS", "mqtt.meshtastic.org"),
     "mqtt_use_tls": os.environ.get("MQTT_USE_TLS", False),
@@ -89,12 +134,40 @@ config = {
     "mqtt_username": os.environ.get("MQTT_USERNAME"),
     "mqtt_password": os.environ.get("MQTT_PASSWORD"),
     "mqtt_topic": os.environ.get("MQTT_TOPIC", "msh/EU_433/#"),
+    "sources": os.environ.get("SOURCES"),
     "prometheus_server_addr": os.environ.get("PROMETHEUS_SERVER_ADDR", "0.0.0.0"),
     "prometheus_server_port": os.environ.get("PROMETHEUS_SERVER_PORT", 9464),
+    "admin_server_addr": os.environ.get("ADMIN_SERVER_ADDR", "127.0.0.1"),
+    "admin_server_port": os.environ.get("ADMIN_SERVER_PORT"),
     "log_level": os.environ.get("LOG_LEVEL", "INFO"),
     "log_color": os.environ.get("LOG_COLOR", True),
     "flood_expire_time": int(os.environ.get("FLOOD_EXPIRE_TIME", 10 * 60)),
+    "flood_cache_maxsize": int(os.environ.get("FLOOD_CACHE_MAXSIZE", 50000)),
+    "node_cache_ttl": int(os.environ.get("NODE_CACHE_TTL", 3600 * 72)),
+    "node_cache_maxsize": int(os.environ.get("NODE_CACHE_MAXSIZE", 50000)),
+    "topology_ttl": int(os.environ.get("TOPOLOGY_TTL", 3600 * 24)),
+    "rollup_window": int(os.environ.get("ROLLUP_WINDOW", 15 * 60)),
+    "nodedb_path": os.environ.get("NODEDB_PATH"),
+    "nodedb_flush_interval": int(os.environ.get("NODEDB_FLUSH_INTERVAL", 10)),
+    "nodedb_sync_interval": float(os.environ.get("NODEDB_SYNC_INTERVAL", 300)),
+    "ingest_queue_size": int(os.environ.get("INGEST_QUEUE_SIZE", 10000)),
+    "ingest_workers": int(os.environ.get("INGEST_WORKERS", 1)),
+    "ingest_processes": int(os.environ.get("INGEST_PROCESSES", 0)),
+    "ingest_drop_policy": os.environ.get("INGEST_DROP_POLICY", "drop_oldest"),
+    "ingest_block_timeout": float(os.environ.get("INGEST_BLOCK_TIMEOUT", 1)),
+    "capture_path": os.environ.get("CAPTURE_PATH"),
+    "channel_keys": os.environ.get("CHANNEL_KEYS", ""),
+    "metric_attributes": parse_metric_attributes(
+        os.environ.get("METRIC_ATTRIBUTES", "")
+    ),
+    "metric_series_limit": int(os.environ.get("METRIC_SERIES_LIMIT", 0)),
+    "metric_staleness": int(os.environ.get("METRIC_STALENESS", 3600 * 72)),
+    "metrics_backend": os.environ.get("METRICS_BACKEND", "otel"),
+    "runtime": os.environ.get("RUNTIME", "threads"),
+    "metrics_cache_interval": float(os.environ.get("METRICS_CACHE_INTERVAL", 5)),
     "enable_sentry": os.environ.get("ENABLE_SENTRY", True),
+    "sentry_traces_sample_rate": float(os.environ.get("SENTRY_TRACES_SAMPLE_RATE", 0)),
+    "error_report_interval": float(os.environ.get("ERROR_REPORT_INTERVAL", 60)),
     "sentry_dsn": os.environ.get(
         "SENTRY_DSN",
         "https://d03452fcb06e7141c5c9a1d6ee370e8d@o4508362511286272.ingest.de.sentry.io/4508362517381200",
@@ -102,41 +175,159 @@ config = {
 }
 
 logger = logging.getLogger("meshtastic_prometheus_exporter")
-logger.propagate = False
 
-logger.setLevel(getattr(logging, config["log_level"].upper()))
 
-handler = logging.StreamHandler(stdout)
-handler.setFormatter(
-    ColorFormatter(
-        "%(asctime)s - meshtastic_prometheus_exporter - %(levelname)s - %(message)s",
-        use_color=bool(config.get("log_color", False)),
+def configure_logging():
+    logger.propagate = False
+    logger.setLevel(getattr(logging, config["log_level"].upper()))
+
+    handler = logging.StreamHandler(stdout)
+    handler.setFormatter(
+        ColorFormatter(
+            "%(asctime)s - meshtastic_prometheus_exporter - %(levelname)s - %(message)s",
+            use_color=bool(config.get("log_color", False)),
+        )
     )
-)
 
-logger.addHandler(handler)
+    logger.addHandler(handler)
 
-try:
-    reader = PrometheusMetricReader()
-    start_http_server(
-        port=config["prometheus_server_port"], addr=config["prometheus_server_addr"]
-    )
 
-    provider = MeterProvider(
-        resource=Resource.create(attributes={"service.name": "meshtastic"}),
-        metric_readers=[reader],
-        # views=[],
+# Set for METRICS_BACKEND=prometheus, merges the state of INGEST_PROCESSES shards
+collector = None
+
+
+def configure_metrics_backend():
+    """
+    Configure the instruments and register the METRICS_BACKEND that serves
+    them in the prometheus_client REGISTRY.
+    """
+    global collector
+
+    views = configure_instruments(
+        config["metric_attributes"],
+        config["metric_series_limit"],
+        config["metric_staleness"],
     )
-    metrics.set_meter_provider(provider)
-    meter = metrics.get_meter("meshtastic_prometheus_exporter")
+    if config["metrics_backend"] == "prometheus":
+        use_native_backend()
+        collector = Collector()
+        REGISTRY.register(collector)
+    elif config["metrics_backend"] == "otel":
+        from opentelemetry.exporter.prometheus import PrometheusMetricReader
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.resources import Resource
+
+        reader = PrometheusMetricReader()
+        provider = MeterProvider(
+            resource=Resource.create(attributes={"service.name": "meshtastic"}),
+            metric_readers=[reader],
+            views=views,
+        )
+        metrics.set_meter_provider(provider)
+        SERIES_EXPIRED_HOOKS.append(functools.partial(forget_sdk_series, provider))
+        # Histograms never record into the SDK
+        REGISTRY.register(
+            Collector(
+                instruments={
+                    name: instrument
+                    for name, instrument in INSTRUMENTS.items()
+                    if isinstance(instrument, Histogram)
+                },
+                observables=[],
+            )
+        )
+    else:
+        raise ValueError(f"Unknown METRICS_BACKEND {config['metrics_backend']}")
 
-    cache = TTLCache(maxsize=10000, ttl=config["flood_expire_time"])
 
-except Exception as e:
-    logger.fatal(
-        f"Exception occurred while starting up: {';'.join(traceback.format_exc().splitlines())}"
+# Packet ids are only needed for as long as a flood can echo through the
+# mesh, whereas node metadata must survive until the next NodeInfo
+# broadcast (hours apart), so the two are kept in separate stores to stop
+# one from evicting the other.
+flood_cache = DedupWindow(
+    ttl=config["flood_expire_time"], maxsize=config["flood_cache_maxsize"]
+)
+create_observable_counter(
+    "meshtastic_exporter_dedup_hits_total",
+    callbacks=[flood_cache.observe_hits],
+    description="MeshPackets dropped as duplicates",
+)
+create_observable_counter(
+    "meshtastic_exporter_dedup_misses_total",
+    callbacks=[flood_cache.observe_misses],
+    description="MeshPackets seen for the first time",
+)
+create_observable_counter(
+    "meshtastic_exporter_dedup_evictions_total",
+    callbacks=[flood_cache.observe_evictions],
+    description="Dedup entries evicted before FLOOD_EXPIRE_TIME because FLOOD_CACHE_MAXSIZE was reached",
+)
+node_cache = NodeRegistry(
+    maxsize=config["node_cache_maxsize"], ttl=config["node_cache_ttl"]
+)
+create_observable_gauge(
+    "meshtastic_exporter_cache_entries",
+    callbacks=[flood_cache.observe_size, node_cache.observe_size],
+    description="Entries of the dedup window, the node registry and its NodeLabels",
+)
+# Set from CHANNEL_KEYS by main()
+channel_keys = {}
+
+# Links between nodes from NeighborInfo, expiring TOPOLOGY_TTL seconds
+# after the last report that listed them
+topology = TopologyIndex(
+    ttl=config["topology_ttl"],
+    attributes=lambda node: get_node_labels(node).gauge_attributes,
+)
+create_observable_gauge(
+    "meshtastic_topology_node_degree",
+    callbacks=[topology.observe_degree],
+    description="Number of nodes each node is linked with according to NeighborInfo",
+)
+create_observable_gauge(
+    "meshtastic_topology_links",
+    callbacks=[topology.observe_links],
+    description="Links between nodes according to NeighborInfo",
+)
+create_observable_gauge(
+    "meshtastic_topology_components",
+    callbacks=[topology.observe_components],
+    description="Connected components of the mesh according to NeighborInfo",
+)
+create_observable_gauge(
+    "meshtastic_topology_component_nodes",
+    callbacks=[topology.observe_component_nodes],
+    description="Nodes of every connected component, labelled with its lowest node number",
+)
+create_observable_gauge(
+    "meshtastic_topology_link_snr_decibels",
+    callbacks=[topology.observe_link_snr],
+    description="Minimum, mean and maximum SNR of the links of every node",
+)
+
+# Network-wide statistics of key telemetry by channel and region
+telemetry_rollups = Rollups(window=config["rollup_window"])
+for statistic, callback, description in (
+    ("samples", telemetry_rollups.observe_count, "Number of measurements"),
+    ("mean", telemetry_rollups.observe_mean, "Mean"),
+    ("min", telemetry_rollups.observe_min, "Minimum"),
+    ("max", telemetry_rollups.observe_max, "Maximum"),
+    ("quantile", telemetry_rollups.observe_quantiles, "Approximate quantiles"),
+):
+    create_observable_gauge(
+        f"meshtastic_telemetry_rollup_{statistic}",
+        callbacks=[callback],
+        description=f"{description} of telemetry metrics of all nodes over the last ROLLUP_WINDOW seconds, by channel and region",
     )
-    sys.exit(1)
+
+# Set from CAPTURE_PATH, records raw MQTT messages for meshtastic-prometheus-exporter-replay
+capture_writer = None
+
+# Name of the source (SOURCES) of every SerialInterface/TCPInterface/BLEInterface
+interface_sources = {}
+
+# Name of every MQTT source to 1 while it is connected, 0 otherwise
+mqtt_connected = {}
 
 
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -145,68 +336,250 @@ def on_connect(client, userdata, flags, reason_code, properties):
             f"Failed to connect to MQTT server with result code {reason_code}. loop_forever() will retry connection"
         )
     else:
-        logger.info(f"Connected to MQTT server with result code {reason_code}")
-        client.subscribe(config["mqtt_topic"])
+        logger.info(
+            f"Connected to MQTT server {userdata['address']} of source {userdata['name']} with result code {reason_code}"
+        )
+        mqtt_connected[userdata["name"]] = 1
+        client.subscribe([(topic, 0) for topic in userdata["topics"]])
 
 
-def on_meshtastic_service_envelope(envelope, msg):
-    logger.debug(
-        f"Received ServiceEnvelope payload `{msg['payload']}` from `{msg.topic}` topic"
+def on_disconnect(client, userdata, flags, reason_code, properties):
+    logger.warning(
+        f"Disconnected from MQTT server {userdata['address']} of source {userdata['name']} with result code {reason_code}"
+    )
+    mqtt_connected[userdata["name"]] = 0
+    meshtastic_exporter_mqtt_disconnects_total.add(
+        1, attributes={"ingest_source": userdata["name"]}
     )
 
-    if envelope:
-        logger.debug(
-            f"Decoded ServiceEnvelope payload into MeshPacket `{envelope.packet}`"
+
+def observe_mqtt_connected(options):
+    for name, connected in list(mqtt_connected.items()):
+        yield Observation(connected, attributes={"ingest_source": name})
+
+
+def predecode_service_envelope(topic, payload, source="mqtt"):
+    """
+    Parse the ServiceEnvelope and check the header of its MeshPacket (from, id
+    and whether it is encrypted). Return None if the packet is a duplicate or
+    cannot be processed, so that it never reaches the ingest queue and its
+    payload is never decoded. The outcome is counted for ``source``.
+
+    upb only parses the outer messages here and keeps app payloads as bytes,
+    which is as cheap as scanning the wire format for the header fields.
+    """
+    started = time.perf_counter_ns()
+    try:
+        envelope = mqtt_pb2.ServiceEnvelope.FromString(payload)
+    except Exception as e:
+        error_reporter.report(
+            e, lambda: f"payload from `{topic}` topic", level=logging.WARNING
         )
-        on_meshtastic_mesh_packet(envelope.packet)
+        count_dropped_packet("invalid")
+        count_ingested_packet(source, "invalid")
+        return None
+    record_stage("decode", envelope.packet.decoded.portnum, started)
 
+    if not accept_mesh_packet(envelope.packet, source):
+        return None
+    return envelope
 
-def on_meshtastic_mesh_packet(packet):
-    if packet.get("encrypted", False):
-        logger.info(f"Skipping encrypted packet {packet['id']}")
-        return
 
-    if packet.get("id", None) is None:
-        return
+def accept_mesh_packet(packet, source):
+    """
+    Check the header of a MeshPacket and return False if it is encrypted on
+    a channel without CHANNEL_KEYS or a duplicate, counting the outcome for
+    ``source``. Packets on channels with a key are decrypted later, by the
+    ingest workers.
+    """
+    if packet.HasField("encrypted") and packet.channel not in channel_keys:
+        logger.info(f"Skipping encrypted packet {packet.id}")
+        count_decryption(packet.channel, "unknown_channel")
+        meshtastic_exporter_full_parses_avoided_total.add(
+            1, attributes={"reason": "encrypted"}
+        )
+        count_dropped_packet("encrypted")
+        count_ingested_packet(source, "encrypted")
+        return False
 
-    # Use the packet id as the cache key for deduplication
-    unique = cache.setdefault(str(packet["id"]), True)
-    if not unique:
-        logger.info(f"Skipping duplicate packet {packet['id']}")
-        return
+    started = time.perf_counter_ns()
+    duplicate = packet.id and flood_cache.seen(getattr(packet, "from"), packet.id)
+    record_stage("dedup", packet.decoded.portnum, started)
+    if duplicate:
+        logger.info(f"Skipping duplicate packet {packet.id}")
+        meshtastic_exporter_full_parses_avoided_total.add(
+            1, attributes={"reason": "duplicate"}
+        )
+        count_dropped_packet("duplicate")
+        count_ingested_packet(source, "duplicate")
+        return False
 
-    source = packet["decoded"].get("source", packet["from"])
+    count_ingested_packet(source, "accepted")
+    return True
 
-    source_long_name = get_decoded_node_metadata_from_cache(cache, source, "long_name")
-    source_short_name = get_decoded_node_metadata_from_cache(
-        cache, source, "short_name"
-    )
-    from_long_name = get_decoded_node_metadata_from_cache(
-        cache, packet["from"], "long_name"
-    )
-    from_short_name = get_decoded_node_metadata_from_cache(
-        cache, packet["from"], "short_name"
-    )
-    to_long_name = get_decoded_node_metadata_from_cache(
-        cache, packet["to"], "long_name"
+
+def count_ingested_packet(source, status):
+    meshtastic_exporter_ingest_packets_total.add(
+        1, attributes={"ingest_source": source, "status": status}
     )
-    to_short_name = get_decoded_node_metadata_from_cache(
-        cache, packet["to"], "short_name"
+
+
+def count_dropped_packet(reason):
+    meshtastic_exporter_dropped_packets_total.add(1, attributes={"reason": reason})
+
+
+# (stage, portnum) to the attributes of meshtastic_exporter_stage_duration_seconds
+stage_attributes = {}
+
+
+def record_stage(stage, portnum, started):
+    """Record the time since ``started`` (perf_counter_ns) spent in ``stage``."""
+    elapsed = time.perf_counter_ns() - started
+    attributes = stage_attributes.get((stage, portnum))
+    if attributes is None:
+        attributes = stage_attributes[(stage, portnum)] = Attributes(
+            stage=stage, portnum=PORTNUM_NAMES.get(portnum, portnum)
+        )
+    meshtastic_exporter_stage_duration_seconds.record(
+        elapsed / 10**9, attributes=attributes
     )
 
+
+def on_meshtastic_service_envelope(topic, envelope):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Received UTF-8 payload `{MessageToDict(envelope)}` from `{topic}` topic"
+        )
+
+    started = time.perf_counter_ns()
+    try:
+        on_meshtastic_mesh_packet_pb(envelope.packet, topic, envelope.channel_id)
+    except Exception as e:
+        report_packet_exception(e, envelope.packet)
+    record_stage("dispatch", envelope.packet.decoded.portnum, started)
+
+
+# Destination of most packets, never saved in the node cache
+broadcast_labels = NodeLabels(meshtastic.BROADCAST_NUM, "unknown", "unknown")
+
+
+def get_node_labels(node):
+    """NodeLabels of ``node``, built from the node cache lookups if it is not known."""
+    labels = node_cache.labels(node)
+    if labels is None:
+        if node == meshtastic.BROADCAST_NUM:
+            return broadcast_labels
+        labels = NodeLabels(
+            node,
+            get_decoded_node_metadata_from_cache(node_cache, node, "long_name"),
+            get_decoded_node_metadata_from_cache(node_cache, node, "short_name"),
+        )
+    return labels
+
+
+def count_mesh_packet(source, sender, to, attributes):
+    """
+    Add the packet to meshtastic_mesh_packets_total, labelled with the node
+    names from the cache, and return the NodeLabels of its source.
+    """
+    source_labels = get_node_labels(source)
     # https://buf.build/meshtastic/protobufs/file/main:meshtastic/portnums.proto
     meshtastic_mesh_packets_total.add(
         1,
         attributes={
-            "source": source,
-            "source_long_name": source_long_name,
-            "source_short_name": source_short_name,
-            "from": packet["from"],
-            "from_long_name": from_long_name,
-            "from_short_name": from_short_name,
-            "to": packet["to"],
-            "to_long_name": to_long_name,
-            "to_short_name": to_short_name,
+            **source_labels.source,
+            **get_node_labels(sender).sender,
+            **get_node_labels(to).to,
+            **attributes,
+        },
+    )
+    return source_labels
+
+
+# Attributes of the network-wide histograms
+network_attributes = Attributes()
+
+# Node number to the time of its last MeshPacket (time.monotonic), for the
+# inter-arrival histograms. Kept apart from NodeLabels, which are rebuilt on
+# renames and not kept at all for nodes without NodeInfo.
+last_arrivals = LRUCache(maxsize=config["node_cache_maxsize"])
+last_arrivals_lock = threading.Lock()
+
+
+def record_hops_and_arrival(source, source_labels, hop_start, hop_limit):
+    """
+    Add the hops taken by a MeshPacket and the time since the previous packet
+    of its source to the per-node and network-wide histograms.
+    """
+    attributes = source_labels.gauge_attributes
+    # Firmware older than 2.3 does not set hop_start
+    if hop_start and hop_start >= hop_limit:
+        hops = hop_start - hop_limit
+        meshtastic_mesh_packet_hops.record(hops, attributes=attributes)
+        meshtastic_mesh_network_packet_hops.record(hops, network_attributes)
+
+    now = time.monotonic()
+    with last_arrivals_lock:
+        last_arrival = last_arrivals.get(source)
+        last_arrivals[source] = now
+    if last_arrival is not None:
+        meshtastic_mesh_packet_interarrival_seconds.record(
+            now - last_arrival, attributes=attributes
+        )
+        meshtastic_mesh_network_packet_interarrival_seconds.record(
+            now - last_arrival, network_attributes
+        )
+
+
+@functools.lru_cache(maxsize=1024)
+def topic_region(topic):
+    """
+    Region of an MQTT topic such as msh/EU_868/2/e/LongFast/!deadbeef: the
+    levels between the root topic and the protocol version.
+    """
+    if topic is None:
+        return "unknown"
+    levels = topic.split("/")
+    if "2" not in levels[1:]:
+        return "unknown"
+    return "/".join(levels[1 : levels.index("2", 1)]) or "unknown"
+
+
+def telemetry_rollup(channel, region):
+    """rollup callback of the telemetry handlers, see record_telemetry."""
+    attributes = (("channel", channel), ("region", region))
+    return lambda metric, value: telemetry_rollups.add(metric, attributes, value)
+
+
+def on_meshtastic_mesh_packet(packet):
+    """
+    Process a MeshPacket received from a device through pubsub and return
+    whether it was accepted or dropped as encrypted, invalid or duplicate.
+    """
+    if packet.get("encrypted", False):
+        logger.info(f"Skipping encrypted packet {packet['id']}")
+        count_dropped_packet("encrypted")
+        return "encrypted"
+
+    if packet.get("id", None) is None:
+        count_dropped_packet("invalid")
+        return "invalid"
+
+    started = time.perf_counter_ns()
+    duplicate = flood_cache.seen(packet["from"], packet["id"])
+    record_stage("dedup", packet["decoded"]["portnum"], started)
+    if duplicate:
+        logger.info(f"Skipping duplicate packet {packet['id']}")
+        count_dropped_packet("duplicate")
+        return "duplicate"
+
+    source = packet["decoded"].get("source", packet["from"])
+
+    source_labels = count_mesh_packet(
+        source,
+        packet["from"],
+        packet["to"],
+        {
             "channel": packet.get("channel", 0),
             "type": packet["decoded"]["portnum"],
             "hop_limit": packet.get("hopLimit", "unknown"),
@@ -215,51 +588,240 @@ def on_meshtastic_mesh_packet(packet):
             "via_mqtt": packet.get("viaMqtt", "false"),
         },
     )
+    record_hops_and_arrival(
+        source, source_labels, packet.get("hopStart", 0), packet.get("hopLimit", 0)
+    )
     if packet["decoded"]["portnum"] == "NODEINFO_APP":
-        on_meshtastic_nodeinfo_app(cache, packet)
+        on_meshtastic_nodeinfo_app(node_cache, packet)
     else:
-        known_source = (
-            get_decoded_node_metadata_from_cache(cache, source, "long_name")
-            != "unknown"
-        )
-
-        if not known_source:
+        if source_labels.long_name == "unknown":
             logger.info(
                 f"NodeInfo is now yet known for Node {source}, ignoring the packet {packet['id']}"
             )
-            return
+            count_dropped_packet("unknown_source")
+            return "accepted"
 
     if packet["decoded"]["portnum"] == "TELEMETRY_APP":
-        on_meshtastic_telemetry_app(packet, source_long_name, source_short_name)
+        on_meshtastic_telemetry_app(
+            packet,
+            source_labels.long_name,
+            source_labels.short_name,
+            source_labels.gauge_attributes,
+            telemetry_rollup(str(packet.get("channel", 0)), "unknown"),
+        )
 
     if packet["decoded"]["portnum"] == "NEIGHBORINFO_APP":
         on_meshtastic_neighborinfo_app(
-            cache, packet, source_long_name, source_short_name
+            node_cache,
+            packet,
+            source_labels.long_name,
+            source_labels.short_name,
+            topology,
+        )
+    return "accepted"
+
+
+def on_meshtastic_mesh_packet_pb(packet, topic=None, channel_id=None):
+    """
+    Same as on_meshtastic_mesh_packet, but works on the MeshPacket protobuf
+    received over MQTT instead of its MessageToDict() representation. The
+    label values are kept identical to the ones of the dict path. ``topic``
+    and ``channel_id`` (of the ServiceEnvelope) are the region and channel of
+    the telemetry rollups.
+
+    Duplicates are already dropped by predecode_service_envelope. Encrypted
+    packets are decrypted with CHANNEL_KEYS first.
+    """
+    if packet.HasField("encrypted"):
+        if decrypt_mesh_packet(packet, channel_keys) is None:
+            logger.info(f"Skipping encrypted packet {packet.id}")
+            count_dropped_packet("encrypted")
+            return
+
+    if not packet.id:
+        count_dropped_packet("invalid")
+        return
+
+    sender = getattr(packet, "from")
+    decoded = packet.decoded
+    portnum = decoded.portnum
+    source = decoded.source or sender
+
+    source_labels = count_mesh_packet(
+        source,
+        sender,
+        packet.to,
+        {
+            "channel": packet.channel,
+            "type": PORTNUM_NAMES.get(portnum, portnum),
+            "hop_limit": packet.hop_limit or "unknown",
+            "want_ack": True if packet.want_ack else "unknown",
+            "delayed": DELAYED_NAMES[packet.delayed] if packet.delayed else "unknown",
+            "via_mqtt": True if packet.via_mqtt else "false",
+        },
+    )
+    record_hops_and_arrival(source, source_labels, packet.hop_start, packet.hop_limit)
+    if portnum == portnums_pb2.NODEINFO_APP:
+        on_meshtastic_nodeinfo_app_pb(node_cache, packet)
+    elif source_labels.long_name == "unknown":
+        logger.info(
+            f"NodeInfo is now yet known for Node {source}, ignoring the packet {packet.id}"
+        )
+        count_dropped_packet("unknown_source")
+        return
+
+    if portnum == portnums_pb2.TELEMETRY_APP:
+        on_meshtastic_telemetry_app_pb(
+            packet,
+            source_labels.long_name,
+            source_labels.short_name,
+            source_labels.gauge_attributes,
+            telemetry_rollup(channel_id or str(packet.channel), topic_region(topic)),
+        )
+
+    if portnum == portnums_pb2.NEIGHBORINFO_APP:
+        on_meshtastic_neighborinfo_app_pb(
+            node_cache,
+            packet,
+            source_labels.long_name,
+            source_labels.short_name,
+            topology,
         )
 
 
 def on_message(client, userdata, msg):
+    # userdata is the source, with the shared IngestQueue unless INGEST_WORKERS is 0
+    # Exceptions must not reach paho, they would stop its network loop
+    envelope = None
     try:
-        envelope = mqtt_pb2.ServiceEnvelope.FromString(msg.payload)
-        packet = envelope.packet
-        logger.debug(
-            f"Received UTF-8 payload `{MessageToDict(envelope)}` from `{msg.topic}` topic"
+        if capture_writer is not None:
+            capture_writer.write(time.time(), msg.topic, msg.payload)
+        meshtastic_exporter_ingest_bytes_total.add(
+            len(msg.payload), attributes={"ingest_source": userdata["name"]}
         )
-        on_native_message(MessageToDict(packet), None)
+        envelope = predecode_service_envelope(msg.topic, msg.payload, userdata["name"])
+        if envelope is None:
+            return
+        if userdata["ingest_queue"] is not None:
+            userdata["ingest_queue"].put((msg.topic, envelope))
+        else:
+            on_meshtastic_service_envelope(msg.topic, envelope)
     except Exception as e:
-        logger.warning(f"Exception occurred in on_message: {e}")
+        report_packet_exception(
+            e, envelope.packet if envelope is not None else {"topic": msg.topic}
+        )
 
 
-def on_native_message(packet, interface):
+def on_mqtt_payload(topic, payload):
+    envelope = predecode_service_envelope(topic, payload)
+    if envelope is not None:
+        on_meshtastic_service_envelope(topic, envelope)
+
+
+def on_from_radio(source, from_radio, ingest_queue):
+    """
+    Handle a FromRadio read by aio.run_tcp_source: queue received packets
+    and save the NodeDB that the device sends on connection.
+    """
+    variant = from_radio.WhichOneof("payload_variant")
     try:
-        on_meshtastic_mesh_packet(packet)
+        if variant == "packet":
+            if accept_mesh_packet(from_radio.packet, source["name"]):
+                ingest_queue.put(
+                    (
+                        source["name"],
+                        mqtt_pb2.ServiceEnvelope(packet=from_radio.packet),
+                    )
+                )
+        elif variant == "node_info" and from_radio.node_info.HasField("user"):
+            save_user_in_cache(
+                node_cache, from_radio.node_info.num, from_radio.node_info.user
+            )
     except Exception as e:
-        logger.error(
-            f"{e} occurred while processing MeshPacket {packet}, please consider submitting a PR/issue on GitHub: `{json.dumps(packet, default=repr)}` {';'.join(traceback.format_exc().splitlines())
-}"
+        # Would otherwise reach aio.run_tcp_source and drop the connection
+        report_packet_exception(e, from_radio.packet)
+
+
+def run_asyncio(sources):
+    """RUNTIME=asyncio: read MQTT and TCP sources from one event loop."""
+    import asyncio
+
+    from meshtastic_prometheus_exporter import aio
+
+    async def run():
+        ingest_queue = AsyncIngestQueue(
+            on_meshtastic_service_envelope,
+            maxsize=config["ingest_queue_size"],
+            workers=max(config["ingest_workers"], 1),
+            policy=config["ingest_drop_policy"],
+        )
+        create_observable_gauge(
+            "meshtastic_exporter_ingest_queue_depth",
+            callbacks=[ingest_queue.observe_depth],
+            description="MQTT messages waiting to be processed",
         )
-        if "sentry_sdk" in globals():
-            sentry_sdk.capture_exception(e)
+        create_observable_counter(
+            "meshtastic_exporter_ingest_dropped_total",
+            callbacks=[ingest_queue.observe_dropped],
+            description="MQTT messages dropped because the ingest queue was full",
+        )
+        coroutines = []
+        for source in sources:
+            logger.info(f"Starting {source['interface']} source {source['name']}")
+            if source["interface"] == "MQTT":
+                coroutines.append(
+                    aio.run_mqtt_source(
+                        source,
+                        {**source, "ingest_queue": ingest_queue},
+                        on_connect,
+                        on_message,
+                        on_disconnect,
+                    )
+                )
+            else:
+                coroutines.append(
+                    aio.run_tcp_source(
+                        source,
+                        functools.partial(on_from_radio, ingest_queue=ingest_queue),
+                    )
+                )
+        await aio.serve(coroutines, ingest_queue)
+
+    asyncio.run(run())
+
+
+def on_native_message(packet, interface):
+    started = time.perf_counter_ns()
+    try:
+        status = on_meshtastic_mesh_packet(packet)
+    except Exception as e:
+        status = "accepted"
+        report_packet_exception(e, packet)
+    record_stage(
+        "dispatch", packet.get("decoded", {}).get("portnum", "UNKNOWN_APP"), started
+    )
+    count_ingested_packet(
+        interface_sources.get(interface, type(interface).__name__), status
+    )
+
+
+# Sends to Sentry once it is enabled by main()
+error_reporter = ErrorReporter(config["error_report_interval"])
+
+
+def report_packet_exception(e, packet):
+    """
+    Count an exception raised while processing ``packet``, a MeshPacket or
+    its dict. Only sampled exceptions pay for serializing the packet.
+    """
+    count_dropped_packet("exception")
+
+    def describe():
+        if isinstance(packet, google.protobuf.message.Message):
+            return f"MeshPacket `{json.dumps(MessageToDict(packet))}`"
+        return f"MeshPacket `{json.dumps(packet, default=repr)}`"
+
+    error_reporter.report(e, describe)
 
 
 def on_native_connection_established(interface, topic=pub.AUTO_TOPIC):
@@ -270,28 +832,110 @@ def on_native_connection_lost(interface, topic=pub.AUTO_TOPIC):
     logger.warning(f"Lost connection to device over {type(interface).__name__}")
 
 
+def start_mqtt_source(source, ingest_queue):
+    import ssl
+
+    import paho.mqtt.client as mqtt
+
+    mqttc = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        userdata={**source, "ingest_queue": ingest_queue},
+    )
+
+    mqttc.on_connect = on_connect
+    mqttc.on_message = on_message
+    mqttc.on_disconnect = on_disconnect
+
+    if int(source["use_tls"]) == 1:
+        tlscontext = ssl.create_default_context()
+        mqttc.tls_set_context(tlscontext)
+
+    if source["username"]:
+        mqttc.username_pw_set(source["username"], source["password"])
+
+    mqttc.connect(
+        source["address"],
+        int(source["port"]),
+        keepalive=int(source["keepalive"]),
+    )
+    mqttc.loop_start()
+    return mqttc
+
+
+def start_native_source(source):
+    # Only the module of the interface in use is imported, the BLE one pulls
+    # in bleak and D-Bus
+    if source["interface"] == "SERIAL":
+        import meshtastic.serial_interface
+
+        iface = meshtastic.serial_interface.SerialInterface(devPath=source["device"])
+    elif source["interface"] == "TCP":
+        import meshtastic.tcp_interface
+
+        iface = meshtastic.tcp_interface.TCPInterface(
+            hostname=source["address"],
+            portNumber=int(source["port"]),
+        )
+    else:
+        import meshtastic.ble_interface
+
+        iface = meshtastic.ble_interface.BLEInterface(address=source["address"])
+    interface_sources[iface] = source["name"]
+    return iface
+
+
+def on_shard_started():
+    """Runs first in every INGEST_PROCESSES shard, only the parent writes NODEDB_PATH."""
+    node_cache.store = None
+
+
 def check_and_save_nodedb(iface, cache):
     if hasattr(iface, "nodes") and len(iface.nodes) > 0:
         logger.info(
-            f"NodeDB is available, saving metadata in cache for {len(iface.nodes.values())} nodes"
-        )
-        for n in iface.nodes.values():
-            save_node_metadata_in_cache(
-                cache,
-                n["num"],
-                {
-                    "longName": n["user"]["longName"],
-                    "shortName": n["user"]["shortName"],
-                    "hwModel": n["user"]["hwModel"],
-                },
-            )
+            f"NodeDB is available, saving metadata in cache for {len(iface.nodes)} nodes"
+        )
+        sync_device_nodes(iface.nodes, cache)
+    elif len(cache) > 0:
+        logger.info(
+            f"Device NodeDB is empty or not available, using metadata of {len(cache)} nodes loaded from {config['nodedb_path']}"
+        )
     else:
         logger.warning(
-            "Device NodeDB is empty or not available. NodeInfo packets are not sent often, so populating local NodeDB (stored in memory) may take from several hours to several days or more."
+            "Device NodeDB is empty or not available. NodeInfo packets are not sent often, so populating local NodeDB (stored in memory) may take from several hours to several days or more. Set NODEDB_PATH to keep it across restarts."
+        )
+
+
+def start_servers():
+    """
+    Start /metrics, the admin endpoint and the NODEDB_PATH writer. Their
+    threads are started after the INGEST_PROCESSES shards are forked, as a
+    fork while they hold a lock could deadlock the shard.
+    """
+    start_exposition_server(
+        port=int(config["prometheus_server_port"]),
+        addr=config["prometheus_server_addr"],
+        cache=ExpositionCache(interval=config["metrics_cache_interval"]),
+    )
+
+    if config["admin_server_port"]:
+        from meshtastic_prometheus_exporter.admin import start_admin_server
+
+        logger.warning(
+            f"Serving profiles and heap snapshots on {config['admin_server_addr']}:{config['admin_server_port']}, unset ADMIN_SERVER_PORT to disable"
+        )
+        start_admin_server(
+            int(config["admin_server_port"]), config["admin_server_addr"]
         )
 
+    if node_cache.store is not None:
+        node_cache.store.start()
+        atexit.register(node_cache.store.close)
+
 
 def main():
+    global capture_writer, channel_keys
+
+    configure_logging()
     try:
         logger.info(
             "Share ideas and vote for new features https://github.com/hacktegic/meshtastic-prometheus-exporter/discussions/categories/ideas"
@@ -308,65 +952,150 @@ def main():
 
             sentry_sdk.init(
                 dsn=config.get("sentry_dsn"),
-                traces_sample_rate=1.0,
+                traces_sample_rate=config["sentry_traces_sample_rate"],
                 integrations=[
                     LoggingIntegration(level=logging.INFO, event_level=logging.FATAL),
                 ],
             )
+            error_reporter.capture = sentry_sdk.capture_exception
         else:
             logger.warning(
                 "Sentry error reporting is disabled. To enable automatic error reporting to project maintainers in case of runtime errors, set the ENABLE_SENTRY environment variable to 1."
             )
 
-        if config.get("meshtastic_interface") not in ["MQTT", "SERIAL", "TCP", "BLE"]:
+        if (
+            not config["sources"]
+            and config.get("meshtastic_interface") not in INTERFACES
+        ):
+            logger.fatal(
+                f"Invalid value for MESHTASTIC_INTERFACE: {config['meshtastic_interface']}. Must be one of: {', '.join(INTERFACES)}"
+            )
+            sys.exit(1)
+
+        try:
+            sources = parse_sources(config["sources"], config)
+        except ValueError as e:
+            logger.fatal(f"Invalid value for SOURCES: {e}")
+            sys.exit(1)
+
+        if config["ingest_drop_policy"] not in INGEST_POLICIES:
             logger.fatal(
-                f"Invalid value for MESHTASTIC_INTERFACE: {config['meshtastic_interface']}. Must be one of: MQTT, SERIAL, TCP, BLE"
+                f"Invalid value for INGEST_DROP_POLICY: {config['ingest_drop_policy']}. Must be one of: {', '.join(INGEST_POLICIES)}"
             )
             sys.exit(1)
 
+        channel_keys = parse_channel_keys(config["channel_keys"])
+        configure_metrics_backend()
+        # Exit through sys.exit() on `docker stop` so that atexit handlers run
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        if config["nodedb_path"]:
+            node_cache.store = NodeStore(
+                config["nodedb_path"],
+                ttl=config["node_cache_ttl"],
+                flush_interval=config["nodedb_flush_interval"],
+            )
+            started = time.monotonic()
+            loaded = node_cache.load()
+            logger.info(
+                f"Loaded metadata of {loaded} nodes from {config['nodedb_path']} in {time.monotonic() - started:.3f}s"
+            )
+
         pub.subscribe(on_native_message, "meshtastic.receive")
         pub.subscribe(
             on_native_connection_established, "meshtastic.connection.established"
         )
         pub.subscribe(on_native_connection_lost, "meshtastic.connection.lost")
 
-        if config.get("meshtastic_interface") == "SERIAL":
-            iface = meshtastic.serial_interface.SerialInterface(
-                devPath=config.get("serial_device")
-            )
-            check_and_save_nodedb(iface, cache)
-        elif config.get("meshtastic_interface") == "TCP":
-            iface = meshtastic.tcp_interface.TCPInterface(
-                hostname=config.get("interface_tcp_addr"),
-                portNumber=int(config.get("interface_tcp_port")),
+        mqtt_sources = [s for s in sources if s["interface"] == "MQTT"]
+        if mqtt_sources and config["capture_path"]:
+            logger.warning(
+                f"Recording raw MQTT messages to {config['capture_path']}, unset CAPTURE_PATH to stop"
             )
-            check_and_save_nodedb(iface, cache)
-        elif config.get("meshtastic_interface") == "BLE":
-            iface = meshtastic.ble_interface.BLEInterface(
-                address=config.get("interface_ble_addr"),
+            capture_writer = CaptureWriter(config["capture_path"])
+            atexit.register(capture_writer.close)
+        if mqtt_sources:
+            create_observable_gauge(
+                "meshtastic_exporter_mqtt_connected",
+                callbacks=[observe_mqtt_connected],
+                description="Whether each MQTT source (SOURCES) is connected",
             )
-            check_and_save_nodedb(iface, cache)
-        elif config.get("meshtastic_interface") == "MQTT":
-            mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-
-            mqttc.on_connect = on_connect
-            mqttc.on_message = on_message
 
-            if int(config["mqtt_use_tls"]) == 1:
-                tlscontext = ssl.create_default_context()
-                mqttc.tls_set_context(tlscontext)
+        if config["runtime"] == "asyncio":
+            unsupported = [
+                s["name"] for s in sources if s["interface"] not in ("MQTT", "TCP")
+            ]
+            if unsupported:
+                logger.fatal(
+                    f"RUNTIME=asyncio only supports MQTT and TCP sources, not {', '.join(unsupported)}"
+                )
+                sys.exit(1)
+            start_servers()
+            run_asyncio(sources)
+            return
 
-            if config["mqtt_username"]:
-                mqttc.username_pw_set(config["mqtt_username"], config["mqtt_password"])
+        ingest_queue = None
+        if mqtt_sources and config["ingest_processes"] > 0:
+            if collector is None:
+                logger.fatal("INGEST_PROCESSES requires METRICS_BACKEND=prometheus")
+                sys.exit(1)
+            from meshtastic_prometheus_exporter.shards import ShardRouter
 
-            mqttc.connect(
-                config["mqtt_address"],
-                int(config["mqtt_port"]),
-                keepalive=int(config["mqtt_keepalive"]),
+            ingest_queue = ShardRouter(
+                config["ingest_processes"],
+                on_meshtastic_service_envelope,
+                functools.partial(save_nodeinfo_in_cache, node_cache),
+                maxsize=config["ingest_queue_size"],
+                initializer=on_shard_started,
+                save_neighbors=functools.partial(
+                    save_neighborinfo_in_topology, topology
+                ),
             )
+            collector.shards = ingest_queue
+            atexit.register(ingest_queue.stop)
+        elif mqtt_sources and config["ingest_workers"] > 0:
+            ingest_queue = IngestQueue(
+                on_meshtastic_service_envelope,
+                maxsize=config["ingest_queue_size"],
+                workers=config["ingest_workers"],
+                policy=config["ingest_drop_policy"],
+                block_timeout=config["ingest_block_timeout"],
+            )
+        if ingest_queue is not None:
+            create_observable_gauge(
+                "meshtastic_exporter_ingest_queue_depth",
+                callbacks=[ingest_queue.observe_depth],
+                description="MQTT messages waiting to be processed",
+            )
+            create_observable_counter(
+                "meshtastic_exporter_ingest_dropped_total",
+                callbacks=[ingest_queue.observe_dropped],
+                description="MQTT messages dropped because the ingest queue was full",
+            )
+            ingest_queue.start()
+        start_servers()
+
+        # Devices keep learning about nodes after they connected, their
+        # NodeDB is applied to node_cache again every NODEDB_SYNC_INTERVAL
+        nodedb_sync = DeviceNodeSync(node_cache, config["nodedb_sync_interval"])
+
+        # All sources share flood_cache and node_cache, so a packet heard by
+        # several of them is only counted once
+        for source in sources:
+            logger.info(f"Starting {source['interface']} source {source['name']}")
+            if source["interface"] == "MQTT":
+                start_mqtt_source(source, ingest_queue)
+            else:
+                iface = start_native_source(source)
+                check_and_save_nodedb(iface, node_cache)
+                nodedb_sync.interfaces.append(iface)
+
+        if nodedb_sync.interfaces and config["nodedb_sync_interval"] > 0:
+            nodedb_sync.start()
+            atexit.register(nodedb_sync.close)
 
-            check_and_save_nodedb(object(), cache)
-            mqttc.loop_forever()
+        if len(mqtt_sources) == len(sources):
+            check_and_save_nodedb(object(), node_cache)
 
         while True:
             time.sleep(1)
@@ -0,0 +1,254 @@
+"""
+Admin endpoint (ADMIN_SERVER_PORT): on-demand CPU profiles and tracemalloc
+heap snapshots of the running exporter, for when a profiler cannot be
+attached to its container.
+
+    GET /debug/profile?seconds=30&format=collapsed   sampling CPU profile
+    GET /debug/profile?seconds=30&format=pstats      same, as a pstats dump
+    GET /debug/heap/snapshot                         start tracing, top sites
+    GET /debug/heap/diff                             growth since last snapshot
+    GET /debug/heap/stop                             stop tracing
+"""
+
+import collections
+import linecache
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+MAX_PROFILE_SECONDS = 300
+DEFAULT_SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+
+# Heap snapshots only keep allocations made while the exporter's own modules
+# are on the stack unless ?all=1 is given
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample_stacks(seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    Sample the stacks of all other threads every ``interval`` seconds for
+    ``seconds`` seconds. Return a Counter of stacks, each a tuple of
+    (thread name, code objects from the outermost frame to the innermost).
+    """
+    me = threading.get_ident()
+    samples = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            samples[(names.get(ident, str(ident)), tuple(reversed(codes)))] += 1
+        time.sleep(interval)
+    return samples
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _function(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def collapsed_stacks(samples):
+    """Render samples in the collapsed format of flamegraph.pl and speedscope."""
+    lines = []
+    for (thread, codes), count in samples.most_common():
+        frames = ";".join([thread, *map(_frame_name, codes)])
+        lines.append(f"{frames} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def pstats_dump(samples, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    Render samples as a marshalled stats dict that ``pstats.Stats`` loads.
+
+    A sampling profile has no call counts, so every function is reported as
+    called once per sample it appears in, its own time is its samples at
+    the top of a stack and its cumulative time its samples anywhere in one.
+    """
+    # function to [cc, nc, tt, ct, {caller: [cc, nc, tt, ct]}]
+    stats = {}
+    for (_, codes), count in samples.items():
+        elapsed = count * interval
+        seen = set()
+        caller = None
+        for depth, code in enumerate(codes):
+            function = _function(code)
+            entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+            leaf = depth == len(codes) - 1
+            recursive = function in seen
+            seen.add(function)
+            if not recursive:
+                entry[0] += count
+                entry[1] += count
+                entry[3] += elapsed
+            if leaf:
+                entry[2] += elapsed
+            if caller is not None:
+                edge = entry[4].setdefault(caller, [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[2] += elapsed if leaf else 0.0
+                edge[3] += elapsed
+            caller = function
+    return marshal.dumps(
+        {
+            function: (cc, nc, tt, ct, {key: tuple(e) for key, e in callers.items()})
+            for function, (cc, nc, tt, ct, callers) in stats.items()
+        }
+    )
+
+
+class HeapTracker:
+    """
+    tracemalloc snapshots compared with the previous one, so that repeated
+    diffs show which allocation sites keep growing.
+    """
+
+    def __init__(self, frames=TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _take(self, all_files):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        snapshot = tracemalloc.take_snapshot()
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+        ]
+        if not all_files:
+            filters.append(
+                tracemalloc.Filter(
+                    True, os.path.join(PACKAGE_DIR, "*"), all_frames=True
+                )
+            )
+        return snapshot.filter_traces(filters)
+
+    def snapshot(self, limit=25, all_files=False):
+        """Start tracing if needed, keep a snapshot and render its top sites."""
+        with self._lock:
+            self._snapshot = self._take(all_files)
+            statistics = self._snapshot.statistics("lineno")
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced {current} bytes, peak {peak} bytes"]
+        lines.extend(str(statistic) for statistic in statistics[:limit])
+        return "\n".join(lines) + "\n"
+
+    def diff(self, limit=25, all_files=False):
+        """Render the growth of allocation sites since the previous snapshot."""
+        with self._lock:
+            if self._snapshot is None:
+                return None
+            snapshot = self._take(all_files)
+            statistics = snapshot.compare_to(self._snapshot, "lineno")
+            self._snapshot = snapshot
+        lines = [str(statistic) for statistic in statistics[:limit]]
+        return "\n".join(lines) + "\n"
+
+    def stop(self):
+        with self._lock:
+            self._snapshot = None
+            tracemalloc.stop()
+
+
+class AdminHandler(BaseHTTPRequestHandler):
+    heap = None
+    # Only one profile at a time: samplers would sample each other
+    profile_lock = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/debug/profile":
+                self._profile(query)
+            elif url.path == "/debug/heap/snapshot":
+                self._send(
+                    200,
+                    self.heap.snapshot(
+                        int(query.get("limit", 25)), query.get("all") == "1"
+                    ),
+                )
+            elif url.path == "/debug/heap/diff":
+                body = self.heap.diff(
+                    int(query.get("limit", 25)), query.get("all") == "1"
+                )
+                if body is None:
+                    self._send(409, "Take a snapshot with /debug/heap/snapshot first\n")
+                else:
+                    self._send(200, body)
+            elif url.path == "/debug/heap/stop":
+                self.heap.stop()
+                self._send(200, "tracemalloc stopped\n")
+            else:
+                self._send(404, __doc__)
+        except ValueError as e:
+            self._send(400, f"{e}\n")
+
+    def _profile(self, query):
+        seconds = float(query.get("seconds", 30))
+        interval = float(query.get("interval", DEFAULT_SAMPLE_INTERVAL))
+        output = query.get("format", "collapsed")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"seconds must be within (0, {MAX_PROFILE_SECONDS}]")
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if output not in ("collapsed", "pstats"):
+            raise ValueError("format must be collapsed or pstats")
+
+        if not self.profile_lock.acquire(blocking=False):
+            self._send(409, "A profile is already running\n")
+            return
+        try:
+            logger.info(f"Profiling for {seconds}s ({output})")
+            samples = sample_stacks(seconds, interval)
+        finally:
+            self.profile_lock.release()
+
+        if output == "pstats":
+            self._send(200, pstats_dump(samples, interval), "application/octet-stream")
+        else:
+            self._send(200, collapsed_stacks(samples))
+
+    def _send(self, status, body, content_type="text/plain; charset=utf-8"):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_admin_server(port, addr="127.0.0.1"):
+    """Serve the admin endpoint from a daemon thread."""
+    handler = type(
+        "AdminHandler",
+        (AdminHandler,),
+        {"heap": HeapTracker(), "profile_lock": threading.Lock()},
+    )
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="admin", daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,217 @@
+"""
+asyncio runtime (RUNTIME=asyncio): MQTT and TCP sources read by tasks of a
+single event loop instead of paho and meshtastic threads.
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import signal
+import threading
+
+import paho.mqtt.client as mqtt
+from meshtastic.protobuf import mesh_pb2
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+# meshtastic stream API framing: START1 START2, 16-bit big-endian length, FromRadio
+FRAME_START = b"\x94\xc3"
+MAX_FRAME_SIZE = 512
+HEARTBEAT_INTERVAL = 300
+RECONNECT_DELAY = 5
+
+
+class MqttSocketBridge:
+    """
+    Drives a paho client from the event loop: its socket is watched with
+    add_reader/add_writer and loop_misc() runs once per second, as in paho's
+    asyncio example. All paho callbacks therefore run on the event loop.
+
+    connect() blocks on DNS, TCP and TLS and runs in an executor; the socket
+    callbacks it triggers there are handed over to the event loop.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self._misc = None
+        self._loop_thread = threading.get_ident()
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call(self, callback, *args):
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._call(self._open, sock)
+
+    def _open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self._misc = self.loop.create_task(self._loop_misc())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._call(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    async def _loop_misc(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+async def run_mqtt_source(source, userdata, on_connect, on_message, on_disconnect=None):
+    """Keep an MQTT source connected until cancelled, reconnecting on failures."""
+    loop = asyncio.get_running_loop()
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, userdata=userdata)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    MqttSocketBridge(loop, client)
+    if int(source["use_tls"]) == 1:
+        client.tls_set()
+    if source["username"]:
+        client.username_pw_set(source["username"], source["password"])
+
+    disconnected = asyncio.Event()
+
+    def on_disconnected(*args):
+        if on_disconnect is not None:
+            on_disconnect(*args)
+        else:
+            logger.warning(f"Disconnected from MQTT source {source['name']}")
+        disconnected.set()
+
+    client.on_disconnect = on_disconnected
+    try:
+        while True:
+            disconnected.clear()
+            try:
+                await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        client.connect,
+                        source["address"],
+                        int(source["port"]),
+                        keepalive=int(source["keepalive"]),
+                    ),
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Failed to connect to MQTT server {source['address']} of source {source['name']}: {e}"
+                )
+            else:
+                await disconnected.wait()
+            await asyncio.sleep(RECONNECT_DELAY)
+    finally:
+        client.disconnect()
+
+
+def frame(to_radio):
+    payload = to_radio.SerializeToString()
+    return FRAME_START + len(payload).to_bytes(2, "big") + payload
+
+
+async def read_frames(reader):
+    """Yield the FromRadio messages of a stream, skipping device log output."""
+    while True:
+        try:
+            await reader.readuntil(FRAME_START)
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+            continue
+        length = int.from_bytes(await reader.readexactly(2), "big")
+        if length > MAX_FRAME_SIZE:
+            continue
+        payload = await reader.readexactly(length)
+        try:
+            yield mesh_pb2.FromRadio.FromString(payload)
+        except Exception as e:
+            logger.warning(f"Failed to decode FromRadio: {e}")
+
+
+async def run_tcp_source(source, on_from_radio):
+    """
+    Read a device over TCP until cancelled, reconnecting on failures, and
+    pass every FromRadio to ``on_from_radio(source, from_radio)``.
+    """
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(
+                source["address"], int(source["port"])
+            )
+        except Exception as e:
+            logger.warning(
+                f"Failed to connect to {source['address']} of source {source['name']}: {e!r}"
+            )
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+
+        heartbeat = asyncio.create_task(_send_heartbeats(writer))
+        try:
+            # Ask for the device NodeDB, then the stream of received packets
+            writer.write(
+                frame(mesh_pb2.ToRadio(want_config_id=random.randint(1, 2**32 - 1)))
+            )
+            await writer.drain()
+            logger.info(f"Connected to TCP source {source['name']}")
+            async for from_radio in read_frames(reader):
+                on_from_radio(source, from_radio)
+        except Exception as e:
+            # Timeouts, other socket errors and failures of on_from_radio alike:
+            # one source failing must not stop the others
+            logger.warning(f"Lost connection to TCP source {source['name']}: {e!r}")
+        finally:
+            heartbeat.cancel()
+            writer.close()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def _send_heartbeats(writer):
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        writer.write(frame(mesh_pb2.ToRadio(heartbeat=mesh_pb2.Heartbeat())))
+        await writer.drain()
+
+
+async def serve(sources, ingest_queue, shutdown_timeout=10):
+    """
+    Run the coroutines of ``sources`` and the ingest workers until SIGTERM
+    or SIGINT, then stop reading sources, process what is already queued
+    for up to ``shutdown_timeout`` seconds and return. Sources reconnect on
+    their own, one that fails anyway is logged without stopping the others.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    ingest_queue.start()
+    tasks = [asyncio.create_task(source) for source in sources]
+    for task in tasks:
+        task.add_done_callback(_log_source_failure)
+    await stop.wait()
+    logger.info("Shutting down")
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await ingest_queue.stop(shutdown_timeout)
+
+
+def _log_source_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Source failed: {task.exception()!r}")
@@ -0,0 +1,60 @@
+import struct
+import threading
+
+MAGIC = b"MPECAP01"
+
+# timestamp (unix seconds), topic length, payload length
+RECORD_HEADER = struct.Struct("<dHI")
+
+
+class CaptureWriter:
+    """
+    Appends raw MQTT messages to a capture file.
+
+    The file starts with MAGIC and holds one record per message: a
+    RECORD_HEADER followed by the UTF-8 topic and the payload as received.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def write(self, timestamp, topic, payload):
+        topic = topic.encode()
+        with self._lock:
+            self._file.write(
+                RECORD_HEADER.pack(timestamp, len(topic), len(payload)) + topic
+            )
+            self._file.write(payload)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """
+    Yield (timestamp, topic, payload) records of a capture file. A truncated
+    last record, as left by an exporter killed while recording, is ignored.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a meshtastic-prometheus-exporter capture")
+
+    offset = len(MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, topic_length, payload_length = RECORD_HEADER.unpack_from(
+            data, offset
+        )
+        offset += RECORD_HEADER.size
+        topic = data[offset : offset + topic_length].decode()
+        offset += topic_length
+        payload = data[offset : offset + payload_length]
+        offset += payload_length
+        if len(payload) != payload_length:
+            return
+        yield timestamp, topic, payload
@@ -0,0 +1,119 @@
+import json
+import re
+
+from prometheus_client.core import Metric
+from prometheus_client.utils import floatToGoString
+
+from meshtastic_prometheus_exporter.metrics import INSTRUMENTS, OBSERVABLES, snapshot
+
+_INVALID_LABEL_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Collector:
+    """
+    prometheus_client collector serving the instruments of metrics.py from
+    their own state (METRICS_BACKEND=prometheus), without going through the
+    OTel SDK and PrometheusMetricReader on every scrape.
+
+    Label names and values are converted the way the OTel Prometheus
+    exporter does, so both backends expose the same series.
+    """
+
+    def __init__(self, instruments=None, observables=None, shards=None):
+        self.instruments = INSTRUMENTS if instruments is None else instruments
+        self.observables = OBSERVABLES if observables is None else observables
+        # shards.ShardRouter of INGEST_PROCESSES, whose state is merged in
+        self.shards = shards
+        self._label_names = {}
+
+    def describe(self):
+        # Families depend on what has been recorded, do not collect on register
+        return []
+
+    def collect(self):
+        state = snapshot(self.instruments)
+        if self.shards is not None:
+            for shard_state in self.shards.snapshots():
+                merge(state, shard_state)
+
+        for name, (kind, description, series) in state.items():
+            family = self._family(name, description, kind)
+            if kind == "counter":
+                sample_name = family.name + "_total"
+                for key, total in series.items():
+                    family.add_sample(sample_name, self._labels(key), total)
+            elif kind == "histogram":
+                self._add_histogram_samples(family, INSTRUMENTS[name], series)
+            else:
+                for key, (value, _) in series.items():
+                    family.add_sample(family.name, self._labels(key), value)
+            if family.samples:
+                yield family
+
+        for kind, name, callbacks, description in list(self.observables):
+            family = self._family(name, description, kind)
+            sample_name = family.name + "_total" if kind == "counter" else name
+            for callback in callbacks:
+                for observation in callback(None):
+                    family.add_sample(
+                        sample_name,
+                        self._labels((observation.attributes or {}).items()),
+                        observation.value,
+                    )
+            if family.samples:
+                yield family
+
+    def _add_histogram_samples(self, family, histogram, series):
+        bounds = [floatToGoString(b) for b in histogram.boundaries] + ["+Inf"]
+        for key, (counts, total) in series.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                family.add_sample(
+                    family.name + "_bucket", {**labels, "le": bound}, cumulative
+                )
+            family.add_sample(family.name + "_count", labels, cumulative)
+            family.add_sample(family.name + "_sum", labels, total)
+
+    def _family(self, name, description, kind):
+        if kind == "counter" and name.endswith("_total"):
+            name = name[: -len("_total")]
+        return Metric(name, description, kind)
+
+    def _labels(self, items):
+        labels = {}
+        for key, value in items:
+            name = self._label_names.get(key)
+            if name is None:
+                name = self._label_names[key] = _INVALID_LABEL_CHARACTERS.sub("_", key)
+            labels[name] = (
+                value if isinstance(value, str) else json.dumps(value, default=str)
+            )
+        return labels
+
+
+def merge(state, other):
+    """
+    Merge the metrics.snapshot() ``other`` into ``state``: counters and
+    histograms are summed, gauges keep the most recently updated value.
+    """
+    for name, (kind, description, series) in other.items():
+        if name not in state:
+            state[name] = (kind, description, series)
+            continue
+        merged = state[name][2]
+        if kind == "counter":
+            for key, total in series.items():
+                merged[key] = merged.get(key, 0) + total
+        elif kind == "histogram":
+            for key, (counts, total) in series.items():
+                if key in merged:
+                    merged_counts, merged_total = merged[key]
+                    counts = tuple(map(sum, zip(merged_counts, counts)))
+                    total += merged_total
+                merged[key] = (counts, total)
+        else:
+            for key, value in series.items():
+                if key not in merged or merged[key][1] < value[1]:
+                    merged[key] = value
@@ -0,0 +1,115 @@
+import base64
+import logging
+import struct
+
+from google.protobuf.message import DecodeError
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # CHANNEL_KEYS requires the decrypt extra
+    Cipher = None
+
+from meshtastic_prometheus_exporter.metrics import meshtastic_exporter_decryptions_total
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+# Key of PSK index 1 (AQ==), the default key of the LongFast preset.
+# Indexes 2-10 are the same key with its last byte incremented by index - 1.
+DEFAULT_KEY = bytes.fromhex("d4f1bb3a20290759f0bcffabcf4e6901")
+
+# A wrong key still yields a Data now and then, but hardly ever one with a
+# known port
+KNOWN_PORTNUMS = frozenset(portnums_pb2.PortNum.values()) - {portnums_pb2.UNKNOWN_APP}
+
+
+def expand_psk(psk):
+    """Return the AES key of a channel PSK, or None if it is not encrypted."""
+    if len(psk) == 0 or psk == b"\x00":
+        return None
+    if len(psk) == 1:
+        return DEFAULT_KEY[:-1] + bytes([(DEFAULT_KEY[-1] + psk[0] - 1) & 0xFF])
+    if len(psk) < 16:
+        return psk.ljust(16, b"\x00")
+    if len(psk) < 32:
+        return psk.ljust(32, b"\x00")
+    return psk[:32]
+
+
+def xor_hash(data):
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
+def channel_hash(name, key):
+    """MeshPacket.channel of packets encrypted with ``key`` on channel ``name``."""
+    return xor_hash(name.encode()) ^ xor_hash(key)
+
+
+def parse_channel_keys(value):
+    """
+    Parse CHANNEL_KEYS, e.g. ``LongFast=AQ==;Private=<base64 PSK>``, into a
+    dict of channel hashes to the (channel name, AES algorithm) pairs of the
+    channels with that hash, so that the key schedule is set up once per
+    channel rather than once per packet.
+    """
+    channel_keys = {}
+    for entry in value.split(";"):
+        if not entry.strip():
+            continue
+        name, _, psk = entry.partition("=")
+        name = name.strip()
+        key = expand_psk(base64.b64decode(psk.strip()))
+        if key is None:
+            continue
+        if Cipher is None:
+            raise ValueError("CHANNEL_KEYS requires the cryptography package")
+        channel_keys.setdefault(channel_hash(name, key), []).append(
+            (name, algorithms.AES(key))
+        )
+    return channel_keys
+
+
+def count_decryption(channel_hash, result, channel="unknown"):
+    meshtastic_exporter_decryptions_total.add(
+        1,
+        attributes={
+            "channel": channel,
+            "channel_hash": str(channel_hash),
+            "result": result,
+        },
+    )
+
+
+def decrypt_mesh_packet(packet, channel_keys):
+    """
+    Decrypt ``packet.encrypted`` into ``packet.decoded`` with the keys of its
+    channel hash and return the name of the channel, or None if the channel
+    is unknown or no key yields a valid Data. The outcome is counted in
+    meshtastic_exporter_decryptions_total.
+    """
+    candidates = channel_keys.get(packet.channel)
+    if not candidates:
+        count_decryption(packet.channel, "unknown_channel")
+        return None
+
+    # AES-CTR with the packet id (64 bits) and sender (32 bits) as nonce
+    nonce = struct.pack("<QI4x", packet.id, getattr(packet, "from"))
+    for name, algorithm in candidates:
+        decryptor = Cipher(algorithm, modes.CTR(nonce)).decryptor()
+        plaintext = decryptor.update(packet.encrypted) + decryptor.finalize()
+        try:
+            data = mesh_pb2.Data.FromString(plaintext)
+        except DecodeError:
+            continue
+        if data.portnum not in KNOWN_PORTNUMS:
+            continue
+        packet.decoded.CopyFrom(data)
+        count_decryption(packet.channel, "success", name)
+        return name
+
+    logger.debug(f"Failed to decrypt packet {packet.id} on channel {packet.channel}")
+    count_decryption(packet.channel, "failure", candidates[0][0])
+    return None
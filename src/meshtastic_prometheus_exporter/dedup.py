@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import deque
+
+from opentelemetry.metrics import Observation
+
+
+class DedupWindow:
+    """
+    Remembers (from, id) pairs of recently seen MeshPackets for ``ttl`` seconds.
+
+    Keys are kept in a dict for O(1) lookups and in a ring of time buckets,
+    each covering ``ttl / buckets`` seconds, so that expiry drops a whole
+    bucket at once instead of tracking a deadline per key. At most ``maxsize``
+    keys are held; when full, the oldest key is evicted early.
+    """
+
+    def __init__(self, ttl, maxsize, buckets=16, timer=time.monotonic):
+        if ttl <= 0:
+            raise ValueError(f"ttl must be positive, not {ttl}")
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, not {maxsize}")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._timer = timer
+        self._span = ttl / buckets
+        self._keys = {}
+        self._buckets = deque(deque() for _ in range(buckets))
+        self._bucket_start = timer()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def seen(self, node, packet_id):
+        """Record the packet and return True if it was already in the window."""
+        key = (node << 32) | packet_id
+        with self._lock:
+            self._expire(self._timer())
+            if key in self._keys:
+                self.hits += 1
+                return True
+            self.misses += 1
+            if len(self._keys) >= self.maxsize:
+                self._evict_oldest_key()
+                self.evictions += 1
+            self._keys[key] = None
+            self._buckets[-1].append(key)
+            return False
+
+    def _expire(self, now):
+        steps = int((now - self._bucket_start) // self._span)
+        if steps <= 0:
+            return
+        for _ in range(min(steps, len(self._buckets))):
+            self._drop_oldest_bucket()
+        self._bucket_start += steps * self._span
+
+    def _drop_oldest_bucket(self):
+        bucket = self._buckets.popleft()
+        for key in bucket:
+            del self._keys[key]
+        dropped = len(bucket)
+        bucket.clear()
+        self._buckets.append(bucket)
+        return dropped
+
+    def _evict_oldest_key(self):
+        # Pop from the oldest non-empty bucket in place: rotating the ring
+        # would shift every other bucket one span closer to expiry
+        for bucket in self._buckets:
+            if bucket:
+                del self._keys[bucket.popleft()]
+                return
+
+    def observe_hits(self, options):
+        yield Observation(self.hits)
+
+    def observe_misses(self, options):
+        yield Observation(self.misses)
+
+    def observe_evictions(self, options):
+        yield Observation(self.evictions)
+
+    def observe_size(self, options):
+        yield Observation(len(self), attributes={"cache": "dedup"})
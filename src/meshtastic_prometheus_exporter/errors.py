@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+import traceback
+
+from meshtastic_prometheus_exporter.metrics import (
+    Attributes,
+    meshtastic_exporter_errors_total,
+)
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def fingerprint(e):
+    """
+    Return (exception type, location) of ``e``, the location being the
+    innermost frame of its traceback in the exporter's own modules (or the
+    innermost frame if none is), as ``module.py:function:line``.
+    """
+    location = innermost = "unknown"
+    tb = e.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        innermost = (
+            f"{os.path.basename(code.co_filename)}:{code.co_name}:{tb.tb_lineno}"
+        )
+        if code.co_filename.startswith(PACKAGE_DIR):
+            location = innermost
+        tb = tb.tb_next
+    if location == "unknown":
+        location = innermost
+    return type(e).__name__, location
+
+
+class ErrorReporter:
+    """
+    Aggregates the exceptions raised while processing packets, so that a
+    malformed packet variant repeated thousands of times does not pay for
+    formatting, logging and sending every single one.
+
+    Every exception is counted in meshtastic_exporter_errors_total by its
+    fingerprint(), but only the first one of a fingerprint in every
+    ``interval`` seconds is logged with its traceback and passed to
+    ``capture`` (sentry_sdk.capture_exception when Sentry is enabled),
+    along with the number of exceptions suppressed since the previous one.
+    Exceptions reported with a level below ERROR, such as undecodable
+    payloads from a broker, are logged without traceback and not captured.
+    """
+
+    def __init__(self, interval, capture=None, timer=time.monotonic):
+        self.interval = interval
+        self.capture = capture
+        self._timer = timer
+        # fingerprint to [Attributes, last sample at, suppressed since]
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def report(self, e, describe=None, level=logging.ERROR):
+        """
+        Count ``e`` and return True if it was sampled. ``describe()`` returns
+        the context of the exception, it is only called for samples.
+        """
+        key = fingerprint(e)
+        now = self._timer()
+        with self._lock:
+            entry = self._fingerprints.get(key)
+            if entry is None:
+                entry = self._fingerprints[key] = [
+                    Attributes(type=key[0], location=key[1]),
+                    None,
+                    0,
+                ]
+            attributes, last, suppressed = entry
+            sampled = last is None or now - last >= self.interval
+            if sampled:
+                entry[1] = now
+                entry[2] = 0
+            else:
+                entry[2] += 1
+        meshtastic_exporter_errors_total.add(1, attributes=attributes)
+        if not sampled:
+            return False
+
+        context = f" while processing {describe()}" if describe is not None else ""
+        repeated = f" ({suppressed} more since the last report)" if suppressed else ""
+        if level < logging.ERROR:
+            logger.log(level, f"{key[0]} occurred{context}{repeated}: {e}")
+            return True
+        logger.error(
+            f"{key[0]} at {key[1]} occurred{context}{repeated}, please consider submitting a PR/issue on GitHub: {';'.join(''.join(traceback.format_exception(type(e), e, e.__traceback__)).splitlines())}"
+        )
+        if self.capture is not None:
+            self.capture(e)
+        return True
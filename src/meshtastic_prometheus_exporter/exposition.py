@@ -0,0 +1,99 @@
+import gzip
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from meshtastic_prometheus_exporter import metrics
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+# How long a snapshot is served while nothing is recorded, so that the
+# process metrics of the registry do not freeze on an idle mesh
+MAX_CLEAN_AGE = 60
+
+
+class ExpositionCache:
+    """
+    Rendered /metrics body, plain and gzip-compressed, shared by all scrapers.
+
+    The snapshot is rebuilt when it is older than ``interval`` seconds and an
+    instrument has recorded something since it was rendered. A single
+    request renders it; concurrent requests wait for that render and are
+    served the same snapshot.
+    """
+
+    def __init__(self, registry=REGISTRY, interval=5.0, timer=time.monotonic):
+        self.registry = registry
+        self.interval = interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        # (rendered at, plain body, gzip body)
+        self._snapshot = None
+
+    def _fresh(self, snapshot):
+        if snapshot is None:
+            return False
+        age = self._timer() - snapshot[0]
+        return age < self.interval or (not metrics.dirty and age < MAX_CLEAN_AGE)
+
+    def get(self):
+        """Return (plain body, gzip body)."""
+        snapshot = self._snapshot
+        if not self._fresh(snapshot):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._fresh(snapshot):
+                    snapshot = self._render()
+        return snapshot[1], snapshot[2]
+
+    def _render(self):
+        # Cleared first, so that measurements during the render mark the
+        # snapshot dirty again
+        metrics.dirty = False
+        started = self._timer()
+        body = generate_latest(self.registry)
+        self._snapshot = (started, body, gzip.compress(body, compresslevel=6))
+        logger.debug(
+            f"Rendered /metrics ({len(body)} bytes) in {self._timer() - started:.3f}s"
+        )
+        return self._snapshot
+
+
+class ExpositionHandler(BaseHTTPRequestHandler):
+    cache = None
+
+    def do_GET(self):
+        plain, compressed = self.cache.get()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE_LATEST)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            self.send_header("Content-Encoding", "gzip")
+            body = compressed
+        else:
+            body = plain
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exposition_server(port, addr="0.0.0.0", cache=None):
+    """
+    Serve the cached exposition on every path, like
+    prometheus_client.start_http_server, from a daemon thread.
+    """
+    handler = type(
+        "ExpositionHandler", (ExpositionHandler,), {"cache": cache or ExpositionCache()}
+    )
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="exposition", daemon=True
+    )
+    thread.start()
+    return server, thread
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import queue
+import threading
+
+from opentelemetry.metrics import Observation
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+class IngestQueue:
+    """
+    Bounded queue between the MQTT network thread and a pool of workers.
+
+    put() never blocks for longer than ``block_timeout`` so that the network
+    thread keeps answering keepalives. When the queue is full, ``policy``
+    decides what is dropped:
+
+    * ``block`` waits up to ``block_timeout`` seconds for a free slot, then
+      drops the new message
+    * ``drop_newest`` drops the new message right away
+    * ``drop_oldest`` drops the oldest queued message to make room
+    """
+
+    def __init__(
+        self, handler, maxsize, workers=1, policy="drop_oldest", block_timeout=1.0
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ingest drop policy {policy}")
+        self.handler = handler
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def put(self, item):
+        try:
+            if self.policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+                return
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            if self.policy != "drop_oldest":
+                self._drop(item)
+                return
+
+        while True:
+            try:
+                self._drop(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _drop(self, item):
+        with self._lock:
+            self.dropped += 1
+        logger.debug(f"Ingest queue is full, dropped message from `{item[0]}` topic")
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self.handler(*item)
+            except Exception as e:
+                logger.warning(f"Exception occurred while processing {item[0]}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def observe_depth(self, options):
+        yield Observation(self._queue.qsize())
+
+    def observe_dropped(self, options):
+        yield Observation(self.dropped, attributes={"policy": self.policy})
+
+
+class AsyncIngestQueue:
+    """
+    IngestQueue for RUNTIME=asyncio: a bounded asyncio.Queue consumed by
+    ``workers`` tasks of the event loop.
+
+    put() is called from callbacks running on the event loop and must not
+    wait, so the ``block`` policy behaves like ``drop_newest`` and there is no
+    ``block_timeout``.
+    """
+
+    def __init__(self, handler, maxsize, workers=1, policy="drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ingest drop policy {policy}")
+        self.handler = handler
+        self.policy = policy
+        self.dropped = 0
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize)
+        self._tasks = []
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"ingest-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self, timeout):
+        """Process the queued messages for up to ``timeout`` seconds, then cancel the workers."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Dropping {self._queue.qsize()} queued messages on shutdown"
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            if self.policy != "drop_oldest":
+                self._drop(item)
+                return
+        self._drop(self._queue.get_nowait())
+        self._queue.task_done()
+        self._queue.put_nowait(item)
+
+    def _drop(self, item):
+        self.dropped += 1
+        logger.debug(f"Ingest queue is full, dropped message from `{item[0]}` topic")
+
+    async def _work(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                self.handler(*item)
+            except Exception as e:
+                logger.warning(f"Exception occurred while processing {item[0]}: {e}")
+            finally:
+                self._queue.task_done()
+            # Handlers do not await, let the network tasks run between messages
+            await asyncio.sleep(0)
+
+    def observe_depth(self, options):
+        yield Observation(self._queue.qsize())
+
+    def observe_dropped(self, options):
+        yield Observation(self.dropped, attributes={"policy": self.policy})
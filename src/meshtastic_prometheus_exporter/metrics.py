@@ -1,131 +1,694 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
 from opentelemetry import metrics
+from opentelemetry.metrics import Observation
 
 meter = metrics.get_meter("meshtastic_prometheus_exporter")
 
-meshtastic_mesh_packets_total = meter.create_counter(
+# Attributes of the series that measurements are folded into once an
+# instrument has reached its series limit
+OVERFLOW_ATTRIBUTES = {"otel.metric.overflow": "true"}
+
+# Most stale gauge series removed per collection, so that a large part of the
+# mesh going silent at once is forgotten over several scrapes
+SWEEP_BATCH = 1000
+
+# Buckets of the hop count histograms, hop_limit is at most 7
+HOP_BOUNDARIES = (0, 1, 2, 3, 4, 5, 6, 7)
+# Buckets of the inter-arrival histograms, from bursts to daily NodeInfo
+INTERARRIVAL_BOUNDARIES = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 10800, 43200, 86400)
+
+INSTRUMENTS = {}
+
+# (kind, name, callbacks, description) of the observable instruments
+OBSERVABLES = []
+
+# Set by every measurement, cleared by exposition.ExpositionCache when it
+# renders /metrics
+dirty = True
+
+# Called with (instrument name, series keys) when gauge series expire, to
+# free whatever the metrics backend keeps for them
+SERIES_EXPIRED_HOOKS = []
+
+
+class Attributes(dict):
+    """
+    Immutable attribute set, for attribute sets reused across measurements
+    such as the per-node ones of nodedb.NodeLabels. The series key of every
+    instrument it is recorded with is computed once and kept.
+    """
+
+    __slots__ = ("_keys",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._keys = {}
+
+    def key(self, instrument):
+        key = self._keys.get(instrument.name)
+        if key is None:
+            key = self._keys[instrument.name] = instrument._project(self)
+        return key
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Attributes are immutable")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = __ior__ = _immutable
+
+
+class Instrument:
+    """
+    Base of the instruments below, which keep the OTel instrument API but
+    enforce a limit on the number of series per instrument. Measurements
+    for new attribute sets beyond ``series_limit`` are recorded with
+    OVERFLOW_ATTRIBUTES instead.
+
+    Series are counted after projecting attributes on ``attribute_keys``,
+    the attributes kept by the View of the instrument, so the limit applies
+    to the series actually exported.
+    """
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.attribute_keys = None
+        self.series_limit = 0
+        self._series = set()
+        # Hashes only, to count each dropped series once without keeping it
+        self._dropped = set()
+        self._lock = threading.Lock()
+        INSTRUMENTS[name] = self
+
+    def _key(self, attributes):
+        if type(attributes) is Attributes:
+            return attributes.key(self)
+        return self._project(attributes)
+
+    def _project(self, attributes):
+        if self.attribute_keys is None:
+            return frozenset(attributes.items())
+        return frozenset(
+            (k, v) for k, v in attributes.items() if k in self.attribute_keys
+        )
+
+    def _limit(self, attributes, key):
+        if not self.series_limit or key in self._series:
+            return attributes
+        with self._lock:
+            if len(self._series) < self.series_limit:
+                self._series.add(key)
+                return attributes
+            dropped = hash(key) not in self._dropped
+            self._dropped.add(hash(key))
+        if dropped:
+            meshtastic_exporter_dropped_series_total.add(
+                1, attributes={"instrument": self.name}
+            )
+        return OVERFLOW_ATTRIBUTES
+
+
+class Counter(Instrument):
+    """
+    Counter recording into the OTel SDK, or into ``_totals`` (series key to
+    total) once use_native_backend() has been called.
+    """
+
+    def __init__(self, name, description=""):
+        super().__init__(name, description)
+        self._totals = None
+        self._counter = meter.create_counter(name=name, description=description)
+
+    def add(self, amount, attributes=None):
+        global dirty
+        dirty = True
+        if self._totals is None:
+            if attributes and self.series_limit:
+                attributes = self._limit(attributes, self._key(attributes))
+            self._counter.add(amount, attributes=attributes)
+            return
+
+        key = self._key(attributes or {})
+        if (
+            self.series_limit
+            and key
+            and self._limit(attributes, key) is OVERFLOW_ATTRIBUTES
+        ):
+            key = self._key(OVERFLOW_ATTRIBUTES)
+        with self._lock:
+            self._totals[key] = self._totals.get(key, 0) + amount
+
+    def series(self):
+        """Return (series key, total) of every series."""
+        with self._lock:
+            return list(self._totals.items())
+
+
+class Gauge(Instrument):
+    """
+    Gauge keeping the last value of every series until it is not updated
+    for ``staleness`` seconds (0 keeps series forever).
+
+    Series are kept in update order and exported through an observable gauge.
+    Collection walks them from the most recently updated and stops at the
+    first stale one; stale series are removed from the head, at most
+    SWEEP_BATCH per collection.
+    """
+
+    def __init__(self, name, description="", timer=time.monotonic):
+        super().__init__(name, description)
+        self.staleness = 0
+        self._timer = timer
+        self._values = OrderedDict()
+        self._gauge = meter.create_observable_gauge(
+            name=name, callbacks=[self.observe], description=description
+        )
+
+    def set(self, amount, attributes=None):
+        global dirty
+        dirty = True
+        # Observations are exported later, callers may reuse their dict
+        if not isinstance(attributes, Attributes):
+            attributes = dict(attributes or {})
+        key = self._key(attributes)
+        attributes = self._limit(attributes, key)
+        if attributes is OVERFLOW_ATTRIBUTES:
+            key = self._key(attributes)
+        with self._lock:
+            self._values[key] = (self._timer(), amount, attributes)
+            self._values.move_to_end(key)
+
+    def observe(self, options=None):
+        return [
+            Observation(amount, attributes)
+            for _, attributes, amount, _ in self.series()
+        ]
+
+    def series(self):
+        """
+        Return (series key, attributes, value, update time) of the series
+        updated within ``staleness``, most recently updated first.
+        """
+        with self._lock:
+            if self.staleness:
+                deadline = self._timer() - self.staleness
+                expired = self._sweep(deadline)
+            else:
+                deadline = float("-inf")
+                expired = []
+            series = []
+            for key, (updated, amount, attributes) in reversed(self._values.items()):
+                if updated < deadline:
+                    break
+                series.append((key, attributes, amount, updated))
+
+        if expired:
+            for hook in SERIES_EXPIRED_HOOKS:
+                hook(self.name, expired)
+        return series
+
+    def _sweep(self, deadline):
+        values = self._values
+        expired = []
+        while values and len(expired) < SWEEP_BATCH:
+            key, (updated, _, _) = next(iter(values.items()))
+            if updated >= deadline:
+                break
+            del values[key]
+            self._series.discard(key)
+            expired.append(key)
+        return expired
+
+
+class Histogram(Instrument):
+    """
+    Histogram with fixed bucket ``boundaries``, kept in its own state in both
+    backends: recording into the OTel SDK costs several microseconds, too
+    much for the per-packet timings it is used for. It is exported by
+    collector.Collector, registered for the histograms alone with the OTel
+    backend.
+
+    Every thread records into buckets of its own, so that recording takes no
+    lock; series() adds them up. Bucket counts are kept in fixed-size arrays,
+    as some histograms have a series per node. Like gauges, series not
+    recorded into for ``staleness`` seconds are removed by series().
+    """
+
+    def __init__(self, name, boundaries, description="", timer=time.monotonic):
+        super().__init__(name, description)
+        self.boundaries = tuple(boundaries)
+        self.staleness = 0
+        self._timer = timer
+        self._zeros = bytes(8 * (len(self.boundaries) + 1))
+        self._local = threading.local()
+        # Series key to [count per bucket (+Inf last), sum, last recorded at],
+        # one dict per thread
+        self._thread_buckets = []
+
+    def record(self, amount, attributes=None):
+        global dirty
+        dirty = True
+        key = self._key({} if attributes is None else attributes)
+        if self.series_limit and self._limit(attributes, key) is OVERFLOW_ATTRIBUTES:
+            key = self._key(OVERFLOW_ATTRIBUTES)
+        try:
+            buckets = self._local.buckets
+        except AttributeError:
+            buckets = self._local.buckets = {}
+            with self._lock:
+                self._thread_buckets.append(buckets)
+        series = buckets.get(key)
+        if series is None:
+            series = buckets[key] = [array("Q", self._zeros), 0, 0]
+        series[0][bisect_left(self.boundaries, amount)] += 1
+        series[1] += amount
+        series[2] = self._timer()
+
+    def series(self):
+        """Return (series key, (count per bucket, sum)) of every series."""
+        merged = {}
+        updated = {}
+        with self._lock:
+            thread_buckets = list(self._thread_buckets)
+        for buckets in thread_buckets:
+            for key, (counts, total, recorded) in list(buckets.items()):
+                if key in merged:
+                    merged_counts, merged_total = merged[key]
+                    counts = map(sum, zip(merged_counts, counts))
+                    total += merged_total
+                    recorded = max(recorded, updated[key])
+                merged[key] = (tuple(counts), total)
+                updated[key] = recorded
+
+        if self.staleness:
+            deadline = self._timer() - self.staleness
+            expired = [key for key, recorded in updated.items() if recorded < deadline]
+            # A thread recording into an expired series right now may lose
+            # that measurement, which is as good as the series being stale
+            for key in expired:
+                for buckets in thread_buckets:
+                    buckets.pop(key, None)
+                del merged[key]
+            if expired:
+                with self._lock:
+                    self._series.difference_update(expired)
+        return list(merged.items())
+
+    def _clear(self):
+        for buckets in self._thread_buckets:
+            buckets.clear()
+
+
+def expire_unobserved(name, callback):
+    """
+    Wrap the callback of an observable instrument so that the series it
+    stops yielding, such as the edges of topology.TopologyIndex once they
+    expire, are passed to SERIES_EXPIRED_HOOKS like expired gauge series.
+    """
+    observed = set()
+
+    def observe(options):
+        current = set()
+        for observation in callback(options):
+            current.add(frozenset((observation.attributes or {}).items()))
+            yield observation
+        expired = observed - current
+        observed.clear()
+        observed.update(current)
+        if expired:
+            for hook in SERIES_EXPIRED_HOOKS:
+                hook(name, list(expired))
+
+    return observe
+
+
+def create_observable_counter(name, callbacks, description=""):
+    """meter.create_observable_counter, also exported by the native backend."""
+    OBSERVABLES.append(("counter", name, callbacks, description))
+    return meter.create_observable_counter(
+        name,
+        callbacks=[expire_unobserved(name, callback) for callback in callbacks],
+        description=description,
+    )
+
+
+def create_observable_gauge(name, callbacks, description=""):
+    """meter.create_observable_gauge, also exported by the native backend."""
+    OBSERVABLES.append(("gauge", name, callbacks, description))
+    return meter.create_observable_gauge(
+        name,
+        callbacks=[expire_unobserved(name, callback) for callback in callbacks],
+        description=description,
+    )
+
+
+def use_native_backend():
+    """
+    Make the instruments keep their own state for collector.Collector instead
+    of recording into the OTel SDK.
+    """
+    for instrument in INSTRUMENTS.values():
+        if isinstance(instrument, Counter) and instrument._totals is None:
+            instrument._totals = {}
+
+
+def reset_instruments():
+    """Forget the state of all instruments, e.g. in a freshly forked shard."""
+    for instrument in INSTRUMENTS.values():
+        with instrument._lock:
+            instrument._series.clear()
+            instrument._dropped.clear()
+            if isinstance(instrument, Counter) and instrument._totals is not None:
+                instrument._totals.clear()
+            elif isinstance(instrument, Gauge):
+                instrument._values.clear()
+            elif isinstance(instrument, Histogram):
+                instrument._clear()
+
+
+def snapshot(instruments=None):
+    """
+    Return {name: (kind, description, series)} of the native backend state
+    of ``instruments`` (all by default). Counter series map series keys to
+    totals, gauge series map series keys to (value, update time), histogram
+    series map series keys to (count per bucket, sum).
+    """
+    state = {}
+    if instruments is None:
+        instruments = INSTRUMENTS
+    for instrument in list(instruments.values()):
+        if isinstance(instrument, Counter) and instrument._totals is not None:
+            series = dict(instrument.series())
+            kind = "counter"
+        elif isinstance(instrument, Gauge):
+            series = {
+                key: (value, updated) for key, _, value, updated in instrument.series()
+            }
+            kind = "gauge"
+        elif isinstance(instrument, Histogram):
+            series = dict(instrument.series())
+            kind = "histogram"
+        else:
+            continue
+        state[instrument.name] = (kind, instrument.description, series)
+    return state
+
+
+meshtastic_exporter_dropped_series_total = Counter(
+    name="meshtastic_exporter_dropped_series_total",
+    description="Attribute sets folded into the overflow series because the instrument reached METRIC_SERIES_LIMIT",
+)
+
+
+def parse_metric_attributes(value):
+    """
+    Parse METRIC_ATTRIBUTES, e.g.
+    ``meshtastic_mesh_packets_total=source,type;meshtastic_telemetry_*=source``,
+    into a dict of instrument name patterns to the set of attributes to keep.
+    """
+    attribute_keys = {}
+    for entry in value.split(";"):
+        if not entry.strip():
+            continue
+        pattern, _, keys = entry.partition("=")
+        attribute_keys[pattern.strip()] = {k.strip() for k in keys.split(",") if k}
+    return attribute_keys
+
+
+def configure_instruments(attribute_keys, series_limit, staleness=0):
+    """
+    Apply METRIC_ATTRIBUTES, METRIC_SERIES_LIMIT and METRIC_STALENESS to the
+    instruments and return the Views to register on the MeterProvider.
+
+    meshtastic_exporter_dropped_series_total is exempt from the series limit,
+    it has at most one series per instrument and must report all of them.
+
+    Every instrument takes the attributes of the first pattern it matches.
+    The SDK would apply every View matching an instrument, so there is one
+    View per instrument and observable created so far rather than per
+    pattern.
+    """
+    from opentelemetry.sdk.metrics.view import View
+
+    views = []
+    names = list(INSTRUMENTS) + [name for _, name, _, _ in OBSERVABLES]
+    for name in dict.fromkeys(names):
+        instrument = INSTRUMENTS.get(name)
+        if instrument is not None:
+            if instrument is not meshtastic_exporter_dropped_series_total:
+                instrument.series_limit = series_limit
+            if isinstance(instrument, (Gauge, Histogram)):
+                instrument.staleness = staleness
+        for pattern, keys in attribute_keys.items():
+            if fnmatchcase(name, pattern):
+                keys = keys | set(OVERFLOW_ATTRIBUTES)
+                if instrument is not None:
+                    instrument.attribute_keys = keys
+                views.append(View(instrument_name=name, attribute_keys=keys))
+                break
+    return views
+
+
+def forget_sdk_series(provider, name, keys):
+    """
+    SERIES_EXPIRED_HOOKS callback dropping the aggregations that the OTel SDK
+    MeterProvider keeps for every attribute set it has ever seen.
+    """
+    for storage in provider._measurement_consumer._reader_storages.values():
+        for instrument, matches in list(
+            storage._instrument_view_instrument_matches.items()
+        ):
+            if instrument.name != name:
+                continue
+            for match in matches:
+                # Keys of observable series are not projected on the View yet
+                attribute_keys = match._view._attribute_keys
+                with match._lock:
+                    for key in keys:
+                        if attribute_keys is not None:
+                            key = frozenset(
+                                (k, v) for k, v in key if k in attribute_keys
+                            )
+                        match._attributes_aggregation.pop(key, None)
+
+
+meshtastic_mesh_packets_total = Counter(
     name="meshtastic_mesh_packets_total",
 )
 
-meshtastic_node_info_last_heard_timestamp_seconds = meter.create_gauge(
+meshtastic_node_info_last_heard_timestamp_seconds = Gauge(
     name="meshtastic_node_info_last_heard_timestamp_seconds",
 )
 
-meshtastic_neighbor_info_snr_decibels = meter.create_gauge(
+meshtastic_neighbor_info_snr_decibels = Gauge(
     name="meshtastic_neighbor_info_snr_decibels",
 )
 
-meshtastic_neighbor_info_last_rx_time = meter.create_gauge(
+meshtastic_neighbor_info_last_rx_time = Gauge(
     name="meshtastic_neighbor_info_last_rx_time",
 )
 
-meshtastic_telemetry_device_battery_level_percent = meter.create_gauge(
+meshtastic_telemetry_device_battery_level_percent = Gauge(
     name="meshtastic_telemetry_device_battery_level_percent",
 )
 
-meshtastic_telemetry_device_voltage_volts = meter.create_gauge(
+meshtastic_telemetry_device_voltage_volts = Gauge(
     name="meshtastic_telemetry_device_voltage_volts",
 )
 
-meshtastic_telemetry_device_channel_utilization_percent = meter.create_gauge(
+meshtastic_telemetry_device_channel_utilization_percent = Gauge(
     name="meshtastic_telemetry_device_channel_utilization_percent",
 )
 
-meshtastic_telemetry_device_air_util_tx_percent = meter.create_gauge(
+meshtastic_telemetry_device_air_util_tx_percent = Gauge(
     name="meshtastic_telemetry_device_air_util_tx_percent",
 )
 
-meshtastic_telemetry_env_temperature_celsius = meter.create_gauge(
+meshtastic_telemetry_env_temperature_celsius = Gauge(
     name="meshtastic_telemetry_env_temperature_celsius",
 )
 
-meshtastic_telemetry_env_relative_humidity_percent = meter.create_gauge(
+meshtastic_telemetry_env_relative_humidity_percent = Gauge(
     name="meshtastic_telemetry_env_relative_humidity_percent",
 )
 
-meshtastic_telemetry_env_barometric_pressure_pascal = meter.create_gauge(
+meshtastic_telemetry_env_barometric_pressure_pascal = Gauge(
     name="meshtastic_telemetry_env_barometric_pressure_pascal",
 )
 
-meshtastic_telemetry_env_gas_resistance_ohms = meter.create_gauge(
+meshtastic_telemetry_env_gas_resistance_ohms = Gauge(
     name="meshtastic_telemetry_env_gas_resistance_ohms",
 )
 
-meshtastic_telemetry_env_voltage_volts = meter.create_gauge(
+meshtastic_telemetry_env_voltage_volts = Gauge(
     name="meshtastic_telemetry_env_voltage_volts",
 )
 
-meshtastic_telemetry_env_current_amperes = meter.create_gauge(
+meshtastic_telemetry_env_current_amperes = Gauge(
     name="meshtastic_telemetry_env_current_amperes",
 )
 
-meshtastic_telemetry_power_ch1_voltage_volts = meter.create_gauge(
+meshtastic_telemetry_power_ch1_voltage_volts = Gauge(
     name="meshtastic_telemetry_power_ch1_voltage_volts",
 )
 
-meshtastic_telemetry_power_ch1_current_amperes = meter.create_gauge(
+meshtastic_telemetry_power_ch1_current_amperes = Gauge(
     name="meshtastic_telemetry_power_ch1_current_amperes",
 )
 
-meshtastic_telemetry_power_ch2_voltage_volts = meter.create_gauge(
+meshtastic_telemetry_power_ch2_voltage_volts = Gauge(
     name="meshtastic_telemetry_power_ch2_voltage_volts",
 )
 
-meshtastic_telemetry_power_ch2_current_amperes = meter.create_gauge(
+meshtastic_telemetry_power_ch2_current_amperes = Gauge(
     name="meshtastic_telemetry_power_ch2_current_amperes",
 )
 
-meshtastic_telemetry_power_ch3_voltage_volts = meter.create_gauge(
+meshtastic_telemetry_power_ch3_voltage_volts = Gauge(
     name="meshtastic_telemetry_power_ch3_voltage_volts",
 )
 
-meshtastic_telemetry_power_ch3_current_amperes = meter.create_gauge(
+meshtastic_telemetry_power_ch3_current_amperes = Gauge(
     name="meshtastic_telemetry_power_ch3_current_amperes",
 )
 
-meshtastic_telemetry_air_quality_pm10_standard = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm10_standard = Gauge(
     name="meshtastic_telemetry_air_quality_pm10_standard",
 )
 
-meshtastic_telemetry_air_quality_pm25_standard = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm25_standard = Gauge(
     name="meshtastic_telemetry_air_quality_pm25_standard",
 )
 
-meshtastic_telemetry_air_quality_pm100_standard = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm100_standard = Gauge(
     name="meshtastic_telemetry_air_quality_pm100_standard",
 )
 
-meshtastic_telemetry_air_quality_pm10_environmental = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm10_environmental = Gauge(
     name="meshtastic_telemetry_air_quality_pm10_environmental",
 )
 
-meshtastic_telemetry_air_quality_pm25_environmental = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm25_environmental = Gauge(
     name="meshtastic_telemetry_air_quality_pm25_environmental",
 )
 
-meshtastic_telemetry_air_quality_pm100_environmental = meter.create_gauge(
+meshtastic_telemetry_air_quality_pm100_environmental = Gauge(
     name="meshtastic_telemetry_air_quality_pm100_environmental",
 )
 
-meshtastic_telemetry_air_quality_particles_03um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_03um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_03um",
 )
 
-meshtastic_telemetry_air_quality_particles_05um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_05um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_05um",
 )
 
-meshtastic_telemetry_air_quality_particles_10um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_10um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_10um",
 )
 
-meshtastic_telemetry_air_quality_particles_25um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_25um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_25um",
 )
 
-meshtastic_telemetry_air_quality_particles_50um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_50um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_50um",
 )
 
-meshtastic_telemetry_air_quality_particles_100um = meter.create_gauge(
+meshtastic_telemetry_air_quality_particles_100um = Gauge(
     name="meshtastic_telemetry_air_quality_particles_100um",
 )
+
+meshtastic_exporter_full_parses_avoided_total = Counter(
+    name="meshtastic_exporter_full_parses_avoided_total",
+    description="MQTT messages dropped by their MeshPacket header, before queueing and payload decoding",
+)
+
+meshtastic_exporter_ingest_packets_total = Counter(
+    name="meshtastic_exporter_ingest_packets_total",
+    description="MeshPackets received per source (SOURCES), by whether they were accepted or dropped as duplicate, encrypted or invalid",
+)
+
+meshtastic_exporter_ingest_bytes_total = Counter(
+    name="meshtastic_exporter_ingest_bytes_total",
+    description="MQTT payload bytes received per source (SOURCES)",
+)
+
+meshtastic_exporter_telemetry_unknown_total = Counter(
+    name="meshtastic_exporter_telemetry_unknown_total",
+    description="Telemetry variants and fields received that have no metric, by variant and field",
+)
+
+meshtastic_exporter_decryptions_total = Counter(
+    name="meshtastic_exporter_decryptions_total",
+    description="Encrypted MeshPackets by channel hash, channel name (unknown without a key) and by whether they were decrypted with CHANNEL_KEYS, failed to decrypt or are on a channel without a key",
+)
+
+meshtastic_exporter_stage_duration_seconds = Histogram(
+    name="meshtastic_exporter_stage_duration_seconds",
+    boundaries=(
+        0.00001,
+        0.000025,
+        0.00005,
+        0.0001,
+        0.00025,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.05,
+    ),
+    description="Time spent per MeshPacket in the decode, dedup and dispatch stages, by portnum",
+)
+
+meshtastic_mesh_packet_hops = Histogram(
+    name="meshtastic_mesh_packet_hops",
+    boundaries=HOP_BOUNDARIES,
+    description="Hops taken by MeshPackets (hop_start - hop_limit) per source node",
+)
+
+meshtastic_mesh_network_packet_hops = Histogram(
+    name="meshtastic_mesh_network_packet_hops",
+    boundaries=HOP_BOUNDARIES,
+    description="Hops taken by MeshPackets (hop_start - hop_limit) of all nodes",
+)
+
+meshtastic_mesh_packet_interarrival_seconds = Histogram(
+    name="meshtastic_mesh_packet_interarrival_seconds",
+    boundaries=INTERARRIVAL_BOUNDARIES,
+    description="Time between consecutive MeshPackets of every source node",
+)
+
+meshtastic_mesh_network_packet_interarrival_seconds = Histogram(
+    name="meshtastic_mesh_network_packet_interarrival_seconds",
+    boundaries=INTERARRIVAL_BOUNDARIES,
+    description="Time between consecutive MeshPackets of the same source node, over all nodes",
+)
+
+meshtastic_exporter_dropped_packets_total = Counter(
+    name="meshtastic_exporter_dropped_packets_total",
+    description="MeshPackets dropped before reaching metrics, by reason (duplicate, encrypted, invalid, unknown_source, exception)",
+)
+
+meshtastic_exporter_errors_total = Counter(
+    name="meshtastic_exporter_errors_total",
+    description="Exceptions raised while processing MeshPackets, by exception type and location",
+)
+
+meshtastic_exporter_nodedb_synced_nodes_total = Counter(
+    name="meshtastic_exporter_nodedb_synced_nodes_total",
+    description="Nodes of device NodeDBs written to the node cache (updated) or skipped for lack of a User (invalid)",
+)
+
+meshtastic_exporter_mqtt_disconnects_total = Counter(
+    name="meshtastic_exporter_mqtt_disconnects_total",
+    description="Connections to MQTT sources lost, by source (SOURCES)",
+)
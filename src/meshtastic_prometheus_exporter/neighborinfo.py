@@ -1,37 +1,56 @@
 import logging
 import json
+from google.protobuf.json_format import MessageToJson
+from meshtastic.protobuf import mesh_pb2
 from meshtastic_prometheus_exporter.util import get_decoded_node_metadata_from_cache
 from meshtastic_prometheus_exporter.metrics import *
 
 logger = logging.getLogger("meshtastic_prometheus_exporter")
 
 
-def on_meshtastic_neighborinfo_app(cache, packet, source_long_name, source_short_name):
+def neighbor_names(cache, node):
+    """(long name, short name) of a neighbor, from its NodeLabels if it is known."""
+    labels = cache.labels(node)
+    if labels is not None:
+        return labels.long_name, labels.short_name
+    return (
+        get_decoded_node_metadata_from_cache(cache, node, "long_name"),
+        get_decoded_node_metadata_from_cache(cache, node, "short_name"),
+    )
+
+
+def save_neighborinfo_in_topology(topology, packet):
+    """Update the TopologyIndex with a NEIGHBORINFO_APP MeshPacket without counting the packet."""
+    neighbor_info = mesh_pb2.NeighborInfo.FromString(packet.decoded.payload)
+    topology.update(
+        neighbor_info.node_id, [(n.node_id, n.snr) for n in neighbor_info.neighbors]
+    )
+
+
+def on_meshtastic_neighborinfo_app(
+    cache, packet, source_long_name, source_short_name, topology=None
+):
     neighbor_info = packet["decoded"]["neighborinfo"]
     logger.debug(
         f"Received MeshPacket {packet['id']} with NeighborInfo `{json.dumps(neighbor_info, default=repr)}`"
     )
 
     source = neighbor_info["nodeId"]
-    neighbor_info_attributes = {
-        "source": source,
-        "source_long_name": source_long_name,
-        "source_short_name": source_short_name,
-    }
     for n in neighbor_info["neighbors"]:
         neighbor_source = n["nodeId"]
 
-        neighbor_info_attributes["neighbor_source"] = neighbor_source or "unknown"
-        neighbor_info_attributes["neighbor_source_long_name"] = (
-            get_decoded_node_metadata_from_cache(cache, neighbor_source, "long_name")
-            if source
-            else "unknown"
-        )
-        neighbor_info_attributes["neighbor_source_short_name"] = (
-            get_decoded_node_metadata_from_cache(cache, neighbor_source, "short_name")
-            if source
-            else "unknown"
-        )
+        if source:
+            long_name, short_name = neighbor_names(cache, neighbor_source)
+        else:
+            long_name = short_name = "unknown"
+        neighbor_info_attributes = {
+            "source": source,
+            "source_long_name": source_long_name,
+            "source_short_name": source_short_name,
+            "neighbor_source": neighbor_source or "unknown",
+            "neighbor_source_long_name": long_name,
+            "neighbor_source_short_name": short_name,
+        }
 
         meshtastic_neighbor_info_snr_decibels.set(
             n["snr"], attributes=neighbor_info_attributes
@@ -40,3 +59,42 @@ def on_meshtastic_neighborinfo_app(cache, packet, source_long_name, source_short
         # meshtastic_neighbor_info_last_rx_time.set(
         #     n["rxTime"], attributes=neighbor_info_attributes
         # )
+
+    if topology is not None and source:
+        topology.update(
+            source, [(n["nodeId"], n["snr"]) for n in neighbor_info["neighbors"]]
+        )
+
+
+def on_meshtastic_neighborinfo_app_pb(
+    cache, packet, source_long_name, source_short_name, topology=None
+):
+    neighbor_info = mesh_pb2.NeighborInfo.FromString(packet.decoded.payload)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Received MeshPacket {packet.id} with NeighborInfo `{MessageToJson(neighbor_info, indent=None)}`"
+        )
+
+    source = neighbor_info.node_id
+    for n in neighbor_info.neighbors:
+        neighbor_source = n.node_id
+
+        if source:
+            long_name, short_name = neighbor_names(cache, neighbor_source)
+        else:
+            long_name = short_name = "unknown"
+        neighbor_info_attributes = {
+            "source": source,
+            "source_long_name": source_long_name,
+            "source_short_name": source_short_name,
+            "neighbor_source": neighbor_source or "unknown",
+            "neighbor_source_long_name": long_name,
+            "neighbor_source_short_name": short_name,
+        }
+
+        meshtastic_neighbor_info_snr_decibels.set(
+            n.snr, attributes=neighbor_info_attributes
+        )
+
+    if topology is not None and source:
+        topology.update(source, [(n.node_id, n.snr) for n in neighbor_info.neighbors])
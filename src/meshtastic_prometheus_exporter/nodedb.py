@@ -0,0 +1,386 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from opentelemetry.metrics import Observation
+
+from meshtastic_prometheus_exporter.metrics import (
+    Attributes,
+    meshtastic_exporter_nodedb_synced_nodes_total,
+)
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+FIELDS = ("long_name", "short_name", "hw_model", "is_licensed")
+# Nodes of a device NodeDB written to a NodeRegistry per lock acquisition
+SYNC_BATCH_SIZE = 200
+
+
+class NodeStore:
+    """
+    SQLite file holding the node metadata saved by save_node_metadata_in_cache.
+
+    put() only records the latest metadata per node in memory; a background
+    thread writes pending nodes in one transaction every ``flush_interval``
+    seconds and deletes nodes not updated within ``ttl`` every
+    ``compact_interval`` seconds.
+    """
+
+    def __init__(self, path, ttl, flush_interval=10, compact_interval=3600):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        db = self._connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "num INTEGER PRIMARY KEY, long_name TEXT, short_name TEXT, "
+            "hw_model TEXT, is_licensed TEXT, updated_at REAL)"
+        )
+        db.commit()
+        db.close()
+
+        self._thread = threading.Thread(
+            target=self._run, name="nodedb-writer", daemon=True
+        )
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def load(self):
+        """
+        Return (num, *FIELDS, updated_at) rows of nodes updated within ttl,
+        least recently updated first.
+        """
+        db = self._connect()
+        try:
+            return db.execute(
+                f"SELECT num, {', '.join(FIELDS)}, updated_at FROM nodes "
+                "WHERE updated_at >= ? ORDER BY updated_at",
+                (time.time() - self.ttl,),
+            ).fetchall()
+        finally:
+            db.close()
+
+    def put(self, node, node_data):
+        with self._lock:
+            self._pending[node] = (node_data, time.time())
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            db = self._connect()
+            self._flush(db)
+            db.close()
+
+    def _run(self):
+        db = self._connect()
+        last_compaction = time.monotonic()
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush(db)
+                if time.monotonic() - last_compaction >= self.compact_interval:
+                    self._compact(db)
+                    last_compaction = time.monotonic()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write NodeDB to {self.path}: {e}")
+        self._flush(db)
+        db.close()
+
+    def _flush(self, db):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (node, *(node_data.get(f) for f in FIELDS), updated_at)
+                    for node, (node_data, updated_at) in pending.items()
+                ),
+            )
+        logger.debug(f"Saved metadata of {len(pending)} nodes to {self.path}")
+
+    def _compact(self, db):
+        with db:
+            deleted = db.execute(
+                "DELETE FROM nodes WHERE updated_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Removed {deleted} expired nodes from {self.path}")
+
+
+class NodeLabels:
+    """
+    Names of a node and the attribute sets built from them, shared by every
+    packet of the node until its names change.
+
+    ``source``, ``sender`` and ``to`` are its attributes as the source, from
+    and to node of meshtastic_mesh_packets_total; ``gauge_attributes`` are
+    the attributes of its telemetry gauges.
+    """
+
+    __slots__ = (
+        "long_name",
+        "short_name",
+        "source",
+        "sender",
+        "to",
+        "gauge_attributes",
+    )
+
+    def __init__(self, node, long_name, short_name):
+        self.long_name = long_name
+        self.short_name = short_name
+        self.source = Attributes(
+            source=node, source_long_name=long_name, source_short_name=short_name
+        )
+        self.sender = Attributes(
+            {"from": node, "from_long_name": long_name, "from_short_name": short_name}
+        )
+        self.to = Attributes(to=node, to_long_name=long_name, to_short_name=short_name)
+        self.gauge_attributes = Attributes(
+            source=node or "unknown",
+            source_long_name=long_name or "unknown",
+            source_short_name=short_name or "unknown",
+        )
+
+
+class NodeRegistry(MutableMapping):
+    """
+    Node metadata keyed by node number, expiring ``ttl`` seconds after the last
+    update and dropping the least recently updated node beyond ``maxsize``.
+
+    Entries are kept in update order, so expiry and eviction only ever look at
+    the head of the OrderedDict. Every write is mirrored into the optional NodeStore.
+
+    The NodeLabels of every node are built on first use and kept until an
+    update changes the names of the node.
+    """
+
+    def __init__(self, maxsize, ttl, store=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._labels = {}
+        # Reads are lock-free, writes may come from several ingest workers
+        self._lock = threading.Lock()
+
+    def __getitem__(self, node):
+        entry = self._entries[node]
+        if entry[0] < self._timer() - self.ttl:
+            raise KeyError(node)
+        return entry[1]
+
+    def get(self, node, default=None):
+        entry = self._entries.get(node)
+        if entry is None or entry[0] < self._timer() - self.ttl:
+            return default
+        return entry[1]
+
+    def labels(self, node):
+        """Return the NodeLabels of ``node``, or None if it is not known."""
+        labels = self._labels.get(node)
+        if labels is not None and self.get(node) is not None:
+            return labels
+        with self._lock:
+            node_data = self.get(node)
+            if node_data is None:
+                return None
+            labels = self._labels[node] = NodeLabels(
+                node,
+                _label(node_data.get("long_name")),
+                _label(node_data.get("short_name")),
+            )
+        return labels
+
+    def __setitem__(self, node, node_data):
+        self.update_nodes([(node, node_data)])
+
+    def update_nodes(self, items):
+        """Write (node, node_data) pairs under a single acquisition of the lock."""
+        with self._lock:
+            now = self._timer()
+            for node, node_data in items:
+                previous = self._entries.get(node)
+                if previous is None or any(
+                    previous[1].get(name) != node_data.get(name)
+                    for name in ("long_name", "short_name")
+                ):
+                    self._labels.pop(node, None)
+                self._entries[node] = (now, node_data)
+                self._entries.move_to_end(node)
+            self._evict(now)
+        if self.store is not None:
+            for node, node_data in items:
+                self.store.put(node, node_data)
+
+    def __delitem__(self, node):
+        with self._lock:
+            del self._entries[node]
+            self._labels.pop(node, None)
+
+    def __iter__(self):
+        with self._lock:
+            self._evict(self._timer())
+            return iter(list(self._entries))
+
+    def __len__(self):
+        with self._lock:
+            self._evict(self._timer())
+            return len(self._entries)
+
+    def observe_size(self, options):
+        yield Observation(len(self), attributes={"cache": "nodes"})
+        yield Observation(len(self._labels), attributes={"cache": "node_labels"})
+
+    def _evict(self, now):
+        entries = self._entries
+        deadline = now - self.ttl
+        while entries:
+            updated, _ = next(iter(entries.values()))
+            if len(entries) <= self.maxsize and updated >= deadline:
+                break
+            node, _ = entries.popitem(last=False)
+            self._labels.pop(node, None)
+
+    def load(self):
+        """Fill the registry from the store without writing the nodes back."""
+        if self.store is None:
+            return 0
+        # Keep the time of the last update, so that the restart does not
+        # extend the ttl of loaded nodes
+        offset = self._timer() - time.time()
+        rows = self.store.load()[-self.maxsize :]
+        with self._lock:
+            self._entries.update(
+                (
+                    num,
+                    (
+                        updated_at + offset,
+                        {
+                            "long_name": long_name,
+                            "short_name": short_name,
+                            "hw_model": hw_model,
+                            "is_licensed": is_licensed,
+                        },
+                    ),
+                )
+                for num, long_name, short_name, hw_model, is_licensed, updated_at in rows
+            )
+            self._evict(self._timer())
+        return len(rows)
+
+
+def device_node_metadata(node):
+    """
+    Return the metadata of an entry of a device NodeDB (``iface.nodes``) as
+    saved by save_node_metadata_in_cache, or None if the device has not
+    received the User of the node yet.
+    """
+    user = node.get("user")
+    if not user or not user.get("longName"):
+        return None
+    return {
+        "long_name": user["longName"],
+        "short_name": user.get("shortName"),
+        "hw_model": user.get("hwModel"),
+        "is_licensed": str(user.get("isLicensed", False)),
+    }
+
+
+def sync_device_nodes(nodes, registry, batch_size=SYNC_BATCH_SIZE):
+    """
+    Write the nodes of a device NodeDB (``iface.nodes``) that are missing
+    from ``registry`` or differ from it, ``batch_size`` at a time so that
+    ingest workers are not kept waiting on the lock of the registry.
+    Return the number of nodes written.
+    """
+    changes = []
+    invalid = 0
+    # The interface thread adds nodes while we iterate
+    for node in list(nodes.values()):
+        num = node.get("num")
+        node_data = device_node_metadata(node)
+        if num is None or node_data is None:
+            invalid += 1
+        elif registry.get(num) != node_data:
+            changes.append((num, node_data))
+    for i in range(0, len(changes), batch_size):
+        registry.update_nodes(changes[i : i + batch_size])
+    meshtastic_exporter_nodedb_synced_nodes_total.add(
+        len(changes), attributes={"result": "updated"}
+    )
+    meshtastic_exporter_nodedb_synced_nodes_total.add(
+        invalid, attributes={"result": "invalid"}
+    )
+    return len(changes)
+
+
+class DeviceNodeSync:
+    """
+    Background thread applying the changes of the NodeDB of connected
+    devices to a NodeRegistry every ``interval`` seconds, so that nodes a
+    device learns about after the exporter connected are known before
+    their next NodeInfo broadcast reaches the exporter.
+    """
+
+    def __init__(self, registry, interval, batch_size=SYNC_BATCH_SIZE):
+        self.registry = registry
+        self.interval = interval
+        self.batch_size = batch_size
+        self.interfaces = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="nodedb-sync", daemon=True
+        )
+
+    def sync(self):
+        written = 0
+        for iface in list(self.interfaces):
+            nodes = getattr(iface, "nodes", None)
+            if nodes:
+                written += sync_device_nodes(nodes, self.registry, self.batch_size)
+        return written
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                written = self.sync()
+            except Exception as e:
+                logger.warning(f"Failed to sync device NodeDB: {e}")
+                continue
+            if written:
+                logger.info(f"Synced metadata of {written} nodes from device NodeDB")
+
+
+def _label(value):
+    # Same as get_decoded_node_metadata_from_cache
+    return "unknown" if value is None else value
@@ -2,10 +2,14 @@ import logging
 import time
 from meshtastic_prometheus_exporter.metrics import *
 import json
+from google.protobuf.json_format import MessageToJson
+from meshtastic.protobuf import mesh_pb2
 from meshtastic_prometheus_exporter.util import save_node_metadata_in_cache
 
 logger = logging.getLogger("meshtastic_prometheus_exporter")
 
+HW_MODEL_NAMES = {v: k for k, v in mesh_pb2.HardwareModel.items()}
+
 
 def on_meshtastic_nodeinfo_app(cache, packet):
     node_info = packet["decoded"]["user"]
@@ -29,3 +33,51 @@ def on_meshtastic_nodeinfo_app(cache, packet):
     meshtastic_node_info_last_heard_timestamp_seconds.set(
         time.time(), attributes=node_info_attributes
     )
+
+
+def save_user_in_cache(cache, node, user):
+    save_node_metadata_in_cache(
+        cache,
+        node,
+        {
+            "longName": user.long_name,
+            "shortName": user.short_name,
+            "hwModel": HW_MODEL_NAMES.get(user.hw_model, str(user.hw_model)),
+            "isLicensed": user.is_licensed,
+        },
+    )
+
+
+def save_nodeinfo_in_cache(cache, packet):
+    """Save the User of a NODEINFO_APP MeshPacket without counting the packet."""
+    source = packet.decoded.source or getattr(packet, "from")
+    if source:
+        save_user_in_cache(
+            cache, source, mesh_pb2.User.FromString(packet.decoded.payload)
+        )
+
+
+def on_meshtastic_nodeinfo_app_pb(cache, packet):
+    user = mesh_pb2.User.FromString(packet.decoded.payload)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Received MeshPacket {packet.id} with NodeInfo `{MessageToJson(user, indent=None)}`"
+        )
+
+    source = packet.decoded.source or getattr(packet, "from")
+
+    if source:
+        save_user_in_cache(cache, source, user)
+
+    node_info_attributes = {
+        "source": source,
+        "user": user.id,
+        "source_long_name": user.long_name,
+        "source_short_name": user.short_name,
+        # MessageToDict() omits isLicensed when false, hence "0" like above
+        "is_licensed": "True" if user.is_licensed else "0",
+    }
+    meshtastic_node_info_last_heard_timestamp_seconds.set(
+        time.time(), attributes=node_info_attributes
+    )
@@ -0,0 +1,107 @@
+"""
+Replays MQTT captures recorded with CAPTURE_PATH through the same processing
+path as live MQTT messages and reports packets/sec, per-message latency and
+peak RSS.
+
+    meshtastic-prometheus-exporter-replay capture.mpcap [--realtime] [--loops N]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter.capture import read_capture
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+
+
+def replay(records, realtime=False, speed=1.0):
+    """
+    Feed (timestamp, topic, payload) records through on_mqtt_payload, either as
+    fast as possible or paced by their timestamps, and return the processing
+    time of every message in nanoseconds.
+    """
+    latencies = []
+    started = time.monotonic()
+    first_timestamp = None
+    for timestamp, topic, payload in records:
+        if realtime:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        t = time.perf_counter_ns()
+        exporter.on_mqtt_payload(topic, payload)
+        latencies.append(time.perf_counter_ns() - t)
+    return latencies
+
+
+def peak_rss_mib():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("captures", nargs="+", help="capture files")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="keep the original spacing between messages instead of replaying at maximum speed",
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="speed-up factor for --realtime"
+    )
+    parser.add_argument(
+        "--loops",
+        type=int,
+        default=1,
+        help="replay the captures several times, with a fresh dedup window each time",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        help="exporter log level during the replay (INFO logs every packet)",
+    )
+    args = parser.parse_args()
+
+    records = [record for path in args.captures for record in read_capture(path)]
+    if not records:
+        parser.exit(1, f"{', '.join(args.captures)}: capture is empty\n")
+
+    exporter.logger.setLevel(getattr(logging, args.log_level.upper()))
+    exporter.configure_metrics_backend()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.loops):
+        exporter.flood_cache = DedupWindow(
+            ttl=exporter.config["flood_expire_time"],
+            maxsize=exporter.config["flood_cache_maxsize"],
+        )
+        latencies += replay(records, realtime=args.realtime, speed=args.speed)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"messages:  {len(latencies)}")
+    print(f"elapsed:   {elapsed:.3f}s")
+    print(f"rate:      {len(latencies) / elapsed:.0f} messages/s")
+    print(f"p50:       {latencies[len(latencies) // 2] / 1000:.1f} µs")
+    print(f"p99:       {latencies[int(len(latencies) * 0.99)] / 1000:.1f} µs")
+    print(f"peak RSS:  {peak_rss_mib():.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
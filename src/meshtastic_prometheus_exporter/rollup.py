@@ -0,0 +1,155 @@
+import math
+import threading
+import time
+from collections import deque
+
+from opentelemetry.metrics import Observation
+
+# Quantiles of the rollups, within RELATIVE_ACCURACY of the exact ones
+QUANTILES = (0.5, 0.95)
+RELATIVE_ACCURACY = 0.01
+# Values below this are counted as zero
+MIN_VALUE = 1e-9
+
+
+class QuantileSketch:
+    """
+    Count, sum, min, max and quantiles of a stream of non-negative values.
+
+    Values go into logarithmic buckets (DDSketch), bucket i holding the
+    values in (gamma^(i-1), gamma^i], so that quantiles are within
+    RELATIVE_ACCURACY of the exact ones with a bucket count that grows with
+    the logarithm of the range of the values rather than with their number.
+    Adding a value is O(1), sketches of the same accuracy merge exactly.
+    """
+
+    __slots__ = ("count", "total", "min", "max", "zeros", "buckets")
+
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zeros = 0
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value < MIN_VALUE:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    def quantiles(self, quantiles):
+        """Return the values of the sorted ``quantiles`` (0 to 1)."""
+        values = []
+        ranks = [q * (self.count - 1) for q in quantiles]
+        seen = self.zeros
+        buckets = iter(sorted(self.buckets.items()))
+        value = 0.0
+        for rank in ranks:
+            while seen <= rank:
+                index, count = next(buckets)
+                seen += count
+                value = 2 * self.gamma**index / (self.gamma + 1)
+            # The estimate of a bucket may lie outside of what was seen
+            values.append(min(max(value, self.min), self.max))
+        return values
+
+
+class Rollups:
+    """
+    Streaming aggregates of measurements over the last ``window`` seconds,
+    by metric and by attribute set, for network-wide statistics that would
+    otherwise take a query over the series of every node.
+
+    Every series keeps a QuantileSketch per slice of ``window / slices``
+    seconds and drops slices as they leave the window, like the buckets of
+    dedup.DedupWindow. The observe_* callbacks merge the slices of the
+    window, so the exported statistics cover between ``window - window /
+    slices`` and ``window`` seconds.
+    """
+
+    def __init__(self, window, slices=5, timer=time.monotonic):
+        self.window = window
+        self.slices = slices
+        self._span = window / slices
+        self._timer = timer
+        # (metric, attributes) to deque of (slice number, QuantileSketch)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric, attributes, value):
+        """Add ``value`` to the rollup of ``metric`` for ``attributes``, a tuple of pairs."""
+        current = int(self._timer() // self._span)
+        with self._lock:
+            sketches = self._series.get((metric, attributes))
+            if sketches is None:
+                sketches = self._series[(metric, attributes)] = deque()
+            if not sketches or sketches[-1][0] != current:
+                sketches.append((current, QuantileSketch()))
+                while sketches[0][0] <= current - self.slices:
+                    sketches.popleft()
+            sketches[-1][1].add(value)
+
+    def merged(self):
+        """Return {(metric, attributes): QuantileSketch} of the current window."""
+        oldest = int(self._timer() // self._span) - self.slices + 1
+        merged = {}
+        with self._lock:
+            for key, sketches in list(self._series.items()):
+                while sketches and sketches[0][0] < oldest:
+                    sketches.popleft()
+                if not sketches:
+                    del self._series[key]
+                    continue
+                sketch = merged[key] = QuantileSketch()
+                for _, other in sketches:
+                    sketch.merge(other)
+        return merged
+
+    def _observe(self, statistic):
+        for (metric, attributes), sketch in self.merged().items():
+            yield Observation(statistic(sketch), {"metric": metric, **dict(attributes)})
+
+    def observe_count(self, options):
+        return self._observe(lambda sketch: sketch.count)
+
+    def observe_mean(self, options):
+        return self._observe(lambda sketch: sketch.mean)
+
+    def observe_min(self, options):
+        return self._observe(lambda sketch: sketch.min)
+
+    def observe_max(self, options):
+        return self._observe(lambda sketch: sketch.max)
+
+    def observe_quantiles(self, options):
+        for (metric, attributes), sketch in self.merged().items():
+            for quantile, value in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+                yield Observation(
+                    value,
+                    {"metric": metric, **dict(attributes), "quantile": str(quantile)},
+                )
@@ -0,0 +1,278 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import warnings
+
+import meshtastic
+from meshtastic.protobuf import mqtt_pb2, portnums_pb2
+from opentelemetry.metrics import Observation
+
+from meshtastic_prometheus_exporter.metrics import reset_instruments, snapshot
+
+logger = logging.getLogger("meshtastic_prometheus_exporter")
+
+# Messages are sent to shards in batches, to pay the pipe and pickling cost
+# once per batch rather than once per packet
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 0.05
+# Seconds to wait for the snapshot of a shard before /metrics goes without it
+SNAPSHOT_TIMEOUT = 5
+
+
+class ShardRouter:
+    """
+    Ingest queue of INGEST_PROCESSES: spreads MQTT messages over forked
+    worker processes by the sender of their MeshPacket, so that all packets
+    of a node are processed by the same shard.
+
+    Duplicates are dropped by the parent before routing, so dedup stays
+    global. NodeInfo packets are processed by the shard of their sender
+    like any other packet, and also given to ``save_user`` in the parent
+    and every other shard, so that all node registries know every node.
+    NeighborInfo packets are also given to ``save_neighbors`` in the parent,
+    which exports the topology metrics. Encrypted packets are only decrypted
+    by their shard, which sends the NodeInfo and NeighborInfo among them
+    back to the parent to be handled the same way. ``initializer`` runs
+    first thing in every shard.
+
+    Shards are forked, and a process forked while other threads hold locks
+    may deadlock on them: start() must run before the parent starts any
+    other thread.
+
+    The parent serves /metrics by merging snapshot() of every shard into
+    its own state (collector.Collector).
+    """
+
+    def __init__(
+        self,
+        processes,
+        handler,
+        save_user,
+        maxsize,
+        initializer=None,
+        save_neighbors=None,
+    ):
+        self.handler = handler
+        self.save_user = save_user
+        self.save_neighbors = save_neighbors
+        self.initializer = initializer
+        self.dropped = 0
+        self.snapshot_timeout = SNAPSHOT_TIMEOUT
+        # Forked rather than spawned, so that shards start with the node
+        # registry and instrument configuration of the parent
+        context = multiprocessing.get_context("fork")
+        self._queues = [
+            context.Queue(max(maxsize // BATCH_SIZE, 1)) for _ in range(processes)
+        ]
+        self._pipes = [context.Pipe() for _ in range(processes)]
+        # (shard, kind, topic, payload) of packets decrypted by the shards
+        self._decrypted = context.Queue()
+        self._processes = [
+            context.Process(
+                target=self._run_shard,
+                args=(index,),
+                name=f"shard-{index}",
+                daemon=True,
+            )
+            for index in range(processes)
+        ]
+        self._batches = [[] for _ in range(processes)]
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="shard-flusher", daemon=True
+        )
+        self._receiver = threading.Thread(
+            target=self._receive_decrypted, name="shard-decrypted", daemon=True
+        )
+
+    def start(self):
+        # meshtastic starts its "publishing" thread on import, it waits on a
+        # queue (without holding its lock) until a device interface publishes
+        publishing_thread = getattr(meshtastic.publishingThread, "thread", None)
+        others = [
+            thread.name
+            for thread in threading.enumerate()
+            if thread is not threading.current_thread()
+            and thread is not publishing_thread
+        ]
+        with warnings.catch_warnings():
+            if others:
+                logger.warning(
+                    f"Forking shards while threads {', '.join(others)} are running, shards may deadlock"
+                )
+            else:
+                warnings.filterwarnings(
+                    "ignore",
+                    ".*use of fork\\(\\) may lead to deadlocks",
+                    DeprecationWarning,
+                )
+            for process in self._processes:
+                process.start()
+        self._flusher.start()
+        self._receiver.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._flush()
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._decrypted.put(None)
+
+    def put(self, item):
+        topic, envelope = item
+        packet = envelope.packet
+        shard = getattr(packet, "from") % len(self._processes)
+        payload = envelope.SerializeToString()
+        if packet.decoded.portnum == portnums_pb2.NODEINFO_APP:
+            self.save_user(packet)
+            for other in range(len(self._processes)):
+                if other != shard:
+                    self._append(other, ("user", topic, payload))
+        elif (
+            packet.decoded.portnum == portnums_pb2.NEIGHBORINFO_APP
+            and self.save_neighbors is not None
+        ):
+            self.save_neighbors(packet)
+        self._append(shard, ("packet", topic, payload))
+
+    def _append(self, shard, message):
+        with self._lock:
+            batch = self._batches[shard]
+            batch.append(message)
+            if len(batch) < BATCH_SIZE:
+                return
+            self._batches[shard] = []
+        self._send(shard, batch)
+
+    def _send(self, shard, batch):
+        try:
+            self._queues[shard].put_nowait(batch)
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(batch)
+            logger.debug(
+                f"Queue of shard {shard} is full, dropped {len(batch)} messages"
+            )
+
+    def _flush(self):
+        with self._lock:
+            batches = self._batches
+            self._batches = [[] for _ in batches]
+        for shard, batch in enumerate(batches):
+            if batch:
+                self._send(shard, batch)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self._flush()
+
+    def _receive_decrypted(self):
+        while True:
+            message = self._decrypted.get()
+            if message is None:
+                return
+            shard, kind, topic, payload = message
+            try:
+                packet = mqtt_pb2.ServiceEnvelope.FromString(payload).packet
+                if kind == "user":
+                    self.save_user(packet)
+                    for other in range(len(self._processes)):
+                        if other != shard:
+                            self._append(other, ("user", topic, payload))
+                elif self.save_neighbors is not None:
+                    self.save_neighbors(packet)
+            except Exception as e:
+                logger.warning(
+                    f"Exception occurred in decrypted packet of shard {shard}: {e}"
+                )
+
+    def _run_shard(self, index):
+        # Forked from the parent, whose metrics are served by the parent
+        reset_instruments()
+        if self.initializer is not None:
+            self.initializer()
+        threading.Thread(
+            target=self._serve_snapshots,
+            args=(self._pipes[index][1],),
+            name="shard-snapshots",
+            daemon=True,
+        ).start()
+
+        shard_queue = self._queues[index]
+        while True:
+            batch = shard_queue.get()
+            if batch is None:
+                return
+            for message in batch:
+                kind, topic, payload = message
+                try:
+                    envelope = mqtt_pb2.ServiceEnvelope.FromString(payload)
+                    if kind == "packet":
+                        encrypted = envelope.packet.HasField("encrypted")
+                        self.handler(topic, envelope)
+                        if encrypted:
+                            self._forward_decrypted(index, topic, envelope)
+                    else:
+                        self.save_user(envelope.packet)
+                except Exception as e:
+                    logger.warning(f"Exception occurred in shard {index}: {e}")
+
+    def _forward_decrypted(self, index, topic, envelope):
+        """Send a NodeInfo or NeighborInfo decrypted by the handler to the parent."""
+        packet = envelope.packet
+        if not packet.HasField("decoded"):
+            return
+        if packet.decoded.portnum == portnums_pb2.NODEINFO_APP:
+            kind = "user"
+        elif packet.decoded.portnum == portnums_pb2.NEIGHBORINFO_APP:
+            kind = "neighbors"
+        else:
+            return
+        self._decrypted.put((index, kind, topic, envelope.SerializeToString()))
+
+    def _serve_snapshots(self, connection):
+        while True:
+            connection.recv()
+            connection.send(snapshot())
+
+    def snapshots(self):
+        """
+        Yield the metrics.snapshot() of every running shard, skipping shards
+        that do not answer within ``snapshot_timeout`` seconds.
+        """
+        with self._snapshot_lock:
+            for index, (connection, _) in enumerate(self._pipes):
+                if not self._processes[index].is_alive():
+                    logger.error(f"Shard {index} is not running")
+                    continue
+                try:
+                    # Late answers to requests that timed out
+                    while connection.poll():
+                        connection.recv()
+                    connection.send(None)
+                    if not connection.poll(self.snapshot_timeout):
+                        logger.error(
+                            f"Shard {index} did not send its metrics within {self.snapshot_timeout}s"
+                        )
+                        continue
+                    shard_snapshot = connection.recv()
+                except (EOFError, OSError) as e:
+                    logger.error(f"Lost connection to shard {index}: {e}")
+                    continue
+                yield shard_snapshot
+
+    def observe_depth(self, options):
+        for index, shard_queue in enumerate(self._queues):
+            yield Observation(
+                shard_queue.qsize() * BATCH_SIZE, attributes={"shard": index}
+            )
+
+    def observe_dropped(self, options):
+        yield Observation(self.dropped, attributes={"policy": "drop_newest"})
@@ -0,0 +1,63 @@
+import json
+
+INTERFACES = ("MQTT", "SERIAL", "TCP", "BLE")
+
+
+def default_source(config):
+    """The single source described by MESHTASTIC_INTERFACE and its variables."""
+    interface = config.get("meshtastic_interface")
+    source = {"name": (interface or "").lower(), "interface": interface}
+    if interface == "MQTT":
+        source.update(
+            address=config["mqtt_address"],
+            port=config["mqtt_port"],
+            use_tls=config["mqtt_use_tls"],
+            keepalive=config["mqtt_keepalive"],
+            username=config["mqtt_username"],
+            password=config["mqtt_password"],
+            topics=[config["mqtt_topic"]],
+        )
+    elif interface == "SERIAL":
+        source.update(device=config["interface_serial_device"])
+    elif interface == "TCP":
+        source.update(
+            address=config["interface_tcp_addr"], port=config["interface_tcp_port"]
+        )
+    elif interface == "BLE":
+        source.update(address=config["interface_ble_addr"])
+    return source
+
+
+def parse_sources(value, config):
+    """
+    Parse SOURCES, a JSON list of sources such as
+
+        [{"name": "eu433", "interface": "MQTT", "topics": ["msh/EU_433/#"]},
+         {"name": "eu868", "interface": "MQTT", "topics": ["msh/EU_868/#"]},
+         {"name": "gateway", "interface": "SERIAL", "device": "/dev/ttyACM0"}]
+
+    Settings left out of a source default to the ones of MESHTASTIC_INTERFACE
+    and its variables (MQTT_ADDRESS, SERIAL_DEVICE, ...). Without SOURCES the
+    exporter runs the single source described by MESHTASTIC_INTERFACE.
+    """
+    if not value:
+        return [default_source(config)]
+
+    sources = []
+    for entry in json.loads(value):
+        interface = str(entry.get("interface", "")).upper()
+        if interface not in INTERFACES:
+            raise ValueError(
+                f"Invalid interface {entry.get('interface')} of source {entry}. Must be one of: {', '.join(INTERFACES)}"
+            )
+        source = default_source({**config, "meshtastic_interface": interface})
+        source.update(entry, interface=interface)
+        if "topic" in entry:
+            source["topics"] = [source.pop("topic")]
+        sources.append(source)
+
+    names = [source["name"] for source in sources]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Source names must be unique: {', '.join(duplicates)}")
+    return sources
@@ -1,155 +1,196 @@
 import logging
 import json
+from google.protobuf.json_format import MessageToJson
+from meshtastic.protobuf import telemetry_pb2
 from meshtastic_prometheus_exporter.metrics import *
 from meshtastic_prometheus_exporter.util import get_decoded_node_metadata_from_cache
 
 logger = logging.getLogger("meshtastic_prometheus_exporter")
 
+# {variant: ((field, instrument, scale), ...)}, with variants and fields named
+# as in telemetry.proto. Scales convert to the unit of the metric name.
+TELEMETRY_METRICS = {
+    "device_metrics": (
+        ("battery_level", meshtastic_telemetry_device_battery_level_percent, 1),
+        ("voltage", meshtastic_telemetry_device_voltage_volts, 1),
+        (
+            "channel_utilization",
+            meshtastic_telemetry_device_channel_utilization_percent,
+            1,
+        ),
+        ("air_util_tx", meshtastic_telemetry_device_air_util_tx_percent, 1),
+    ),
+    "environment_metrics": (
+        ("temperature", meshtastic_telemetry_env_temperature_celsius, 1),
+        ("relative_humidity", meshtastic_telemetry_env_relative_humidity_percent, 1),
+        # hPa
+        (
+            "barometric_pressure",
+            meshtastic_telemetry_env_barometric_pressure_pascal,
+            10**2,
+        ),
+        ("gas_resistance", meshtastic_telemetry_env_gas_resistance_ohms, 10**-6),
+        ("voltage", meshtastic_telemetry_env_voltage_volts, 1),
+        # mA
+        ("current", meshtastic_telemetry_env_current_amperes, 10**-3),
+    ),
+    "air_quality_metrics": (
+        ("pm10_standard", meshtastic_telemetry_air_quality_pm10_standard, 1),
+        ("pm25_standard", meshtastic_telemetry_air_quality_pm25_standard, 1),
+        ("pm100_standard", meshtastic_telemetry_air_quality_pm100_standard, 1),
+        ("pm10_environmental", meshtastic_telemetry_air_quality_pm10_environmental, 1),
+        ("pm25_environmental", meshtastic_telemetry_air_quality_pm25_environmental, 1),
+        (
+            "pm100_environmental",
+            meshtastic_telemetry_air_quality_pm100_environmental,
+            1,
+        ),
+        ("particles_03um", meshtastic_telemetry_air_quality_particles_03um, 1),
+        ("particles_05um", meshtastic_telemetry_air_quality_particles_05um, 1),
+        ("particles_10um", meshtastic_telemetry_air_quality_particles_10um, 1),
+        ("particles_25um", meshtastic_telemetry_air_quality_particles_25um, 1),
+        ("particles_50um", meshtastic_telemetry_air_quality_particles_50um, 1),
+        ("particles_100um", meshtastic_telemetry_air_quality_particles_100um, 1),
+    ),
+    "power_metrics": (
+        ("ch1_voltage", meshtastic_telemetry_power_ch1_voltage_volts, 1),
+        # mA
+        ("ch1_current", meshtastic_telemetry_power_ch1_current_amperes, 10**-3),
+        ("ch2_voltage", meshtastic_telemetry_power_ch2_voltage_volts, 1),
+        ("ch2_current", meshtastic_telemetry_power_ch2_current_amperes, 10**-3),
+        ("ch3_voltage", meshtastic_telemetry_power_ch3_voltage_volts, 1),
+        ("ch3_current", meshtastic_telemetry_power_ch3_current_amperes, 10**-3),
+    ),
+}
 
-def on_device_metrics_telemetry(packet, attributes):
-    logger.info(f"MeshPacket {packet['id']} is device metrics telemetry")
-    if "batteryLevel" in packet["decoded"]["telemetry"]["deviceMetrics"]:
-        meshtastic_telemetry_device_battery_level_percent.set(
-            packet["decoded"]["telemetry"]["deviceMetrics"]["batteryLevel"],
-            attributes=attributes,
-        )
-    if "voltage" in packet["decoded"]["telemetry"]["deviceMetrics"]:
-        meshtastic_telemetry_device_voltage_volts.set(
-            packet["decoded"]["telemetry"]["deviceMetrics"]["voltage"],
-            attributes=attributes,
-        )
-    if "channelUtilization" in packet["decoded"]["telemetry"]["deviceMetrics"]:
-        meshtastic_telemetry_device_channel_utilization_percent.set(
-            packet["decoded"]["telemetry"]["deviceMetrics"]["channelUtilization"],
-            attributes=attributes,
-        )
-    if "airUtilTx" in packet["decoded"]["telemetry"]["deviceMetrics"]:
-        meshtastic_telemetry_device_air_util_tx_percent.set(
-            packet["decoded"]["telemetry"]["deviceMetrics"]["airUtilTx"],
-            attributes=attributes,
-        )
 
+# Metrics also rolled up over the network by channel and region
+# (rollup.Rollups), so that dashboards need not aggregate every node series
+TELEMETRY_ROLLUPS = frozenset(
+    instrument.name
+    for instrument in (
+        meshtastic_telemetry_device_battery_level_percent,
+        meshtastic_telemetry_device_voltage_volts,
+        meshtastic_telemetry_device_channel_utilization_percent,
+        meshtastic_telemetry_device_air_util_tx_percent,
+    )
+)
 
-def on_meshtastic_telemetry_app(packet, source_long_name, source_short_name):
-    telemetry = packet["decoded"]["telemetry"]
-    logger.debug(
-        f"Received MeshPacket {packet['id']} with Telemetry `{json.dumps(telemetry, default=repr)}`"
+
+def compile_telemetry_metrics(table):
+    """
+    Compile TELEMETRY_METRICS into {variant: (variant, {field: (instrument,
+    scale)})}, keyed by both the proto names (protobuf path) and the JSON
+    names (MessageToDict path) of variants and fields.
+    """
+    entries = {
+        (variant, field): (instrument, scale)
+        for variant, fields in table.items()
+        for field, instrument, scale in fields
+    }
+    dispatch = {}
+    for variant in telemetry_pb2.Telemetry.DESCRIPTOR.oneofs_by_name["variant"].fields:
+        fields = {}
+        for descriptor in variant.message_type.fields:
+            metric = entries.pop((variant.name, descriptor.name), None)
+            if metric is not None:
+                fields[descriptor.name] = fields[descriptor.json_name] = metric
+        dispatch[variant.name] = dispatch[variant.json_name] = (variant.name, fields)
+    if entries:
+        raise ValueError(
+            f"Unknown telemetry fields: {', '.join(map('.'.join, entries))}"
+        )
+    return dispatch
+
+
+TELEMETRY_DISPATCH = compile_telemetry_metrics(TELEMETRY_METRICS)
+
+
+def count_unknown_telemetry(variant, field=""):
+    meshtastic_exporter_telemetry_unknown_total.add(
+        1, attributes={"variant": variant, "field": field}
     )
-    source = packet["decoded"].get("source", packet["from"])
-    telemetry_attributes = {
+
+
+def record_telemetry(variant, fields, attributes, rollup=None):
+    """
+    Set the instruments of ``fields``, an iterable of (name, value) pairs,
+    and pass the values of TELEMETRY_ROLLUPS to ``rollup(metric, value)``.
+    """
+    dispatch = TELEMETRY_DISPATCH.get(variant)
+    if dispatch is None:
+        count_unknown_telemetry(variant)
+        return
+    variant, variant_metrics = dispatch
+    for field, value in fields:
+        metric = variant_metrics.get(field)
+        if metric is None:
+            count_unknown_telemetry(variant, field)
+            continue
+        instrument, scale = metric
+        instrument.set(value * scale, attributes=attributes)
+        if rollup is not None and instrument.name in TELEMETRY_ROLLUPS:
+            rollup(instrument.name, value * scale)
+
+
+def telemetry_attributes(source, source_long_name, source_short_name):
+    return {
         "source": source or "unknown",
         "source_long_name": source_long_name or "unknown",
         "source_short_name": source_short_name or "unknown",
     }
-    if "deviceMetrics" in telemetry:
-        on_device_metrics_telemetry(packet, telemetry_attributes)
-        return
 
-    if "environmentMetrics" in telemetry:
-        logger.info(f"MeshPacket {packet['id']} is environment metrics telemetry")
-        if "temperature" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_temperature_celsius.set(
-                telemetry["environmentMetrics"]["temperature"],
-                attributes=telemetry_attributes,
-            )
-        if "relativeHumidity" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_relative_humidity_percent.set(
-                telemetry["environmentMetrics"]["relativeHumidity"],
-                attributes=telemetry_attributes,
-            )
-        if "barometricPressure" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_barometric_pressure_pascal.set(
-                telemetry["environmentMetrics"]["barometricPressure"] * 10**2,
-                attributes=telemetry_attributes,
-            )
-        if "gasResistance" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_gas_resistance_ohms.set(
-                telemetry["environmentMetrics"]["gasResistance"] / 10**6,
-                attributes=telemetry_attributes,
-            )
-        if "voltage" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_voltage_volts.set(
-                telemetry["environmentMetrics"]["voltage"],
-                attributes=telemetry_attributes,
-            )
-        if "current" in telemetry["environmentMetrics"]:
-            meshtastic_telemetry_env_current_amperes.set(
-                telemetry["environmentMetrics"]["current"] * 10**-3,
-                attributes=telemetry_attributes,
-            )
-    if "airQualityMetrics" in telemetry:
-        logger.info(f"MeshPacket {packet['id']} is air quality metrics telemetry")
-        meshtastic_telemetry_air_quality_pm10_standard.set(
-            telemetry["airQualityMetrics"]["pm10_standard"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_pm25_standard.set(
-            telemetry["airQualityMetrics"]["pm25_standard"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_pm100_standard.set(
-            telemetry["airQualityMetrics"]["pm100_standard"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_pm10_environmental.set(
-            telemetry["airQualityMetrics"]["pm10_environmental"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_pm25_environmental.set(
-            telemetry["airQualityMetrics"]["pm25_environmental"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_pm100_environmental.set(
-            telemetry["airQualityMetrics"]["pm100_environmental"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_03um.set(
-            telemetry["airQualityMetrics"]["particles_03um"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_05um.set(
-            telemetry["airQualityMetrics"]["particles_05um"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_10um.set(
-            telemetry["airQualityMetrics"]["particles_10um"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_25um.set(
-            telemetry["airQualityMetrics"]["particles_25um"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_50um.set(
-            telemetry["airQualityMetrics"]["particles_50um"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_air_quality_particles_100um.set(
-            telemetry["airQualityMetrics"]["particles_100um"],
-            attributes=telemetry_attributes,
-        )
-    if "powerMetrics" in telemetry:
-        logger.info(f"MeshPacket {packet['id']} is power metrics telemetry")
-        meshtastic_telemetry_power_ch1_voltage_volts.set(
-            telemetry["powerMetrics"]["ch1_voltage"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_power_ch1_current_amperes.set(
-            telemetry["powerMetrics"]["ch1_current"] * 10**-3,
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_power_ch2_voltage_volts.set(
-            telemetry["powerMetrics"]["ch2_voltage"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_power_ch2_current_amperes.set(
-            telemetry["powerMetrics"]["ch2_current"] * 10**-3,
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_power_ch3_voltage_volts.set(
-            telemetry["powerMetrics"]["ch3_voltage"],
-            attributes=telemetry_attributes,
-        )
-        meshtastic_telemetry_power_ch3_current_amperes.set(
-            telemetry["powerMetrics"]["ch3_current"] * 10**-3,
-            attributes=telemetry_attributes,
-        )
+
+def on_meshtastic_telemetry_app(
+    packet, source_long_name, source_short_name, attributes=None, rollup=None
+):
+    """
+    ``attributes`` are the gauge attributes of the source node
+    (nodedb.NodeLabels), built from its names when not given. ``rollup`` is
+    given the values of TELEMETRY_ROLLUPS, see record_telemetry.
+    """
+    telemetry = packet["decoded"]["telemetry"]
+    logger.debug(
+        f"Received MeshPacket {packet['id']} with Telemetry `{json.dumps(telemetry, default=repr)}`"
+    )
+    if attributes is None:
+        attributes = telemetry_attributes(
+            packet["decoded"].get("source", packet["from"]),
+            source_long_name,
+            source_short_name,
+        )
+    for variant, fields in telemetry.items():
+        # Fields of Telemetry outside of the variant, such as time
+        if not isinstance(fields, dict):
+            continue
+        logger.info(f"MeshPacket {packet['id']} is {variant} telemetry")
+        record_telemetry(variant, fields.items(), attributes, rollup)
+
+
+def on_meshtastic_telemetry_app_pb(
+    packet, source_long_name, source_short_name, attributes=None, rollup=None
+):
+    telemetry = telemetry_pb2.Telemetry.FromString(packet.decoded.payload)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Received MeshPacket {packet.id} with Telemetry `{MessageToJson(telemetry, indent=None)}`"
+        )
+    if attributes is None:
+        attributes = telemetry_attributes(
+            packet.decoded.source or getattr(packet, "from"),
+            source_long_name,
+            source_short_name,
+        )
+    variant = telemetry.WhichOneof("variant")
+    if variant is None:
+        return
+    logger.info(f"MeshPacket {packet.id} is {variant} telemetry")
+    record_telemetry(
+        variant,
+        (
+            (descriptor.name, value)
+            for descriptor, value in getattr(telemetry, variant).ListFields()
+        ),
+        attributes,
+        rollup,
+    )
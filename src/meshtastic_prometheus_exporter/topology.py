@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+
+from opentelemetry.metrics import Observation
+
+SNR_STATISTICS = ("min", "mean", "max")
+
+
+class TopologyIndex:
+    """
+    Mesh links reported by NEIGHBORINFO_APP packets, for graph metrics that
+    would otherwise take PromQL over every meshtastic_neighbor_info_snr_decibels
+    series.
+
+    Every NeighborInfo replaces the previous report of its node, which
+    expires ``ttl`` seconds after it was received. Two nodes are linked while
+    a report of either one lists the other. Reports are kept in update order,
+    so expiry only ever looks at the head of the OrderedDict, and the
+    adjacency is updated with the difference between a report and the one it
+    replaces. Components are only recomputed by a scrape after a change.
+
+    Per-node series of the observe_* callbacks are labelled with
+    ``attributes(node)``.
+    """
+
+    def __init__(
+        self, ttl, attributes=lambda node: {"source": node}, timer=time.monotonic
+    ):
+        self.ttl = ttl
+        self.attributes = attributes
+        self._timer = timer
+        # node to (received at, {neighbor: SNR})
+        self._reports = OrderedDict()
+        # node to {neighbor: number of reports (1 or 2) listing the link}
+        self._adjacency = {}
+        self._links = 0
+        self._components = None
+        self._lock = threading.Lock()
+
+    def update(self, node, neighbors):
+        """Replace the report of ``node`` with ``neighbors``, (node, SNR) pairs."""
+        neighbors = {
+            neighbor: snr
+            for neighbor, snr in neighbors
+            if neighbor and neighbor != node
+        }
+        with self._lock:
+            now = self._timer()
+            if node not in self._reports:
+                self._components = None
+            previous = self._reports.pop(node, (None, {}))[1]
+            for neighbor in previous.keys() - neighbors.keys():
+                self._unlink(node, neighbor)
+            for neighbor in neighbors.keys() - previous.keys():
+                self._link(node, neighbor)
+            self._reports[node] = (now, neighbors)
+            self._expire(now)
+
+    def _link(self, node, neighbor):
+        self._components = None
+        links = self._adjacency.setdefault(node, {})
+        if neighbor not in links:
+            self._links += 1
+            links[neighbor] = 0
+            self._adjacency.setdefault(neighbor, {})[node] = 0
+        links[neighbor] += 1
+        self._adjacency[neighbor][node] += 1
+
+    def _unlink(self, node, neighbor):
+        self._components = None
+        for a, b in ((node, neighbor), (neighbor, node)):
+            links = self._adjacency[a]
+            links[b] -= 1
+            if not links[b]:
+                del links[b]
+                if not links:
+                    del self._adjacency[a]
+        if neighbor not in self._adjacency.get(node, ()):
+            self._links -= 1
+
+    def _expire(self, now):
+        deadline = now - self.ttl
+        reports = self._reports
+        while reports:
+            received, _ = next(iter(reports.values()))
+            if received >= deadline:
+                break
+            node, (_, neighbors) = reports.popitem(last=False)
+            self._components = None
+            for neighbor in neighbors:
+                self._unlink(node, neighbor)
+
+    def expire(self):
+        with self._lock:
+            self._expire(self._timer())
+
+    def degrees(self):
+        """Return {node: number of nodes it is linked with}, 0 for isolated nodes."""
+        with self._lock:
+            self._expire(self._timer())
+            degrees = dict.fromkeys(self._reports, 0)
+            degrees.update(
+                (node, len(links)) for node, links in self._adjacency.items()
+            )
+            return degrees
+
+    def components(self):
+        """
+        Return the sets of nodes of every connected component, including
+        the reporting nodes without any link.
+        """
+        with self._lock:
+            self._expire(self._timer())
+            if self._components is None:
+                self._components = self._find_components()
+            return self._components
+
+    def _find_components(self):
+        components = []
+        unvisited = set(self._adjacency).union(self._reports)
+        while unvisited:
+            component = set()
+            stack = [unvisited.pop()]
+            while stack:
+                node = stack.pop()
+                component.add(node)
+                for neighbor in self._adjacency.get(node, ()):
+                    if neighbor in unvisited:
+                        unvisited.remove(neighbor)
+                        stack.append(neighbor)
+            components.append(component)
+        return components
+
+    def link_snr(self):
+        """
+        Return {node: (min, mean, max)} of the SNR of the links of every node,
+        as reported by the node itself and by its neighbors.
+        """
+        snrs = {}
+        with self._lock:
+            self._expire(self._timer())
+            for node, (_, neighbors) in self._reports.items():
+                for neighbor, snr in neighbors.items():
+                    snrs.setdefault(node, []).append(snr)
+                    snrs.setdefault(neighbor, []).append(snr)
+        return {
+            node: (min(values), sum(values) / len(values), max(values))
+            for node, values in snrs.items()
+        }
+
+    def observe_degree(self, options):
+        for node, degree in self.degrees().items():
+            yield Observation(degree, self.attributes(node))
+
+    def observe_links(self, options):
+        self.expire()
+        yield Observation(self._links)
+
+    def observe_components(self, options):
+        yield Observation(len(self.components()))
+
+    def observe_component_nodes(self, options):
+        # Components have no identity of their own, the lowest node number
+        # keeps the series stable while the component does not change much
+        for component in self.components():
+            yield Observation(len(component), {"component": min(component)})
+
+    def observe_link_snr(self, options):
+        for node, values in self.link_snr().items():
+            attributes = self.attributes(node)
+            for statistic, value in zip(SNR_STATISTICS, values):
+                yield Observation(value, {**attributes, "statistic": statistic})
@@ -0,0 +1,64 @@
+import pstats
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from meshtastic_prometheus_exporter.admin import start_admin_server
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def admin_url():
+    server, thread = start_admin_server(0, "127.0.0.1")
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_profile_samples_other_threads(admin_url, tmp_path):
+    stop = threading.Event()
+    threading.Thread(target=busy_loop, args=(stop,), name="busy").start()
+    try:
+        with urllib.request.urlopen(
+            f"{admin_url}/debug/profile?seconds=0.3&interval=0.001"
+        ) as response:
+            collapsed = response.read().decode()
+        with urllib.request.urlopen(
+            f"{admin_url}/debug/profile?seconds=0.3&format=pstats"
+        ) as response:
+            (tmp_path / "profile.pstats").write_bytes(response.read())
+    finally:
+        stop.set()
+
+    assert any(
+        line.startswith("busy;") and "busy_loop (" in line
+        for line in collapsed.splitlines()
+    )
+    stats = pstats.Stats(str(tmp_path / "profile.pstats"))
+    assert any(function[2] == "busy_loop" for function in stats.stats)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f"{admin_url}/debug/profile?seconds=3600")
+    assert e.value.code == 400
+
+
+def test_heap_diff_shows_growing_sites(admin_url):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f"{admin_url}/debug/heap/diff")
+    assert e.value.code == 409
+
+    try:
+        urllib.request.urlopen(f"{admin_url}/debug/heap/snapshot?all=1").read()
+        growing = [bytearray(1024) for _ in range(100)]
+        with urllib.request.urlopen(f"{admin_url}/debug/heap/diff?all=1") as response:
+            diff = response.read().decode()
+    finally:
+        urllib.request.urlopen(f"{admin_url}/debug/heap/stop").read()
+
+    assert "test_admin.py" in diff.splitlines()[0]
+    assert len(growing) == 100
@@ -0,0 +1,133 @@
+import asyncio
+
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter import aio
+from meshtastic_prometheus_exporter.ingest import AsyncIngestQueue
+
+
+def from_radio_packet(packet_id):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=0xFFFFFFFF)
+    setattr(packet, "from", 2882400001)
+    packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+    packet.decoded.payload = b"hello"
+    return mesh_pb2.FromRadio(packet=packet)
+
+
+def test_read_frames_skips_device_logs():
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(
+            b"INFO | booting\n"
+            + aio.frame(from_radio_packet(1))
+            + b"\x94\x00 noise"
+            + aio.frame(from_radio_packet(2))
+        )
+        reader.feed_eof()
+        frames = []
+        try:
+            async for from_radio in aio.read_frames(reader):
+                frames.append(from_radio.packet.id)
+        except asyncio.IncompleteReadError:
+            pass
+        return frames
+
+    assert asyncio.run(read()) == [1, 2]
+
+
+def test_tcp_source_queues_packets_and_saves_nodedb():
+    node_info = mesh_pb2.FromRadio()
+    node_info.node_info.num = 2882400001
+    node_info.node_info.user.long_name = "Async node"
+    node_info.node_info.user.short_name = "ASYN"
+    node_info.node_info.user.hw_model = mesh_pb2.HardwareModel.TBEAM
+
+    async def run():
+        received = []
+
+        async def device(reader, writer):
+            received.append(await reader.readexactly(4))
+            writer.write(aio.frame(node_info) + aio.frame(from_radio_packet(424242)))
+            await writer.drain()
+
+        server = await asyncio.start_server(device, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        queued = []
+        ingest_queue = AsyncIngestQueue(lambda *item: queued.append(item), maxsize=10)
+        ingest_queue.start()
+        source = {"name": "gateway", "address": "127.0.0.1", "port": port}
+        task = asyncio.create_task(
+            aio.run_tcp_source(
+                source,
+                lambda source, from_radio: exporter.on_from_radio(
+                    source, from_radio, ingest_queue
+                ),
+            )
+        )
+        while not queued:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await ingest_queue.stop(1)
+        server.close()
+        return received, queued
+
+    received, queued = asyncio.run(run())
+    assert received[0][:2] == aio.FRAME_START
+    ((topic, envelope),) = queued
+    assert topic == "gateway"
+    assert envelope.packet.id == 424242
+    assert exporter.node_cache[2882400001]["long_name"] == "Async node"
+    assert exporter.node_cache[2882400001]["hw_model"] == "TBEAM"
+
+
+def test_async_ingest_queue_drops_oldest():
+    async def run():
+        processed = []
+        ingest_queue = AsyncIngestQueue(
+            lambda topic: processed.append(topic), maxsize=2
+        )
+        for topic in ("a", "b", "c"):
+            ingest_queue.put((topic,))
+        ingest_queue.start()
+        await ingest_queue.stop(1)
+        return processed, ingest_queue.dropped
+
+    assert asyncio.run(run()) == (["b", "c"], 1)
+
+
+def test_tcp_source_reconnects_after_any_error(monkeypatch):
+    monkeypatch.setattr(aio, "RECONNECT_DELAY", 0)
+
+    async def run():
+        connections = []
+
+        async def device(reader, writer):
+            connections.append(await reader.readexactly(4))
+            writer.write(aio.frame(from_radio_packet(len(connections))))
+            await writer.drain()
+
+        server = await asyncio.start_server(device, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        handled = []
+
+        def on_from_radio(source, from_radio):
+            handled.append(from_radio.packet.id)
+            if len(handled) == 1:
+                raise ValueError("malformed FromRadio")
+
+        source = {"name": "gateway", "address": "127.0.0.1", "port": port}
+        task = asyncio.create_task(aio.run_tcp_source(source, on_from_radio))
+
+        async def second_connection():
+            while len(handled) < 2:
+                await asyncio.sleep(0.01)
+
+        try:
+            await asyncio.wait_for(second_connection(), 5)
+        finally:
+            task.cancel()
+        server.close()
+        return handled
+
+    assert asyncio.run(run())[:2] == [1, 2]
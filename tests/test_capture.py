@@ -0,0 +1,46 @@
+import pytest
+
+from meshtastic_prometheus_exporter import replay
+from meshtastic_prometheus_exporter.capture import CaptureWriter, read_capture
+
+
+def test_capture_roundtrip(tmp_path):
+    path = str(tmp_path / "capture.mpcap")
+
+    writer = CaptureWriter(path)
+    writer.write(1730000000.5, "msh/EU_433/2/e/LongFast/!deadbeef", b"\x0a\x00")
+    writer.close()
+    # Appending to an existing capture must not repeat the file header
+    writer = CaptureWriter(path)
+    writer.write(1730000001.5, "msh/EU_868", b"")
+    writer.close()
+
+    assert list(read_capture(path)) == [
+        (1730000000.5, "msh/EU_433/2/e/LongFast/!deadbeef", b"\x0a\x00"),
+        (1730000001.5, "msh/EU_868", b""),
+    ]
+
+
+def test_capture_ignores_truncated_record(tmp_path):
+    path = str(tmp_path / "capture.mpcap")
+
+    writer = CaptureWriter(path)
+    writer.write(1730000000.5, "msh/EU_433", b"\x0a\x00")
+    writer.write(1730000001.5, "msh/EU_433", b"\x0a\x00\x00\x00")
+    writer.close()
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 2)
+
+    assert len(list(read_capture(path))) == 1
+
+
+def test_replay_rejects_empty_capture(tmp_path, mocker, capsys):
+    path = str(tmp_path / "capture.mpcap")
+    CaptureWriter(path).close()
+    mocker.patch("sys.argv", ["replay", path])
+
+    with pytest.raises(SystemExit) as excinfo:
+        replay.main()
+
+    assert excinfo.value.code == 1
+    assert "capture is empty" in capsys.readouterr().err
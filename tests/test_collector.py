@@ -0,0 +1,77 @@
+from opentelemetry.metrics import Observation
+from prometheus_client import CollectorRegistry, generate_latest
+
+from meshtastic_prometheus_exporter import metrics
+from meshtastic_prometheus_exporter.collector import Collector
+
+
+def test_collector_exposes_instrument_state():
+    counter = metrics.Counter(name="test_collector_packets_total")
+    counter._totals = {}
+    gauge = metrics.Gauge(name="test_collector_voltage_volts")
+    counter.add(1, attributes={"source": 1, "otel.metric.overflow": "true"})
+    counter.add(2, attributes={"source": 1, "otel.metric.overflow": "true"})
+    gauge.set(4.1, attributes={"source": 1, "is_licensed": False})
+
+    registry = CollectorRegistry()
+    registry.register(
+        Collector(
+            instruments={"counter": counter, "gauge": gauge},
+            observables=[
+                (
+                    "counter",
+                    "test_collector_hits_total",
+                    [lambda options: [Observation(5)]],
+                    "hits",
+                )
+            ],
+        )
+    )
+
+    assert generate_latest(registry).decode().splitlines() == [
+        "# HELP test_collector_packets_total ",
+        "# TYPE test_collector_packets_total counter",
+        'test_collector_packets_total{otel_metric_overflow="true",source="1"} 3.0',
+        "# HELP test_collector_voltage_volts ",
+        "# TYPE test_collector_voltage_volts gauge",
+        'test_collector_voltage_volts{is_licensed="false",source="1"} 4.1',
+        "# HELP test_collector_hits_total hits",
+        "# TYPE test_collector_hits_total counter",
+        "test_collector_hits_total 5.0",
+    ]
+
+
+def test_native_counter_series_limit():
+    counter = metrics.Counter(name="test_collector_limit_total")
+    counter._totals = {}
+    counter.series_limit = 1
+    counter.add(1, attributes={"source": 1})
+    counter.add(1, attributes={"source": 2})
+    counter.add(1, attributes={"source": 3})
+
+    assert dict(counter.series()) == {
+        frozenset({"source": 1}.items()): 1,
+        frozenset(metrics.OVERFLOW_ATTRIBUTES.items()): 2,
+    }
+
+
+def test_collector_exposes_histograms():
+    histogram = metrics.Histogram(
+        name="test_collector_duration_seconds", boundaries=(0.001, 0.01)
+    )
+    histogram.record(0.0005, attributes={"stage": "decode"})
+    histogram.record(0.005, attributes={"stage": "decode"})
+    histogram.record(0.5, attributes={"stage": "decode"})
+
+    registry = CollectorRegistry()
+    registry.register(Collector(instruments={"histogram": histogram}, observables=[]))
+
+    assert generate_latest(registry).decode().splitlines() == [
+        "# HELP test_collector_duration_seconds ",
+        "# TYPE test_collector_duration_seconds histogram",
+        'test_collector_duration_seconds_bucket{le="0.001",stage="decode"} 1.0',
+        'test_collector_duration_seconds_bucket{le="0.01",stage="decode"} 2.0',
+        'test_collector_duration_seconds_bucket{le="+Inf",stage="decode"} 3.0',
+        'test_collector_duration_seconds_count{stage="decode"} 3.0',
+        'test_collector_duration_seconds_sum{stage="decode"} 0.5055',
+    ]
@@ -0,0 +1,115 @@
+import base64
+import struct
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+from meshtastic_prometheus_exporter.decrypt import (
+    DEFAULT_KEY,
+    channel_hash,
+    decrypt_mesh_packet,
+    expand_psk,
+    parse_channel_keys,
+)
+from pytest_mock import MockerFixture
+from unittest.mock import call
+
+
+def encrypted_packet(data, key, channel):
+    packet = mesh_pb2.MeshPacket(id=3259852070, to=0xFFFFFFFF, hop_limit=3)
+    setattr(packet, "from", 123456789)
+    nonce = struct.pack("<QI4x", packet.id, 123456789)
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(nonce)).encryptor()
+    packet.encrypted = encryptor.update(data.SerializeToString())
+    packet.channel = channel
+    return packet
+
+
+def test_expand_psk():
+    assert expand_psk(b"") is None
+    assert expand_psk(b"\x00") is None
+    assert expand_psk(b"\x01") == DEFAULT_KEY
+    assert expand_psk(b"\x02")[-1] == DEFAULT_KEY[-1] + 1
+    assert expand_psk(b"\x11" * 20) == b"\x11" * 20 + b"\x00" * 12
+    # MeshPacket.channel of the default LongFast channel
+    assert channel_hash("LongFast", DEFAULT_KEY) == 8
+
+
+def test_decrypt_mesh_packet(mocker: MockerFixture):
+    mock_add_decryptions = mocker.patch.object(
+        exporter.meshtastic_exporter_decryptions_total, "add"
+    )
+    channel_keys = parse_channel_keys(
+        f"LongFast=AQ==;Private={base64.b64encode(b'k' * 32).decode()}"
+    )
+    data = mesh_pb2.Data(portnum=portnums_pb2.TEXT_MESSAGE_APP, payload=b"hello")
+
+    packet = encrypted_packet(data, DEFAULT_KEY, 8)
+    assert decrypt_mesh_packet(packet, channel_keys) == "LongFast"
+    assert packet.decoded == data
+    assert not packet.HasField("encrypted")
+
+    wrong_key = encrypted_packet(data, b"w" * 16, 8)
+    assert decrypt_mesh_packet(wrong_key, channel_keys) is None
+    assert decrypt_mesh_packet(encrypted_packet(data, DEFAULT_KEY, 9), {}) is None
+
+    assert mock_add_decryptions.call_args_list == [
+        call(
+            1,
+            attributes={
+                "channel": "LongFast",
+                "channel_hash": "8",
+                "result": "success",
+            },
+        ),
+        call(
+            1,
+            attributes={
+                "channel": "LongFast",
+                "channel_hash": "8",
+                "result": "failure",
+            },
+        ),
+        call(
+            1,
+            attributes={
+                "channel": "unknown",
+                "channel_hash": "9",
+                "result": "unknown_channel",
+            },
+        ),
+    ]
+
+
+def test_mqtt_packets_on_channels_with_keys_are_decrypted(mocker: MockerFixture):
+    mocker.patch.object(exporter, "channel_keys", parse_channel_keys("LongFast=AQ=="))
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+    mock_set_battery_level = mocker.patch.object(
+        exporter.meshtastic_telemetry_device_battery_level_percent, "set"
+    )
+    telemetry = telemetry_pb2.Telemetry(time=1732550036)
+    telemetry.device_metrics.battery_level = 87
+    data = mesh_pb2.Data(
+        portnum=portnums_pb2.TELEMETRY_APP, payload=telemetry.SerializeToString()
+    )
+    exporter.save_node_metadata_in_cache(
+        exporter.node_cache,
+        123456789,
+        {"longName": "namename", "shortName": "name", "hwModel": "TBEAM"},
+    )
+    envelope = mqtt_pb2.ServiceEnvelope(
+        packet=encrypted_packet(data, DEFAULT_KEY, 8),
+        channel_id="LongFast",
+        gateway_id="!deadbeef",
+    )
+
+    exporter.on_mqtt_payload("msh/EU_433/2/e/LongFast", envelope.SerializeToString())
+
+    mock_set_battery_level.assert_called_once_with(
+        87,
+        attributes={
+            "source": 123456789,
+            "source_long_name": "namename",
+            "source_short_name": "name",
+        },
+    )
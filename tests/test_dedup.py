@@ -0,0 +1,84 @@
+import pytest
+
+from meshtastic_prometheus_exporter.dedup import DedupWindow
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_dedup_window_keys_on_from_and_id():
+    window = DedupWindow(ttl=600, maxsize=100, timer=Clock())
+
+    assert not window.seen(123456789, 42)
+    assert window.seen(123456789, 42)
+    assert not window.seen(987654321, 42)
+
+    assert (window.hits, window.misses, window.evictions) == (1, 2, 0)
+
+
+def test_dedup_window_expires_after_ttl():
+    clock = Clock()
+    window = DedupWindow(ttl=600, maxsize=100, buckets=10, timer=clock)
+
+    window.seen(123456789, 42)
+    clock.now = 500
+    assert window.seen(123456789, 42)
+
+    clock.now = 700
+    assert not window.seen(123456789, 42)
+    assert window.evictions == 0
+
+
+def test_dedup_window_evicts_oldest_when_full():
+    clock = Clock()
+    window = DedupWindow(ttl=600, maxsize=2, buckets=10, timer=clock)
+
+    window.seen(1, 1)
+    clock.now = 60
+    window.seen(1, 2)
+    clock.now = 120
+    window.seen(1, 3)
+
+    assert len(window) == 2
+    assert window.evictions == 1
+    assert not window.seen(1, 1)
+
+
+def test_dedup_window_eviction_keeps_ttl_of_other_keys():
+    clock = Clock()
+    window = DedupWindow(ttl=16, maxsize=2, buckets=16, timer=clock)
+
+    window.seen(1, 1)
+    clock.now = 10
+    window.seen(1, 2)
+    window.seen(1, 3)
+
+    assert window.evictions == 1
+    clock.now = 21
+    assert window.seen(1, 2)
+
+
+def test_dedup_window_rejects_empty_maxsize():
+    with pytest.raises(ValueError):
+        DedupWindow(ttl=600, maxsize=0)
+
+
+def test_dedup_window_evicts_one_key_at_a_time():
+    window = DedupWindow(ttl=600, maxsize=3, timer=Clock())
+
+    for packet_id in (1, 2, 3, 4):
+        window.seen(1, packet_id)
+
+    assert window.evictions == 1
+    assert window.seen(1, 2)
+    assert window.seen(1, 3)
+
+
+def test_dedup_window_rejects_empty_ttl():
+    with pytest.raises(ValueError):
+        DedupWindow(ttl=0, maxsize=100)
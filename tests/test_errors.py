@@ -0,0 +1,67 @@
+import logging
+
+from meshtastic_prometheus_exporter import errors
+from meshtastic_prometheus_exporter.errors import ErrorReporter, fingerprint
+
+
+def fail(key):
+    return {}[key]
+
+
+def raised(function, *args):
+    try:
+        function(*args)
+    except Exception as e:
+        return e
+
+
+def test_fingerprint_is_the_exception_type_and_location():
+    error_type, location = fingerprint(raised(fail, "airQuality"))
+
+    assert error_type == "KeyError"
+    assert location.startswith("test_errors.py:fail:")
+    assert fingerprint(raised(fail, "other")) == (error_type, location)
+    assert fingerprint(raised(int, "x"))[0] == "ValueError"
+
+
+def test_reporter_samples_one_exception_per_fingerprint_and_interval(mocker):
+    now = [0.0]
+    captured = []
+    describe = mocker.Mock(return_value="packet")
+    add = mocker.patch.object(errors.meshtastic_exporter_errors_total, "add")
+    log = mocker.patch.object(errors.logger, "error")
+    reporter = ErrorReporter(60, capture=captured.append, timer=lambda: now[0])
+
+    first = raised(fail, "airQuality")
+    assert reporter.report(first, describe)
+    for _ in range(99):
+        assert not reporter.report(raised(fail, "airQuality"), describe)
+    # Another fingerprint is sampled on its own
+    other = raised(int, "x")
+    assert reporter.report(other, describe)
+
+    assert add.call_count == 101
+    assert add.call_args_list[0].kwargs["attributes"]["type"] == "KeyError"
+    assert captured == [first, other]
+    assert describe.call_count == 2
+    assert log.call_count == 2
+
+    now[0] = 60
+    last = raised(fail, "airQuality")
+    assert reporter.report(last, describe)
+    assert captured[-1] is last
+    assert "99 more since the last report" in log.call_args.args[0]
+
+
+def test_reporter_logs_warnings_without_capturing(mocker):
+    captured = []
+    mocker.patch.object(errors.meshtastic_exporter_errors_total, "add")
+    log = mocker.patch.object(errors.logger, "log")
+    reporter = ErrorReporter(60, capture=captured.append)
+
+    assert reporter.report(raised(int, "x"), level=logging.WARNING)
+    assert not reporter.report(raised(int, "x"), level=logging.WARNING)
+
+    assert log.call_count == 1
+    assert log.call_args.args[0] == logging.WARNING
+    assert captured == []
@@ -0,0 +1,53 @@
+import gzip
+import urllib.request
+
+from prometheus_client import CollectorRegistry, Counter
+
+from meshtastic_prometheus_exporter import metrics
+from meshtastic_prometheus_exporter.exposition import (
+    ExpositionCache,
+    start_exposition_server,
+)
+
+
+def test_exposition_cache_rebuilds_after_interval_when_dirty():
+    now = [0.0]
+    registry = CollectorRegistry()
+    counter = Counter("test_exposition", "test", registry=registry)
+    cache = ExpositionCache(registry, interval=10, timer=lambda: now[0])
+
+    plain, compressed = cache.get()
+    assert b"test_exposition_total 0.0" in plain
+    assert gzip.decompress(compressed) == plain
+
+    counter.inc()
+    metrics.dirty = True
+    now[0] = 5
+    assert cache.get()[0] == plain
+
+    now[0] = 10
+    assert b"test_exposition_total 1.0" in cache.get()[0]
+
+    counter.inc()
+    now[0] = 30
+    assert b"test_exposition_total 1.0" in cache.get()[0]
+
+
+def test_exposition_server_serves_gzip():
+    registry = CollectorRegistry()
+    Counter("test_exposition_server", "test", registry=registry).inc()
+    server, thread = start_exposition_server(
+        0, "127.0.0.1", ExpositionCache(registry, interval=10)
+    )
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Encoding"] == "gzip"
+            body = gzip.decompress(response.read())
+        with urllib.request.urlopen(url) as response:
+            assert response.read() == body
+        assert b"test_exposition_server_total 1.0" in body
+    finally:
+        server.shutdown()
+        server.server_close()
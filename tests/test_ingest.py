@@ -0,0 +1,33 @@
+from meshtastic_prometheus_exporter.ingest import IngestQueue
+
+
+def test_ingest_queue_drop_oldest():
+    ingest_queue = IngestQueue(None, maxsize=2, policy="drop_oldest")
+    for i in range(3):
+        ingest_queue.put(("msh/EU_433", i))
+
+    assert ingest_queue.dropped == 1
+    assert [ingest_queue._queue.get_nowait()[1] for _ in range(2)] == [1, 2]
+
+
+def test_ingest_queue_drop_newest():
+    ingest_queue = IngestQueue(None, maxsize=2, policy="drop_newest")
+    for i in range(3):
+        ingest_queue.put(("msh/EU_433", i))
+
+    assert ingest_queue.dropped == 1
+    assert [ingest_queue._queue.get_nowait()[1] for _ in range(2)] == [0, 1]
+
+
+def test_ingest_queue_workers_process_messages():
+    processed = []
+    ingest_queue = IngestQueue(
+        lambda topic, payload: processed.append(payload), maxsize=10, workers=2
+    )
+    ingest_queue.start()
+    for i in range(5):
+        ingest_queue.put(("msh/EU_433", i))
+    ingest_queue.stop()
+
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    assert len(ingest_queue) == 0
@@ -0,0 +1,191 @@
+import pytest
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.metrics.view import View
+from pytest_mock import MockerFixture
+from unittest.mock import call
+
+from meshtastic_prometheus_exporter import metrics
+
+
+def test_parse_metric_attributes():
+    assert metrics.parse_metric_attributes(
+        "meshtastic_mesh_packets_total=source,type; meshtastic_telemetry_*=source;"
+    ) == {
+        "meshtastic_mesh_packets_total": {"source", "type"},
+        "meshtastic_telemetry_*": {"source"},
+    }
+
+
+def test_series_limit_folds_new_series_into_overflow(mocker: MockerFixture):
+    counter = metrics.Counter(name="test_series_limit_total")
+    counter.attribute_keys = {"source"}
+    counter.series_limit = 2
+    mock_add = mocker.patch.object(counter._counter, "add")
+    mock_add_dropped = mocker.patch.object(
+        metrics.meshtastic_exporter_dropped_series_total, "add"
+    )
+
+    for source in (1, 1, 2, 3, 3):
+        counter.add(1, attributes={"source": source, "type": "TEXT_MESSAGE_APP"})
+
+    assert [c.kwargs["attributes"] for c in mock_add.call_args_list] == [
+        {"source": 1, "type": "TEXT_MESSAGE_APP"},
+        {"source": 1, "type": "TEXT_MESSAGE_APP"},
+        {"source": 2, "type": "TEXT_MESSAGE_APP"},
+        metrics.OVERFLOW_ATTRIBUTES,
+        metrics.OVERFLOW_ATTRIBUTES,
+    ]
+    mock_add_dropped.assert_called_once_with(
+        1, attributes={"instrument": "test_series_limit_total"}
+    )
+
+
+def test_dropped_series_are_not_limited(mocker: MockerFixture):
+    counters = [metrics.Counter(name=f"test_dropped_{i}_total") for i in range(3)]
+    mock_add = mocker.patch.object(
+        metrics.meshtastic_exporter_dropped_series_total._counter, "add"
+    )
+    metrics.configure_instruments({}, series_limit=1)
+    try:
+        for counter in counters:
+            mocker.patch.object(counter._counter, "add")
+            for source in (1, 2):
+                counter.add(1, attributes={"source": source})
+    finally:
+        metrics.configure_instruments({}, series_limit=0)
+
+    assert [c.kwargs["attributes"] for c in mock_add.call_args_list] == [
+        {"instrument": f"test_dropped_{i}_total"} for i in range(3)
+    ]
+
+
+def test_views_keep_configured_attributes():
+    reader = InMemoryMetricReader()
+    provider = MeterProvider(
+        metric_readers=[reader],
+        views=[
+            View(
+                instrument_name="test_view_total",
+                attribute_keys={"source"} | set(metrics.OVERFLOW_ATTRIBUTES),
+            )
+        ],
+    )
+    counter = provider.get_meter("test").create_counter("test_view_total")
+    counter.add(1, attributes={"source": 1, "type": "TEXT_MESSAGE_APP"})
+    counter.add(1, attributes={"source": 1, "type": "POSITION_APP"})
+    counter.add(1, attributes=metrics.OVERFLOW_ATTRIBUTES)
+
+    points = reader.get_metrics_data().resource_metrics[0].scope_metrics[0]
+    assert {
+        frozenset(p.attributes.items()): p.value
+        for p in points.metrics[0].data.data_points
+    } == {
+        frozenset({"source": 1}.items()): 2,
+        frozenset(metrics.OVERFLOW_ATTRIBUTES.items()): 1,
+    }
+
+
+def test_first_matching_pattern_selects_attributes():
+    metrics.Counter(name="test_pattern_packets_total")
+    views = metrics.configure_instruments(
+        {"test_pattern_packets_total": {"source"}, "test_pattern_*": {"type"}},
+        series_limit=0,
+    )
+    reader = InMemoryMetricReader()
+    provider = MeterProvider(metric_readers=[reader], views=views)
+    counter = provider.get_meter("test").create_counter("test_pattern_packets_total")
+    counter.add(1, attributes={"source": 1, "type": "TEXT_MESSAGE_APP"})
+
+    points = reader.get_metrics_data().resource_metrics[0].scope_metrics[0]
+    assert [dict(p.attributes) for m in points.metrics for p in m.data.data_points] == [
+        {"source": 1}
+    ]
+    assert metrics.INSTRUMENTS["test_pattern_packets_total"].attribute_keys == {
+        "source"
+    } | set(metrics.OVERFLOW_ATTRIBUTES)
+
+
+def test_gauge_expires_stale_series():
+    now = [0.0]
+    gauge = metrics.Gauge(name="test_gauge_staleness", timer=lambda: now[0])
+    gauge.staleness = 60
+    forgotten = []
+
+    def hook(name, keys):
+        forgotten.extend(keys)
+
+    metrics.SERIES_EXPIRED_HOOKS.append(hook)
+    try:
+        gauge.set(1, attributes={"source": 1})
+        now[0] = 30
+        gauge.set(2, attributes={"source": 2})
+        now[0] = 50
+        gauge.set(3, attributes={"source": 1})
+        assert [o.value for o in gauge.observe()] == [3, 2]
+
+        now[0] = 100
+        assert [o.value for o in gauge.observe()] == [3]
+        assert forgotten == [frozenset({"source": 2}.items())]
+        assert len(gauge._values) == 1
+    finally:
+        metrics.SERIES_EXPIRED_HOOKS.remove(hook)
+
+
+def test_histogram_expires_stale_series():
+    now = [0.0]
+    histogram = metrics.Histogram(
+        name="test_histogram_staleness", boundaries=(1,), timer=lambda: now[0]
+    )
+    histogram.staleness = 60
+
+    histogram.record(1, attributes={"source": 1})
+    now[0] = 30
+    histogram.record(2, attributes={"source": 2})
+    now[0] = 70
+    assert [dict(key) for key, _ in histogram.series()] == [{"source": 2}]
+
+    histogram.record(1, attributes={"source": 1})
+    assert dict(histogram.series())[frozenset({"source": 1}.items())] == (
+        (1, 0),
+        1,
+    )
+
+
+def test_attributes_keep_their_series_key():
+    gauge = metrics.Gauge(name="test_gauge_attributes")
+    gauge.attribute_keys = {"source"}
+    attributes = metrics.Attributes(source=1, source_long_name="one")
+
+    gauge.set(1, attributes=attributes)
+    gauge.set(2, attributes=attributes)
+
+    assert attributes._keys == {gauge.name: frozenset({"source": 1}.items())}
+    assert [o.value for o in gauge.observe()] == [2]
+    with pytest.raises(TypeError):
+        attributes["source"] = 2
+
+
+def test_forget_sdk_series():
+    reader = InMemoryMetricReader()
+    provider = MeterProvider(metric_readers=[reader])
+    values = {1: 10, 2: 20}
+    provider.get_meter("test").create_observable_gauge(
+        "test_forget_sdk_series",
+        callbacks=[
+            lambda options: [
+                metrics.Observation(v, {"source": s}) for s, v in values.items()
+            ]
+        ],
+    )
+    reader.get_metrics_data()
+    del values[2]
+    metrics.forget_sdk_series(
+        provider, "test_forget_sdk_series", [frozenset({"source": 2}.items())]
+    )
+
+    storage = next(iter(provider._measurement_consumer._reader_storages.values()))
+    (matches,) = storage._instrument_view_instrument_matches.values()
+    assert list(matches[0]._attributes_aggregation) == [
+        frozenset({"source": 1}.items())
+    ]
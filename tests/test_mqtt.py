@@ -0,0 +1,137 @@
+from cachetools import LRUCache
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2
+from meshtastic_prometheus_exporter.nodedb import NodeRegistry
+from pytest_mock import MockerFixture
+from unittest.mock import call
+
+
+def service_envelope(packet_id, encrypted=False):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=0xFFFFFFFF)
+    setattr(packet, "from", 123456789)
+    if encrypted:
+        packet.encrypted = b"\x00" * 16
+    else:
+        packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+        packet.decoded.payload = b"hello"
+    return mqtt_pb2.ServiceEnvelope(
+        packet=packet, channel_id="LongFast", gateway_id="!deadbeef"
+    ).SerializeToString()
+
+
+def test_predecode_drops_duplicates_and_encrypted_packets(mocker: MockerFixture):
+    mock_add_full_parses_avoided = mocker.patch.object(
+        exporter.meshtastic_exporter_full_parses_avoided_total, "add"
+    )
+
+    payload = service_envelope(4242424242)
+    envelope = exporter.predecode_service_envelope("msh/EU_433", payload)
+    assert envelope.packet.id == 4242424242
+    assert exporter.predecode_service_envelope("msh/EU_433", payload) is None
+    assert (
+        exporter.predecode_service_envelope(
+            "msh/EU_433", service_envelope(4242424243, encrypted=True)
+        )
+        is None
+    )
+
+    assert mock_add_full_parses_avoided.call_args_list == [
+        call(1, attributes={"reason": "duplicate"}),
+        call(1, attributes={"reason": "encrypted"}),
+    ]
+
+
+def test_on_message_counts_packets_per_source(mocker: MockerFixture):
+    mock_add_ingest_packets = mocker.patch.object(
+        exporter.meshtastic_exporter_ingest_packets_total, "add"
+    )
+    mock_process = mocker.patch.object(exporter, "on_meshtastic_service_envelope")
+    payload = service_envelope(4242424244)
+    message = mocker.Mock(topic="msh/EU_433", payload=payload)
+
+    for name in ("eu433", "eu868"):
+        exporter.on_message(None, {"name": name, "ingest_queue": None}, message)
+
+    mock_process.assert_called_once()
+    assert mock_add_ingest_packets.call_args_list == [
+        call(1, attributes={"ingest_source": "eu433", "status": "accepted"}),
+        call(1, attributes={"ingest_source": "eu868", "status": "duplicate"}),
+    ]
+
+
+def test_on_message_reports_exceptions(mocker: MockerFixture):
+    error = KeyError("airQuality")
+    mocker.patch.object(exporter, "on_meshtastic_service_envelope", side_effect=error)
+    mock_report = mocker.patch.object(exporter, "report_packet_exception")
+    message = mocker.Mock(topic="msh/EU_433", payload=service_envelope(4242424250))
+
+    # Raising would stop the paho network loop
+    exporter.on_message(None, {"name": "eu433", "ingest_queue": None}, message)
+
+    mock_report.assert_called_once()
+    assert mock_report.call_args.args[0] is error
+    assert mock_report.call_args.args[1].id == 4242424250
+
+
+def test_predecode_counts_dropped_packets(mocker: MockerFixture):
+    mock_add_dropped_packets = mocker.patch.object(
+        exporter.meshtastic_exporter_dropped_packets_total, "add"
+    )
+    mock_report = mocker.patch.object(exporter.error_reporter, "report")
+
+    payload = service_envelope(4242424245)
+    exporter.predecode_service_envelope("msh/EU_433", payload)
+    exporter.predecode_service_envelope("msh/EU_433", payload)
+    exporter.predecode_service_envelope("msh/EU_433", b"\xff")
+
+    assert mock_add_dropped_packets.call_args_list == [
+        call(1, attributes={"reason": "duplicate"}),
+        call(1, attributes={"reason": "invalid"}),
+    ]
+    mock_report.assert_called_once()
+    assert mock_report.call_args.args[1]() == "payload from `msh/EU_433` topic"
+
+
+def test_mesh_packet_records_hops_and_interarrival(mocker: MockerFixture):
+    mocker.patch.object(exporter, "node_cache", NodeRegistry(maxsize=10, ttl=3600))
+    mocker.patch.object(exporter, "last_arrivals", LRUCache(maxsize=10))
+    exporter.node_cache[123456789] = {"long_name": "Node", "short_name": "node"}
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+    mock_record_hops = mocker.patch.object(
+        exporter.meshtastic_mesh_packet_hops, "record"
+    )
+    mock_record_interarrival = mocker.patch.object(
+        exporter.meshtastic_mesh_network_packet_interarrival_seconds, "record"
+    )
+    mocker.patch.object(exporter.time, "monotonic", side_effect=[100.0, 130.0])
+
+    for packet_id, hop_start in ((4242424246, 3), (4242424247, 0)):
+        packet = mesh_pb2.MeshPacket(
+            id=packet_id, to=0xFFFFFFFF, hop_start=hop_start, hop_limit=1
+        )
+        setattr(packet, "from", 123456789)
+        packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+        exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    labels = exporter.node_cache.labels(123456789)
+    # hop_start 0 is firmware that does not report it
+    mock_record_hops.assert_called_once_with(2, attributes=labels.gauge_attributes)
+    mock_record_interarrival.assert_called_once_with(30.0, exporter.network_attributes)
+
+
+def test_interarrival_of_nodes_without_nodeinfo(mocker: MockerFixture):
+    mocker.patch.object(exporter, "node_cache", NodeRegistry(maxsize=10, ttl=3600))
+    mocker.patch.object(exporter, "last_arrivals", LRUCache(maxsize=10))
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+    mock_record_interarrival = mocker.patch.object(
+        exporter.meshtastic_mesh_packet_interarrival_seconds, "record"
+    )
+    mocker.patch.object(exporter.time, "monotonic", side_effect=[100.0, 115.0])
+
+    for packet_id in (4242424248, 4242424249):
+        packet = mesh_pb2.MeshPacket(id=packet_id, to=0xFFFFFFFF)
+        setattr(packet, "from", 123456788)
+        packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+        exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    assert mock_record_interarrival.call_args.args[0] == 15.0
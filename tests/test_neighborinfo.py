@@ -1,5 +1,9 @@
 import meshtastic_prometheus_exporter.__main__ as exporter
 import json
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.sdk.metrics import MeterProvider
+from prometheus_client import CollectorRegistry, generate_latest
 from pytest_mock import MockerFixture
 from unittest.mock import call
 
@@ -39,3 +43,112 @@ def test_nodeinfo(mocker: MockerFixture):
     neighbor_info = json.loads(packet)["decoded"]["neighborinfo"]
     for n in neighbor_info["neighbors"]:
         mock_set_snr_decibels.assert_called()  # TODO: more logic here
+
+
+def test_neighborinfo_pb(mocker: MockerFixture):
+    neighbor_info = mesh_pb2.NeighborInfo(
+        node_id=123456789,
+        neighbors=[
+            mesh_pb2.Neighbor(node_id=123456711, snr=3.5),
+            mesh_pb2.Neighbor(node_id=123456722, snr=-11.5),
+        ],
+    )
+    packet = mesh_pb2.MeshPacket(id=3117092157, to=987654321)
+    setattr(packet, "from", 123456789)
+    packet.decoded.portnum = portnums_pb2.NEIGHBORINFO_APP
+    packet.decoded.payload = neighbor_info.SerializeToString()
+
+    mocker.patch(
+        "meshtastic_prometheus_exporter.neighborinfo.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mock_set_snr_decibels = mocker.patch.object(
+        exporter.meshtastic_neighbor_info_snr_decibels, "set"
+    )
+    mock_add_packets_total = mocker.patch.object(
+        exporter.meshtastic_mesh_packets_total, "add"
+    )
+
+    exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    mock_add_packets_total.assert_called_once()
+    assert [c.args[0] for c in mock_set_snr_decibels.call_args_list] == [3.5, -11.5]
+
+
+def test_neighborinfo_pb_updates_topology(mocker: MockerFixture):
+    neighbor_info = mesh_pb2.NeighborInfo(
+        node_id=123456790,
+        neighbors=[
+            mesh_pb2.Neighbor(node_id=123456766, snr=3.5),
+            mesh_pb2.Neighbor(node_id=123456777, snr=-11.5),
+        ],
+    )
+    packet = mesh_pb2.MeshPacket(id=3117092158, to=987654321)
+    setattr(packet, "from", 123456790)
+    packet.decoded.portnum = portnums_pb2.NEIGHBORINFO_APP
+    packet.decoded.payload = neighbor_info.SerializeToString()
+
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mocker.patch.object(exporter.meshtastic_neighbor_info_snr_decibels, "set")
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+
+    exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    degrees = exporter.topology.degrees()
+    assert degrees[123456790] == 2
+    assert degrees[123456766] == 1
+    assert exporter.topology.link_snr()[123456790] == (-11.5, -4.0, 3.5)
+
+
+def test_neighborinfo_exposes_a_series_per_neighbor(mocker: MockerFixture):
+    neighbor_info = mesh_pb2.NeighborInfo(
+        node_id=123456791,
+        neighbors=[
+            mesh_pb2.Neighbor(node_id=5, snr=1.5),
+            mesh_pb2.Neighbor(node_id=7, snr=2.5),
+            mesh_pb2.Neighbor(node_id=9, snr=3.5),
+        ],
+    )
+    packet = mesh_pb2.MeshPacket(id=3117092159, to=987654321)
+    setattr(packet, "from", 123456791)
+    packet.decoded.portnum = portnums_pb2.NEIGHBORINFO_APP
+    packet.decoded.payload = neighbor_info.SerializeToString()
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+
+    reader = PrometheusMetricReader()
+    registry = CollectorRegistry()
+    registry.register(reader._collector)
+    provider = MeterProvider(metric_readers=[reader])
+    provider.get_meter("test").create_observable_gauge(
+        "meshtastic_neighbor_info_snr_decibels",
+        callbacks=[exporter.meshtastic_neighbor_info_snr_decibels.observe],
+    )
+    try:
+        exporter.on_meshtastic_mesh_packet_pb(packet)
+        exposition = generate_latest(registry).decode()
+    finally:
+        provider.shutdown()
+
+    series = sorted(
+        line
+        for line in exposition.splitlines()
+        if line.startswith("meshtastic_neighbor_info_snr_decibels{")
+        and 'source="123456791"' in line
+    )
+    assert [line.split('neighbor_source="')[1][0] for line in series] == [
+        "5",
+        "7",
+        "9",
+    ]
+    assert [float(line.rsplit(" ", 1)[1]) for line in series] == [1.5, 2.5, 3.5]
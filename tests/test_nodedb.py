@@ -0,0 +1,120 @@
+from meshtastic_prometheus_exporter.nodedb import (
+    DeviceNodeSync,
+    NodeRegistry,
+    NodeStore,
+    sync_device_nodes,
+)
+from meshtastic_prometheus_exporter.util import (
+    get_decoded_node_metadata_from_cache,
+    save_node_metadata_in_cache,
+)
+
+
+def test_node_registry_survives_restart(tmp_path):
+    path = str(tmp_path / "nodedb.sqlite")
+
+    store = NodeStore(path, ttl=3600)
+    registry = NodeRegistry(maxsize=100, ttl=3600, store=store)
+    save_node_metadata_in_cache(
+        registry,
+        123456789,
+        {"longName": "namename", "shortName": "name", "hwModel": "TBEAM"},
+    )
+    store.close()
+
+    restarted = NodeRegistry(maxsize=100, ttl=3600, store=NodeStore(path, ttl=3600))
+    assert restarted.load() == 1
+    assert (
+        get_decoded_node_metadata_from_cache(restarted, 123456789, "long_name")
+        == "namename"
+    )
+    assert restarted[123456789]["is_licensed"] == "False"
+
+
+def test_node_registry_skips_expired_nodes(tmp_path):
+    path = str(tmp_path / "nodedb.sqlite")
+
+    store = NodeStore(path, ttl=3600)
+    store.put(123456789, {"long_name": "namename", "short_name": "name"})
+    store.close()
+
+    registry = NodeRegistry(maxsize=100, ttl=0, store=NodeStore(path, ttl=-1))
+    assert registry.load() == 0
+
+
+def test_node_registry_evicts_least_recently_updated():
+    registry = NodeRegistry(maxsize=2, ttl=3600)
+    registry[1] = {"long_name": "one"}
+    registry[2] = {"long_name": "two"}
+    registry[1] = {"long_name": "one"}
+    registry[3] = {"long_name": "three"}
+
+    assert sorted(registry) == [1, 3]
+
+
+def test_node_registry_rebuilds_labels_when_names_change():
+    registry = NodeRegistry(maxsize=100, ttl=3600)
+    assert registry.labels(1) is None
+
+    registry[1] = {"long_name": "one", "short_name": "1", "hw_model": "TBEAM"}
+    labels = registry.labels(1)
+    assert labels.source == {
+        "source": 1,
+        "source_long_name": "one",
+        "source_short_name": "1",
+    }
+    assert registry.labels(1) is labels
+
+    registry[1] = {"long_name": "one", "short_name": "1", "hw_model": "RAK4631"}
+    assert registry.labels(1) is labels
+
+    registry[1] = {"long_name": "uno", "short_name": "1", "hw_model": "RAK4631"}
+    assert registry.labels(1).to == {
+        "to": 1,
+        "to_long_name": "uno",
+        "to_short_name": "1",
+    }
+    del registry[1]
+    assert registry.labels(1) is None
+
+
+def test_sync_device_nodes_applies_only_changes():
+    registry = NodeRegistry(maxsize=100, ttl=3600)
+    nodes = {
+        "!00000001": {
+            "num": 1,
+            "user": {"longName": "one", "shortName": "1", "hwModel": "TBEAM"},
+        },
+        # Not heard a NodeInfo of yet
+        "!00000002": {"num": 2},
+        "!00000003": {"num": 3, "user": {"id": "!00000003"}},
+    }
+
+    assert sync_device_nodes(nodes, registry, batch_size=1) == 1
+    assert registry[1] == {
+        "long_name": "one",
+        "short_name": "1",
+        "hw_model": "TBEAM",
+        "is_licensed": "False",
+    }
+    labels = registry.labels(1)
+    assert sync_device_nodes(nodes, registry) == 0
+    assert registry.labels(1) is labels
+
+    nodes["!00000002"]["user"] = {"longName": "two", "shortName": "2"}
+    nodes["!00000001"]["user"]["longName"] = "uno"
+    assert sync_device_nodes(nodes, registry, batch_size=1) == 2
+    assert registry.labels(1).long_name == "uno"
+    assert registry.labels(2).short_name == "2"
+
+
+def test_device_node_sync_reads_every_interface():
+    registry = NodeRegistry(maxsize=100, ttl=3600)
+    sync = DeviceNodeSync(registry, interval=300)
+
+    class Interface:
+        nodes = {"!00000001": {"num": 1, "user": {"longName": "one"}}}
+
+    sync.interfaces += [Interface(), object()]
+    assert sync.sync() == 1
+    assert registry.labels(1).long_name == "one"
@@ -1,5 +1,6 @@
 import meshtastic_prometheus_exporter.__main__ as exporter
 import json
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
 from pytest_mock import MockerFixture
 
 
@@ -27,3 +28,45 @@ def test_nodeinfo(mocker: MockerFixture):
 
     mock_set_last_heard_timestamp_seconds.assert_called_once()
     mock_add_packets_total.assert_called_once()
+
+
+def test_nodeinfo_pb(mocker: MockerFixture):
+    user = mesh_pb2.User(
+        id="!1fc44445", long_name="namename", short_name="name", hw_model="TBEAM"
+    )
+    packet = mesh_pb2.MeshPacket(id=662811675, to=0xFFFFFFFF)
+    setattr(packet, "from", 0x1FC44445)
+    packet.decoded.portnum = portnums_pb2.NODEINFO_APP
+    packet.decoded.payload = user.SerializeToString()
+
+    mock_save_node_metadata_in_cache = mocker.patch(
+        "meshtastic_prometheus_exporter.nodeinfo.save_node_metadata_in_cache"
+    )
+    mock_set_last_heard_timestamp_seconds = mocker.patch.object(
+        exporter.meshtastic_node_info_last_heard_timestamp_seconds, "set"
+    )
+    mock_add_packets_total = mocker.patch.object(
+        exporter.meshtastic_mesh_packets_total, "add"
+    )
+
+    exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    mock_save_node_metadata_in_cache.assert_called_once_with(
+        exporter.node_cache,
+        0x1FC44445,
+        {
+            "longName": "namename",
+            "shortName": "name",
+            "hwModel": "TBEAM",
+            "isLicensed": False,
+        },
+    )
+    mock_set_last_heard_timestamp_seconds.assert_called_once()
+    assert mock_set_last_heard_timestamp_seconds.call_args.kwargs["attributes"] == {
+        "source": 0x1FC44445,
+        "user": "!1fc44445",
+        "source_long_name": "namename",
+        "source_short_name": "name",
+        "is_licensed": "0",
+    }
+    mock_add_packets_total.assert_called_once()
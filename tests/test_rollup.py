@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from meshtastic_prometheus_exporter.rollup import (
+    RELATIVE_ACCURACY,
+    QuantileSketch,
+    Rollups,
+)
+
+
+def test_sketch_quantiles_are_within_relative_accuracy():
+    rng = random.Random(42)
+    values = [rng.lognormvariate(1, 1) for _ in range(10000)] + [0.0] * 100
+    sketch = QuantileSketch()
+    for value in values[:5000]:
+        sketch.add(value)
+    other = QuantileSketch()
+    for value in values[5000:]:
+        other.add(value)
+    sketch.merge(other)
+
+    values.sort()
+    assert sketch.count == len(values)
+    assert sketch.min == 0.0
+    assert sketch.max == values[-1]
+    assert abs(sketch.mean - sum(values) / len(values)) < 1e-9
+    for quantile, estimate in zip((0.5, 0.95), sketch.quantiles((0.5, 0.95))):
+        exact = values[int(quantile * (len(values) - 1))]
+        assert abs(estimate - exact) <= RELATIVE_ACCURACY * exact
+    # Estimates are clamped to the values seen
+    assert sketch.quantiles((0.0,)) == [0.0]
+
+
+def test_rollups_cover_the_last_window():
+    now = [0.0]
+    rollups = Rollups(window=100, slices=4, timer=lambda: now[0])
+    attributes = (("channel", "LongFast"), ("region", "EU_868"))
+
+    rollups.add("battery", attributes, 10.0)
+    now[0] = 30
+    rollups.add("battery", attributes, 30.0)
+    rollups.add("voltage", attributes, 4.1)
+
+    observations = {
+        (o.attributes["metric"], o.attributes["quantile"]): o.value
+        for o in rollups.observe_quantiles(None)
+    }
+    assert observations[("battery", "0.5")] == pytest.approx(10.0, rel=0.01)
+    assert [
+        (o.value, o.attributes)
+        for o in rollups.observe_mean(None)
+        if o.attributes["metric"] == "battery"
+    ] == [(20.0, {"metric": "battery", "channel": "LongFast", "region": "EU_868"})]
+
+    # The slice of the first measurement leaves the window
+    now[0] = 110
+    assert {o.attributes["metric"]: o.value for o in rollups.observe_count(None)} == {
+        "battery": 1,
+        "voltage": 1,
+    }
+    now[0] = 130
+    assert list(rollups.observe_max(None)) == []
@@ -0,0 +1,156 @@
+import multiprocessing
+import threading
+import time
+
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2
+
+from meshtastic_prometheus_exporter import metrics
+from meshtastic_prometheus_exporter.collector import Collector, merge
+from meshtastic_prometheus_exporter.shards import ShardRouter
+
+
+def envelope(sender, packet_id, portnum=portnums_pb2.TEXT_MESSAGE_APP):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=0xFFFFFFFF)
+    setattr(packet, "from", sender)
+    packet.decoded.portnum = portnum
+    return mqtt_pb2.ServiceEnvelope(packet=packet)
+
+
+def test_merge_sums_counters_and_keeps_latest_gauges():
+    state = {
+        "packets": ("counter", "", {"a": 1}),
+        "voltage": ("gauge", "", {"a": (3.3, 10)}),
+    }
+    merge(
+        state,
+        {
+            "packets": ("counter", "", {"a": 2, "b": 1}),
+            "voltage": ("gauge", "", {"a": (3.9, 20)}),
+        },
+    )
+    assert state == {
+        "packets": ("counter", "", {"a": 3, "b": 1}),
+        "voltage": ("gauge", "", {"a": (3.9, 20)}),
+    }
+
+
+def test_snapshots_skip_shards_that_do_not_answer(mocker):
+    router = ShardRouter(2, None, None, maxsize=1000)
+    router.snapshot_timeout = 0.1
+    router._processes = [mocker.Mock(**{"is_alive.return_value": True})] * 2
+    silent, silent_shard = multiprocessing.Pipe()
+    lost, lost_shard = multiprocessing.Pipe()
+    router._pipes = [(silent, silent_shard), (lost, lost_shard)]
+    lost_shard.close()
+
+    assert list(router.snapshots()) == []
+
+    # The late answer to the request that timed out is not taken for the
+    # answer to the next one
+    silent_shard.send("late")
+
+    def answer():
+        silent_shard.recv()
+        silent_shard.recv()
+        silent_shard.send("current")
+
+    answering = threading.Thread(target=answer)
+    answering.start()
+    assert list(router.snapshots()) == ["current"]
+    answering.join()
+
+
+def route(envelopes, expected_packets):
+    """
+    Route ``envelopes`` through two shards and return the merged metrics and
+    the nodes saved by the parent. Runs in a spawned process, so that the
+    shards are forked from a process without other threads.
+    """
+    packets = metrics.Counter(name="test_shard_packets_total")
+    packets._totals = {}
+    users = metrics.Counter(name="test_shard_users_total")
+    users._totals = {}
+    instruments = {packets.name: packets, users.name: users}
+    saved = []
+
+    def handler(topic, envelope):
+        packet = envelope.packet
+        if packet.HasField("encrypted"):
+            # Decrypted in place like decrypt_mesh_packet does
+            packet.decoded.portnum = portnums_pb2.NODEINFO_APP
+        packets.add(1, attributes={"from": getattr(packet, "from")})
+
+    def save_user(packet):
+        users.add(1, attributes={"from": getattr(packet, "from")})
+        saved.append(getattr(packet, "from"))
+
+    router = ShardRouter(2, handler, save_user, maxsize=1000)
+    router.start()
+    try:
+        for item in envelopes:
+            router.put(item)
+
+        collector = Collector(instruments=instruments, observables=[], shards=router)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            state = {family.name: family.samples for family in collector.collect()}
+            if sum(
+                s.value for s in state.get("test_shard_packets", [])
+            ) == expected_packets and sum(
+                s.value for s in state.get("test_shard_users", [])
+            ) == 2 * (
+                len(saved) or 1
+            ):
+                break
+            time.sleep(0.05)
+    finally:
+        router.stop()
+
+    return (
+        {s.labels["from"]: s.value for s in state["test_shard_packets"]},
+        [s.value for s in state["test_shard_users"]],
+        saved,
+    )
+
+
+def call_and_send(results, function, args):
+    results.put(function(*args))
+
+
+def run_spawned(function, *args):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=call_and_send, args=(results, function, args))
+    process.start()
+    try:
+        return results.get(timeout=60)
+    finally:
+        process.join()
+
+
+def test_shard_router_merges_shard_metrics():
+    envelopes = [
+        ("msh/EU_433", envelope(sender, packet_id))
+        for packet_id, sender in enumerate((10, 11, 10, 13))
+    ]
+    envelopes.append(("msh/EU_433", envelope(12, 5, portnums_pb2.NODEINFO_APP)))
+
+    packets, users, saved = run_spawned(route, envelopes, 5)
+
+    assert packets == {"10": 2, "11": 1, "12": 1, "13": 1}
+    # Saved by the parent and by the shard not owning node 12, the owner
+    # processes the packet itself
+    assert users == [2]
+    assert saved == [12]
+
+
+def test_shard_router_forwards_decrypted_nodeinfo_to_parent():
+    encrypted = envelope(21, 6)
+    encrypted.packet.encrypted = b"ciphertext"
+
+    packets, users, saved = run_spawned(route, [("msh/EU_433", encrypted)], 1)
+
+    assert packets == {"21": 1}
+    # Saved by the parent and by the shard not owning node 21
+    assert users == [2]
+    assert saved == [21]
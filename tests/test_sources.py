@@ -0,0 +1,54 @@
+import pytest
+
+import meshtastic_prometheus_exporter.__main__ as exporter
+from meshtastic_prometheus_exporter.sources import default_source, parse_sources
+
+
+def test_parse_sources_defaults_to_meshtastic_interface():
+    config = {**exporter.config, "meshtastic_interface": "MQTT"}
+    (source,) = parse_sources(None, config)
+    assert source["name"] == "mqtt"
+    assert source["topics"] == [config["mqtt_topic"]]
+    assert source["address"] == config["mqtt_address"]
+
+
+def test_default_source_uses_serial_device():
+    config = {
+        **exporter.config,
+        "meshtastic_interface": "SERIAL",
+        "interface_serial_device": "/dev/ttyUSB1",
+    }
+    assert default_source(config)["device"] == "/dev/ttyUSB1"
+    (source,) = parse_sources('[{"name": "gateway", "interface": "SERIAL"}]', config)
+    assert source["device"] == "/dev/ttyUSB1"
+
+
+def test_parse_sources():
+    sources = parse_sources(
+        '[{"name": "eu433", "interface": "mqtt", "topic": "msh/EU_433/#"},'
+        ' {"name": "eu868", "interface": "MQTT", "topics": ["msh/EU_868/#"],'
+        '  "address": "broker.example.org"},'
+        ' {"name": "gateway", "interface": "TCP", "address": "192.168.1.10"}]',
+        exporter.config,
+    )
+    assert [(s["name"], s["interface"]) for s in sources] == [
+        ("eu433", "MQTT"),
+        ("eu868", "MQTT"),
+        ("gateway", "TCP"),
+    ]
+    assert sources[0]["topics"] == ["msh/EU_433/#"]
+    assert sources[0]["address"] == exporter.config["mqtt_address"]
+    assert sources[1]["address"] == "broker.example.org"
+    assert sources[2]["port"] == exporter.config["interface_tcp_port"]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        '[{"name": "a", "interface": "LORA"}]',
+        '[{"interface": "MQTT"}, {"interface": "MQTT"}]',
+    ],
+)
+def test_parse_sources_rejects_invalid_sources(value):
+    with pytest.raises(ValueError):
+        parse_sources(value, exporter.config)
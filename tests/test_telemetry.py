@@ -1,8 +1,22 @@
 import meshtastic_prometheus_exporter.__main__ as exporter
 import json
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+import pytest
+from meshtastic_prometheus_exporter.nodedb import NodeRegistry
+from meshtastic_prometheus_exporter.telemetry import (
+    on_meshtastic_telemetry_app_pb,
+    record_telemetry,
+)
 from pytest_mock import MockerFixture
 
 
+@pytest.fixture(autouse=True)
+def empty_node_cache(mocker: MockerFixture):
+    # Node names come from the mocked cache lookup, not from nodes saved by
+    # other tests
+    mocker.patch.object(exporter, "node_cache", NodeRegistry(maxsize=10, ttl=3600))
+
+
 def mocked_get_decoded_node_metadata_from_cache(cache, node: float, metadata: str):
     return "mocked"
 
@@ -68,3 +82,170 @@ def test_device_metrics_telemetry(mocker: MockerFixture):
         },
     )
     mock_add_packets_total.assert_called_once()
+
+
+def test_device_metrics_telemetry_pb(mocker: MockerFixture):
+    telemetry = telemetry_pb2.Telemetry(time=1732550036)
+    telemetry.device_metrics.battery_level = 101
+    telemetry.device_metrics.channel_utilization = 0.0
+    packet = mesh_pb2.MeshPacket(id=3259852063, to=987654321, hop_limit=3)
+    setattr(packet, "from", 123456789)
+    packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    packet.decoded.payload = telemetry.SerializeToString()
+
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mock_set_battery_level = mocker.patch.object(
+        exporter.meshtastic_telemetry_device_battery_level_percent, "set"
+    )
+    mock_set_voltage = mocker.patch.object(
+        exporter.meshtastic_telemetry_device_voltage_volts, "set"
+    )
+    mock_set_channel_utilization = mocker.patch.object(
+        exporter.meshtastic_telemetry_device_channel_utilization_percent, "set"
+    )
+    mock_add_packets_total = mocker.patch.object(
+        exporter.meshtastic_mesh_packets_total, "add"
+    )
+
+    exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    attributes = {
+        "source": 123456789,
+        "source_long_name": "mocked",
+        "source_short_name": "mocked",
+    }
+    mock_set_battery_level.assert_called_once_with(101, attributes=attributes)
+    mock_set_channel_utilization.assert_called_once_with(0.0, attributes=attributes)
+    mock_set_voltage.assert_not_called()
+    mock_add_packets_total.assert_called_once_with(
+        1,
+        attributes={
+            "source": 123456789,
+            "source_long_name": "mocked",
+            "source_short_name": "mocked",
+            "from": 123456789,
+            "from_long_name": "mocked",
+            "from_short_name": "mocked",
+            "to": 987654321,
+            "to_long_name": "mocked",
+            "to_short_name": "mocked",
+            "channel": 0,
+            "type": "TELEMETRY_APP",
+            "hop_limit": 3,
+            "want_ack": "unknown",
+            "delayed": "unknown",
+            "via_mqtt": "false",
+        },
+    )
+
+
+def test_air_quality_telemetry_with_missing_fields(mocker: MockerFixture):
+    packet = '{"from": 123456789, "to": 987654321, "decoded": {"portnum": "TELEMETRY_APP", "telemetry": {"time": 1732550036, "airQualityMetrics": {"pm25Standard": 12, "co2": 400}}}, "id": 3259852064, "rxTime": 1732550036, "hopLimit": 3, "priority": "BACKGROUND",  "fromId": null, "toId": "^all"}'
+
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mock_set_pm25 = mocker.patch.object(
+        exporter.meshtastic_telemetry_air_quality_pm25_standard, "set"
+    )
+    mock_set_pm10 = mocker.patch.object(
+        exporter.meshtastic_telemetry_air_quality_pm10_standard, "set"
+    )
+    mock_add_unknown = mocker.patch.object(
+        exporter.meshtastic_exporter_telemetry_unknown_total, "add"
+    )
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+
+    exporter.on_meshtastic_mesh_packet(json.loads(packet))
+
+    mock_set_pm25.assert_called_once_with(
+        12,
+        attributes={
+            "source": 123456789,
+            "source_long_name": "mocked",
+            "source_short_name": "mocked",
+        },
+    )
+    mock_set_pm10.assert_not_called()
+    mock_add_unknown.assert_called_once_with(
+        1, attributes={"variant": "air_quality_metrics", "field": "co2"}
+    )
+
+
+def test_power_metrics_telemetry_pb_scales_currents(mocker: MockerFixture):
+    telemetry = telemetry_pb2.Telemetry(time=1732550036)
+    telemetry.power_metrics.ch1_voltage = 5.0
+    telemetry.power_metrics.ch1_current = 250.0
+    packet = mesh_pb2.MeshPacket(id=3259852065, to=987654321, hop_limit=3)
+    setattr(packet, "from", 123456789)
+    packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    packet.decoded.payload = telemetry.SerializeToString()
+
+    mocker.patch(
+        "meshtastic_prometheus_exporter.__main__.get_decoded_node_metadata_from_cache",
+        new=mocked_get_decoded_node_metadata_from_cache,
+    )
+    mock_set_voltage = mocker.patch.object(
+        exporter.meshtastic_telemetry_power_ch1_voltage_volts, "set"
+    )
+    mock_set_current = mocker.patch.object(
+        exporter.meshtastic_telemetry_power_ch1_current_amperes, "set"
+    )
+    mock_set_ch2_voltage = mocker.patch.object(
+        exporter.meshtastic_telemetry_power_ch2_voltage_volts, "set"
+    )
+    mocker.patch.object(exporter.meshtastic_mesh_packets_total, "add")
+
+    exporter.on_meshtastic_mesh_packet_pb(packet)
+
+    attributes = {
+        "source": 123456789,
+        "source_long_name": "mocked",
+        "source_short_name": "mocked",
+    }
+    mock_set_voltage.assert_called_once_with(5.0, attributes=attributes)
+    mock_set_current.assert_called_once_with(0.25, attributes=attributes)
+    mock_set_ch2_voltage.assert_not_called()
+
+
+def test_unknown_telemetry_variant_is_counted(mocker: MockerFixture):
+    mock_add_unknown = mocker.patch.object(
+        exporter.meshtastic_exporter_telemetry_unknown_total, "add"
+    )
+
+    record_telemetry("futureMetrics", {"value": 1}.items(), {})
+
+    mock_add_unknown.assert_called_once_with(
+        1, attributes={"variant": "futureMetrics", "field": ""}
+    )
+
+
+def test_telemetry_pb_rolls_up_device_metrics(mocker: MockerFixture):
+    telemetry = telemetry_pb2.Telemetry(time=1732550036)
+    telemetry.device_metrics.battery_level = 80
+    telemetry.device_metrics.uptime_seconds = 3600
+    packet = mesh_pb2.MeshPacket(id=3259852064, to=987654321)
+    setattr(packet, "from", 123456789)
+    packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    packet.decoded.payload = telemetry.SerializeToString()
+    mocker.patch.object(
+        exporter.meshtastic_telemetry_device_battery_level_percent, "set"
+    )
+    rollup = mocker.Mock()
+
+    on_meshtastic_telemetry_app_pb(packet, "mocked", "mocked", rollup=rollup)
+
+    rollup.assert_called_once_with(
+        "meshtastic_telemetry_device_battery_level_percent", 80
+    )
+
+
+def test_topic_region():
+    assert exporter.topic_region("msh/EU_868/2/e/LongFast/!deadbeef") == "EU_868"
+    assert exporter.topic_region("msh/US/CA/2/e/LongFast/!deadbeef") == "US/CA"
+    assert exporter.topic_region("custom/topic") == "unknown"
+    assert exporter.topic_region(None) == "unknown"
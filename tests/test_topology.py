@@ -0,0 +1,88 @@
+import functools
+
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+
+from meshtastic_prometheus_exporter import metrics
+from meshtastic_prometheus_exporter.topology import TopologyIndex
+
+
+def observations(callback):
+    return {
+        tuple(sorted((observation.attributes or {}).items())): observation.value
+        for observation in callback(None)
+    }
+
+
+def test_topology_tracks_links_and_components():
+    now = [0.0]
+    topology = TopologyIndex(ttl=100, timer=lambda: now[0])
+
+    topology.update(1, [(2, 5.0), (3, -5.0)])
+    topology.update(2, [(1, 7.0)])
+    topology.update(4, [(5, 1.0)])
+    topology.update(6, [])
+
+    assert topology.degrees() == {1: 2, 2: 1, 3: 1, 4: 1, 5: 1, 6: 0}
+    assert observations(topology.observe_links) == {(): 3}
+    assert sorted(map(sorted, topology.components())) == [[1, 2, 3], [4, 5], [6]]
+    assert observations(topology.observe_component_nodes) == {
+        (("component", 1),): 3,
+        (("component", 4),): 2,
+        (("component", 6),): 1,
+    }
+    assert topology.link_snr()[1] == (-5.0, 7.0 / 3, 7.0)
+    assert (
+        observations(topology.observe_link_snr)[(("source", 3), ("statistic", "max"))]
+        == -5.0
+    )
+
+    # Node 1 no longer hears node 3, node 2 still hears node 1
+    now[0] = 50
+    topology.update(1, [(2, 4.0)])
+    assert topology.degrees()[1] == 1
+    assert observations(topology.observe_links) == {(): 2}
+    assert sorted(map(sorted, topology.components())) == [[1, 2], [4, 5], [6]]
+
+    # Reports of nodes 2, 4 and 6 expire, node 1 still lists node 2
+    now[0] = 120
+    assert topology.degrees() == {1: 1, 2: 1}
+    assert observations(topology.observe_components) == {(): 1}
+
+    now[0] = 151
+    assert topology.degrees() == {}
+    assert observations(topology.observe_links) == {(): 0}
+    assert topology.components() == []
+
+
+def test_expired_topology_series_are_forgotten_by_the_sdk(mocker):
+    reader = InMemoryMetricReader()
+    provider = MeterProvider(metric_readers=[reader])
+    mocker.patch.object(
+        metrics,
+        "SERIES_EXPIRED_HOOKS",
+        [functools.partial(metrics.forget_sdk_series, provider)],
+    )
+    now = [0.0]
+    topology = TopologyIndex(ttl=100, timer=lambda: now[0])
+    provider.get_meter("test").create_observable_gauge(
+        "test_topology_node_degree",
+        callbacks=[
+            metrics.expire_unobserved(
+                "test_topology_node_degree", topology.observe_degree
+            )
+        ],
+    )
+
+    topology.update(1, [(2, 5.0)])
+    now[0] = 60
+    topology.update(3, [])
+    reader.get_metrics_data()
+    now[0] = 120
+    reader.get_metrics_data()
+
+    storage = next(iter(provider._measurement_consumer._reader_storages.values()))
+    (matches,) = storage._instrument_view_instrument_matches.values()
+    assert list(matches[0]._attributes_aggregation) == [
+        frozenset({"source": 3}.items())
+    ]